@@ -24,6 +24,9 @@ import re
 import sys
 import uuid
 import pwd
+import shutil
+import tempfile
+import subprocess
 import unittest
 import mock
 
@@ -46,6 +49,17 @@ except ImportError:
 STDOUT = sys.stdout
 DEVNULL = open("/dev/null", "w")
 UDOCKER = "udocker.py"
+STARTUP_MAX = float(os.getenv("UDOCKER_STARTUP_MAX", "0.25"))
+STARTUP_SCRIPT = """
+import sys, time
+sys.path.insert(0, sys.argv.pop(1))
+import udocker
+sys.argv = ["udocker", "--allow-root"] + sys.argv[1:]
+start = time.time()
+udocker.Main().start()
+sys.stderr.write("%f %s\\n" % (time.time() - start, " ".join(
+    [name for name in ("pycurl", "uuid") if name in sys.modules])))
+"""
 
 
 def set_env():
@@ -279,6 +293,54 @@ class FuncTestBasic(unittest.TestCase):
                " indigodatacloudapps/disvis")
 
 
+class FuncTestStartup(unittest.TestCase):
+    """Startup time of short commands, regression benchmark"""
+
+    def setUp(self):
+        """Setup test, empty repository with the tools installed"""
+        self.topdir = tempfile.mkdtemp()
+        os.makedirs(self.topdir + "/lib")
+        with open(self.topdir + "/lib/VERSION", "w") as filep:
+            filep.write(udocker.Config.tarball_release)
+
+    def tearDown(self):
+        """Cleanup test"""
+        shutil.rmtree(self.topdir)
+
+    def startup(self, t_argv, runs=5):
+        """Best time of runs executions of a command in a new process,
+        the time to load udocker.py is not included
+        """
+        env = dict(os.environ, UDOCKER_DIR=self.topdir)
+        srcdir = os.path.dirname(os.path.abspath(udocker.__file__))
+        best = None
+        for dummy in range(runs):
+            proc = subprocess.Popen(
+                [sys.executable, "-c", STARTUP_SCRIPT, srcdir] + t_argv,
+                stdout=DEVNULL, stderr=subprocess.PIPE, env=env)
+            (elapsed, loaded) = \
+                (proc.communicate()[1].strip().split('\n')[-1] + " ").split(
+                    ' ', 1)
+            self.assertEqual(loaded.strip(), "", str(t_argv))
+            if best is None or float(elapsed) < best:
+                best = float(elapsed)
+        return best
+
+    def test_01_ps(self):
+        """Test startup of the ps command"""
+        self.assertLess(self.startup(["ps"]), STARTUP_MAX)
+
+    def test_02_inspect(self):
+        """Test startup of the inspect -p command"""
+        self.assertLess(self.startup(["inspect", "-p", "noname"]),
+                        STARTUP_MAX)
+
+    def test_03_name(self):
+        """Test startup of the name command"""
+        self.assertLess(self.startup(["name", "noid", "noname"]),
+                        STARTUP_MAX)
+
+
 class FuncTestRepo(unittest.TestCase):
     """Test the local repository"""
 
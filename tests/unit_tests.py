@@ -23,8 +23,16 @@ import os
 import pwd
 import subprocess
 import sys
+import stat
+import struct
+import time
 import json
+import hashlib
 import unittest
+import tarfile
+import tempfile
+import shutil
+import io
 
 try:
     from StringIO import StringIO
@@ -62,6 +70,11 @@ def set_env():
         os.environ["HOME"] = os.getcwd()
 
 
+def passthrough(section, key, stamp, func):
+    """Replace HostInfo.cached() to always obtain the value."""
+    return func()
+
+
 def find_str(self, find_exp, where):
     """Find string in test output messages."""
     found = False
@@ -84,6 +97,90 @@ def is_writable_file(obj):
         return True
 
 
+def make_layer(tmpdir, filename, members, mode="w"):
+    """Create a layer tar file with (name, data, type, linkname)"""
+    layer_file = tmpdir + '/' + filename
+    tarf = tarfile.open(layer_file, mode)
+    for (name, data, ftype, linkname) in members:
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.type = ftype
+        tarinfo.linkname = linkname
+        if data is None:
+            tarf.addfile(tarinfo)
+        else:
+            tarinfo.size = len(data)
+            tarf.addfile(tarinfo, io.BytesIO(data))
+    tarf.close()
+    return layer_file
+
+
+def make_ld_cache(filename, libs):
+    """Create a glibc ld.so.cache in the new format with (soname, path)"""
+    strings = b""
+    entries = b""
+    strings_off = 48 + len(libs) * 24
+    for (soname, path) in libs:
+        key = strings_off + len(strings)
+        strings += soname + b"\0"
+        entries += struct.pack("=iIIIQ", 1, key, strings_off + len(strings),
+                               0, 0)
+        strings += path + b"\0"
+    header = b"glibc-ld.so.cache1.1" + struct.pack("=II", len(libs),
+                                                   len(strings))
+    with open(filename, "wb") as filep:
+        filep.write(header + b"\0" * (48 - len(header)) + entries + strings)
+    return filename
+
+
+def make_elf(filename, interp, rpath, needed=(), runpath=False):
+    """Create a minimal ELF64 executable with PT_INTERP, PT_DYNAMIC
+    with DT_NEEDED and RPATH (or RUNPATH) and one PT_NOTE
+    """
+    interp_off = 64 + 4 * 56
+    dynstr = b"\0" + b"".join([lib + b"\0" for lib in needed])
+    dyn_entries = [(1, dynstr.index(b"\0" + lib + b"\0") + 1)
+                   for lib in needed]
+    dyn_entries.append((29 if runpath else 15, len(dynstr)))
+    dynstr += rpath + b"\0"
+    dynstr_off = interp_off + len(interp) + 1
+    dyn_off = (dynstr_off + len(dynstr) + 7) // 8 * 8
+    dynamic = b"".join([struct.pack("<qQ", tag, val) for (tag, val) in [
+        (5, dynstr_off), (10, len(dynstr))] + dyn_entries + [(0, 0)]])
+    note_off = dyn_off + len(dynamic)
+    end = note_off + 16
+    data = b"\x7fELF\x02\x01\x01" + b"\0" * 9
+    data += struct.pack("<HHIQQQIHHHHHH", 2, 62, 1, 0, 64, 0, 0, 64, 56,
+                        4, 64, 0, 0)
+    for phdr in ((1, 5, 0, 0, end, end, 4096), (3, 4, interp_off,
+                                                 interp_off, len(interp) + 1,
+                                                 len(interp) + 1, 1),
+                 (2, 6, dyn_off, dyn_off, len(dynamic), len(dynamic), 8),
+                 (4, 4, note_off, note_off, 16, 16, 4)):
+        (p_type, p_flags, p_offset, p_vaddr, p_filesz, p_memsz, p_align) = \
+            phdr
+        data += struct.pack("<IIQQQQQQ", p_type, p_flags, p_offset, p_vaddr,
+                            p_vaddr, p_filesz, p_memsz, p_align)
+    data += interp + b"\0" + dynstr
+    data += b"\0" * (dyn_off - len(data)) + dynamic + b"\0" * 16
+    with open(filename, "wb") as filep:
+        filep.write(data)
+    return filename
+
+
+class LazyImportTestCase(unittest.TestCase):
+    """Test LazyImport() modules imported on first use."""
+
+    def test_01_getattr(self):
+        """Test01 LazyImport() import on attribute access."""
+        module = udocker.LazyImport("string")
+        self.assertEqual(module._module, None)
+        self.assertEqual(module.digits, "0123456789")
+        self.assertEqual(module._module.__name__, "string")
+        module = udocker.LazyImport("udocker_no_such_module")
+        with self.assertRaises(NameError):
+            dummy = module.attribute
+
+
 class ConfigTestCase(unittest.TestCase):
     """Test case for the udocker configuration."""
 
@@ -268,6 +365,38 @@ class UprocessTestCase(unittest.TestCase):
     #     pass
 
 
+class WorkerPoolTestCase(unittest.TestCase):
+    """Test WorkerPool() parallel execution of functions."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Setup test."""
+        set_env()
+
+    def test_01_init(self):
+        """Test01 WorkerPool()."""
+        self.assertEqual(udocker.WorkerPool(3).workers, 3)
+        self.assertEqual(udocker.WorkerPool(-1).workers, 1)
+        self.assertTrue(udocker.WorkerPool().workers >= 1)
+
+    def test_02_map(self):
+        """Test02 WorkerPool().map()."""
+        for workers in (1, 4):
+            wpool = udocker.WorkerPool(workers)
+            status = wpool.map(lambda x: x * x, range(10))
+            self.assertEqual(status, [x * x for x in range(10)])
+            status = wpool.map(lambda x: x, range(10),
+                               stop_on=lambda result: result == 0)
+            self.assertEqual(status[0], 0)
+            self.assertTrue(None in status)
+
+    def test_03_map_error(self):
+        """Test03 WorkerPool().map() exception in function."""
+        wpool = udocker.WorkerPool(4)
+        self.assertRaises(ZeroDivisionError, wpool.map,
+                          lambda x: 1 // x, [2, 1, 0, 3])
+
+
 class HostInfoTestCase(unittest.TestCase):
     """Test HostInfo() class."""
 
@@ -284,10 +413,12 @@ class HostInfoTestCase(unittest.TestCase):
         user = hinfo.username()
         self.assertEqual(user, pwd.getpwuid(os.getuid()).pw_name)
 
+    @mock.patch('udocker.HostInfo.cached', side_effect=passthrough)
     @mock.patch('udocker.HostInfo.__init__')
     @mock.patch('udocker.platform.architecture')
     @mock.patch('udocker.platform.machine')
-    def test_02_arch(self, mock_machine, mock_architecture, mock_hinfo):
+    def test_02_arch(self, mock_machine, mock_architecture, mock_hinfo,
+                     mock_cached):
         """Test02 HostInfo.arch()."""
         mock_hinfo.return_value = None
         mock_machine.return_value = "x86_64"
@@ -324,9 +455,10 @@ class HostInfoTestCase(unittest.TestCase):
         status = hinfo.arch()
         self.assertEqual(status, "arm64")
 
+    @mock.patch('udocker.HostInfo.cached', side_effect=passthrough)
     @mock.patch('udocker.HostInfo.__init__')
     @mock.patch('udocker.platform.system')
-    def test_03_osversion(self, mock_system, mock_hinfo):
+    def test_03_osversion(self, mock_system, mock_hinfo, mock_cached):
         """Test03 HostInfo.osversion()."""
         mock_hinfo.return_value = None
         mock_system.return_value = "Linux"
@@ -341,9 +473,11 @@ class HostInfoTestCase(unittest.TestCase):
         status = hinfo.osversion()
         self.assertEqual(status, "")
 
+    @mock.patch('udocker.HostInfo.cached', side_effect=passthrough)
     @mock.patch('udocker.HostInfo.__init__')
     @mock.patch('udocker.platform.linux_distribution')
-    def test_04_osdistribution(self, mock_distribution, mock_hinfo):
+    def test_04_osdistribution(self, mock_distribution, mock_hinfo,
+                                mock_cached):
         """Test04 HostInfo.osdistribution()."""
         mock_hinfo.return_value = None
         mock_distribution.return_value = ("DISTRO XX", "1.0", "DUMMY")
@@ -351,9 +485,10 @@ class HostInfoTestCase(unittest.TestCase):
         status = hinfo.osdistribution()
         self.assertEqual(status, ("DISTRO", "1"))
 
+    @mock.patch('udocker.HostInfo.cached', side_effect=passthrough)
     @mock.patch('udocker.HostInfo.__init__')
     @mock.patch('udocker.platform.release')
-    def test_05_oskernel(self, mock_release, mock_hinfo):
+    def test_05_oskernel(self, mock_release, mock_hinfo, mock_cached):
         """Test05 HostInfo.oskernel()."""
         mock_hinfo.return_value = None
         mock_release.return_value = "1.2.3"
@@ -387,14 +522,81 @@ class HostInfoTestCase(unittest.TestCase):
         status = hinfo.oskernel_isgreater([1, 1, 1])
         self.assertFalse(status)
 
-    # def test_07_cmd_has_option(self):
-    #     """Test07 HostInfo.cmd_has_option()."""
-    #     pass
+    @mock.patch('udocker.Config')
+    @mock.patch('udocker.Uprocess')
+    def test_07_cmd_has_option(self, mock_uproc, mock_config):
+        """Test07 HostInfo.cmd_has_option() help output is cached."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            mock_config.topdir = tmpdir
+            mock_config.host_cache = "host.cache"
+            udocker.HostInfo._cache = None
+            executable = tmpdir + "/tar"
+            open(executable, "w").close()
+            mock_uproc.return_value.get_output.return_value = \
+                "usage: tar [--wildcards] [-x]\n --verbose, -v"
+            hinfo = udocker.HostInfo()
+            self.assertTrue(hinfo.cmd_has_option(executable, "--wildcards"))
+            self.assertFalse(hinfo.cmd_has_option(executable, "--nowild"))
+            self.assertTrue(hinfo.cmd_has_option(executable, "-v"))
+            mock_uproc.return_value.get_output.assert_called_once_with(
+                [executable, "--help"])
+            udocker.HostInfo._cache = None
+            self.assertTrue(hinfo.cmd_has_option(executable, "--verbose"))
+            self.assertEqual(mock_uproc.return_value.get_output.call_count, 1)
+            os.utime(executable, (0, 0))
+            mock_uproc.return_value.get_output.return_value = ""
+            self.assertFalse(hinfo.cmd_has_option(executable, "--verbose"))
+            self.assertEqual(mock_uproc.return_value.get_output.call_count, 2)
+            with open(tmpdir + "/host.cache") as filep:
+                cache = json.load(filep)
+            self.assertEqual(cache["host"], list(os.uname()[2:]))
+            mock_config.topdir = mock.MagicMock()
+            self.assertEqual(hinfo._cache_file(), "")
+        finally:
+            udocker.HostInfo._cache = None
+            shutil.rmtree(tmpdir)
 
     # def test_08_termsize(self):
     #     """Test08 HostInfo.termsize()."""
     #     pass
 
+    @mock.patch('udocker.os.sysconf')
+    def test_09_cpu_count(self, mock_sysconf):
+        """Test09 HostInfo.cpu_count()."""
+        hinfo = udocker.HostInfo()
+        self.assertTrue(hinfo.cpu_count() >= 1)
+        if not hasattr(os, "sched_getaffinity"):
+            mock_sysconf.return_value = 4
+            self.assertEqual(hinfo.cpu_count(), 4)
+            mock_sysconf.side_effect = ValueError("fail")
+            self.assertEqual(hinfo.cpu_count(), 1)
+
+    @mock.patch('udocker.Config')
+    def test_10_cached(self, mock_config):
+        """Test10 HostInfo.cached() without a real topdir."""
+        tmpdir = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        try:
+            os.chdir(tmpdir)
+            mock_config.host_cache = "host.cache"
+            func = mock.Mock(return_value="value")
+            hinfo = udocker.HostInfo()
+            for topdir in (None, "", tmpdir + "/none", mock.MagicMock()):
+                udocker.HostInfo._cache = None
+                mock_config.topdir = topdir
+                with mock.patch('udocker.os.path.isdir',
+                                return_value=not isinstance(topdir, str)), \
+                        mock.patch('udocker.os.rename'):
+                    self.assertEqual(
+                        hinfo.cached("section", "key", 1, func), "value")
+                self.assertEqual(os.listdir(tmpdir), [])
+            self.assertEqual(func.call_count, 4)
+        finally:
+            os.chdir(cwd)
+            udocker.HostInfo._cache = None
+            shutil.rmtree(tmpdir)
+
 
 class GuestInfoTestCase(unittest.TestCase):
     """Test GuestInfo() class."""
@@ -420,21 +622,37 @@ class GuestInfoTestCase(unittest.TestCase):
         self.assertEqual(ginfo._root_dir, self.rootdir)
 
     @mock.patch('udocker.Uprocess.get_output')
-    @mock.patch('udocker.os.path.isfile')
-    def test_02_get_filetype(self, mock_isfile, mock_getout):
+    def test_02_get_filetype(self, mock_getout):
         """Test02 GuestInfo.get_filetype(filename)"""
         self._init()
-        # full filepath exists
-        mock_isfile.return_value = True
-        mock_getout.return_value = self.ftype
-        ginfo = udocker.GuestInfo(self.rootdir)
-        self.assertEqual(ginfo.get_filetype(self.file), self.ftype)
-
-        # file does not exist
-        mock_isfile.return_value = False
-        mock_getout.return_value = self.nofile
-        ginfo = udocker.GuestInfo(self.rootdir)
-        self.assertEqual(ginfo.get_filetype(self.nofile), "")
+        tmpdir = tempfile.mkdtemp()
+        try:
+            root = tmpdir + "/ROOT"
+            os.makedirs(root + "/bin")
+            make_elf(root + "/bin/ls", b"/lib64/ld-linux-x86-64.so.2",
+                     b"/usr/lib")
+            os.symlink("ls", root + "/bin/dir")
+            with open(root + "/bin/script", "w") as filep:
+                filep.write("#!/usr/bin/env python\nprint(1)\n")
+            with open(root + "/layer.gz", "wb") as filep:
+                filep.write(b"\x1f\x8b\x08\x00")
+            make_layer(root, "layer.tar",
+                       [("etc/hostname", b"h", tarfile.REGTYPE, "")])
+            ginfo = udocker.GuestInfo(root)
+            self.assertTrue(ginfo.get_filetype("/bin/dir").endswith(
+                "/bin/ls: ELF 64-bit LSB executable, x86-64, "
+                "version 1 (SYSV), dynamically linked, interpreter "
+                "/lib64/ld-linux-x86-64.so.2"))
+            self.assertTrue(ginfo.get_filetype("/bin/script").endswith(
+                "/bin/script: a /usr/bin/env python script, ASCII text"))
+            self.assertIn("gzip compressed data",
+                          ginfo.get_filetype("/layer.gz"))
+            self.assertIn("POSIX tar archive",
+                          ginfo.get_filetype("/layer.tar"))
+            self.assertEqual(ginfo.get_filetype(self.nofile), "")
+            self.assertFalse(mock_getout.called)
+        finally:
+            shutil.rmtree(tmpdir)
 
     @mock.patch('udocker.GuestInfo.get_filetype')
     def test_03_arch(self, mock_getftype):
@@ -853,8 +1071,13 @@ class ChkSUMTestCase(unittest.TestCase):
     #     """Test09 ChkSUM().sha512()."""
     #     pass
 
-    def test_10_hash(self):
+    @mock.patch.object(udocker.ChkSUM, '_cache_put')
+    @mock.patch.object(udocker.ChkSUM, '_cache_get')
+    @mock.patch.object(udocker.ChkSUM, '_cache_key')
+    def test_10_hash(self, mock_key, mock_get, mock_put):
         """Test10 ChkSUM().hash()."""
+        mock_key.return_value = "KEY"
+        mock_get.return_value = ""
         sha256sum = (
             "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855")
         cksum = udocker.ChkSUM()
@@ -875,6 +1098,120 @@ class ChkSUMTestCase(unittest.TestCase):
                 lambda self: iter(file_data.readline, ''))
             status = cksum.hash("filename", "sha512")
             self.assertEqual(status, sha512sum)
+        mock_put.assert_called_with("filename", "sha512", "KEY", sha512sum)
+
+        mock_put.reset_mock()
+        mock_get.return_value = "CACHED"
+        self.assertEqual(cksum.hash("filename", "sha256"), "CACHED")
+        self.assertFalse(mock_put.called)
+
+        mock_key.return_value = ""
+        self.assertEqual(cksum.hash("filename", "sha256"), "")
+
+    @mock.patch('udocker.os.setxattr', create=True)
+    @mock.patch('udocker.os.getxattr', create=True)
+    def test_11_hash_cache(self, mock_getxattr, mock_setxattr):
+        """Test11 ChkSUM().hash() digest cache in sidecar file."""
+        mock_getxattr.side_effect = OSError("not supported")
+        mock_setxattr.side_effect = OSError("not supported")
+        tmpdir = tempfile.mkdtemp()
+        saved = (udocker.ChkSUM.cache_file, udocker.ChkSUM.cache_dir,
+                 udocker.ChkSUM._cache)
+        try:
+            udocker.ChkSUM.cache_file = tmpdir + "/digests"
+            udocker.ChkSUM.cache_dir = os.path.realpath(tmpdir + "/layers")
+            udocker.ChkSUM._cache = None
+            os.mkdir(tmpdir + "/layers")
+            userfile = tmpdir + "/userfile"
+            with open(userfile, "wb") as filep:
+                filep.write(b"qwerty")
+            sha256sum = hashlib.sha256(b"qwerty").hexdigest()
+            self.assertEqual(udocker.ChkSUM().hash(userfile, "sha256"),
+                             sha256sum)
+            self.assertFalse(os.path.exists(tmpdir + "/digests"))
+            self.assertFalse(mock_setxattr.called)
+            filename = tmpdir + "/layers/file"
+            with open(filename, "wb") as filep:
+                filep.write(b"qwerty")
+            sha256sum = hashlib.sha256(b"qwerty").hexdigest()
+            self.assertEqual(udocker.ChkSUM().hash(filename, "sha256"),
+                             sha256sum)
+            self.assertTrue(os.path.exists(tmpdir + "/digests"))
+            udocker.ChkSUM._cache = None
+            cksum = udocker.ChkSUM()
+            cksum._algorithms["sha256"] = mock.Mock(return_value="NEW")
+            self.assertEqual(cksum.hash(filename, "sha256"), sha256sum)
+            self.assertFalse(cksum._algorithms["sha256"].called)
+            os.utime(filename, (1, 1))
+            self.assertEqual(cksum.hash(filename, "sha256"), "NEW")
+            with open(tmpdir + "/digests") as filep:
+                cache = json.load(filep)
+            cache["OTHER:sha256"] = "FROM_OTHER_PROCESS"
+            with open(tmpdir + "/digests", "w") as filep:
+                json.dump(cache, filep)
+            os.utime(filename, (2, 2))
+            self.assertEqual(cksum.hash(filename, "sha256"), "NEW")
+            with open(tmpdir + "/digests") as filep:
+                cache = json.load(filep)
+            self.assertEqual(cache["OTHER:sha256"], "FROM_OTHER_PROCESS")
+            self.assertEqual(len(cache), 4)
+        finally:
+            (udocker.ChkSUM.cache_file, udocker.ChkSUM.cache_dir,
+             udocker.ChkSUM._cache) = saved
+            shutil.rmtree(tmpdir)
+
+    @mock.patch.object(udocker.ChkSUM, 'hash')
+    def test_12_hash_many(self, mock_hash):
+        """Test12 ChkSUM().hash_many()."""
+        mock_hash.side_effect = lambda filename, algorithm: (
+            "" if filename == "F3" else filename + algorithm)
+        status = udocker.ChkSUM().hash_many(["F1", "F2", "F3"], "sha256", 2)
+        self.assertEqual(status, {"F1": "F1sha256", "F2": "F2sha256",
+                                  "F3": ""})
+        self.assertEqual(udocker.ChkSUM().hash_many([], "sha256"), {})
+
+
+class FileLockTestCase(unittest.TestCase):
+    """Test FileLock() locks shared by processes and threads."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Setup test."""
+        set_env()
+
+    def test_01_acquire(self):
+        """Test01 FileLock().acquire() and release()."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            lockfile = tmpdir + "/file.lock"
+            with udocker.FileLock(lockfile) as flock:
+                self.assertTrue(os.path.exists(lockfile))
+                self.assertTrue(flock._filep)
+                self.assertFalse(
+                    udocker.FileLock(lockfile)._thread_lock.acquire(False))
+            self.assertEqual(flock._filep, None)
+            self.assertTrue(udocker.FileLock(lockfile).acquire())
+            udocker.FileLock(lockfile).release()
+            flock = udocker.FileLock(tmpdir + "/nodir/file.lock")
+            self.assertFalse(flock.acquire())
+            flock.release()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_02_threads(self):
+        """Test02 FileLock() serializes threads."""
+        tmpdir = tempfile.mkdtemp()
+        inside = []
+        def _locked(arg):
+            with udocker.FileLock(tmpdir + "/file.lock"):
+                inside.append(arg)
+                time.sleep(0.01)
+                return len(inside) - inside.index(arg)
+        try:
+            results = udocker.WorkerPool(4).map(_locked, range(8))
+            self.assertEqual(results, [1] * 8)
+        finally:
+            shutil.rmtree(tmpdir)
 
 
 class FileUtilTestCase(unittest.TestCase):
@@ -1199,6 +1536,28 @@ class FileUtilTestCase(unittest.TestCase):
         size = udocker.FileUtil("somefile").size()
         self.assertEqual(size, 4321)
 
+    def test_22_disk_usage(self):
+        """Test22 FileUtil.disk_usage() space used by a tree."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with open(tmpdir + "/file", "wb") as filep:
+                filep.write(b"x" * 8192)
+            os.symlink("file", tmpdir + "/link")
+            os.makedirs(tmpdir + "/d1/d2/d3/d4")
+            with open(tmpdir + "/d1/d2/d3/d4/file", "wb") as filep:
+                filep.write(b"x" * 8192)
+            blocks = [os.lstat(tmpdir + name).st_blocks * 512
+                      for name in ("", "/file", "/link", "/d1", "/d1/d2",
+                                   "/d1/d2/d3", "/d1/d2/d3/d4",
+                                   "/d1/d2/d3/d4/file")]
+            self.assertEqual(udocker.FileUtil(tmpdir).disk_usage(),
+                             sum(blocks))
+            self.assertEqual(udocker.FileUtil(tmpdir + "/file").disk_usage(),
+                             blocks[1])
+            self.assertEqual(udocker.FileUtil(tmpdir + "/x").disk_usage(), -1)
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_23_getdata(self):
         """Test23 FileUtil.getdata() get file content."""
         with mock.patch(BUILTINS + '.open',
@@ -1223,9 +1582,23 @@ class FileUtilTestCase(unittest.TestCase):
         data = futil.putdata("qwerty")
         self.assertFalse(data)
 
-        with mock.patch(BUILTINS + '.open', mock.mock_open()):
-            data = udocker.FileUtil("somefile").putdata("qwerty")
-            self.assertEqual(data, 'qwerty')
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.assertFalse(udocker.FileUtil(tmpdir + "/file").putdata(
+                None, "w"))
+            self.assertEqual(os.listdir(tmpdir), [])
+            filename = tmpdir + "/file"
+            self.assertEqual(
+                udocker.FileUtil(filename).putdata("qwerty", "w"), "qwerty")
+            os.chmod(filename, 0o750)
+            udocker.FileUtil(filename).putdata("asdf", "w")
+            udocker.FileUtil(filename).putdata("gh", "a")
+            with open(filename) as filep:
+                self.assertEqual(filep.read(), "asdfgh")
+            self.assertEqual(stat.S_IMODE(os.stat(filename).st_mode), 0o750)
+            self.assertEqual(os.listdir(tmpdir), ["file"])
+        finally:
+            shutil.rmtree(tmpdir)
 
     @mock.patch('udocker.os.path.exists')
     def test_26_getvalid_path(self, mock_pexist):
@@ -1239,8 +1612,9 @@ class FileUtilTestCase(unittest.TestCase):
     #     """Test27 FileUtil._find_exec()."""
     #     pass
 
+    @mock.patch('udocker.HostInfo.cached', side_effect=passthrough)
     @mock.patch('udocker.Uprocess')
-    def test_28_find_exec(self, mock_call):
+    def test_28_find_exec(self, mock_call, mock_cached):
         """Test28 FileUtil.find_exec() find executable."""
         mock_call.return_value.get_output.return_value = None
         filename = udocker.FileUtil("executable").find_exec()
@@ -1552,6 +1926,15 @@ class FileUtilTestCase(unittest.TestCase):
         self.assertFalse(mock_link_set.called)
         # self.assertTrue(mock_link_restore.called)
 
+        mock_walk.reset_mock()
+        mock_link_set.reset_mock()
+        mock_lstat.return_value.st_uid = udocker.HostInfo.uid
+        mock_link_set.return_value = True
+        status = udocker.FileUtil("/ROOT").links_conv(False, True, "",
+                                                      ["/ROOT/L1"])
+        self.assertFalse(mock_walk.called)
+        self.assertEqual(status, ["/ROOT/L1"])
+
     @mock.patch('udocker.os.listdir')
     @mock.patch('udocker.os.path.isdir')
     @mock.patch('udocker.os.path.basename')
@@ -1910,6 +2293,183 @@ class UdockerToolsTestCase(unittest.TestCase):
         self.assertTrue(status)
 
 
+class ElfFileTestCase(unittest.TestCase):
+    """Test ElfFile() changes to the interpreter and rpath."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Setup test."""
+        set_env()
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_01_get_dynamic_info(self):
+        """Test01 ElfFile().get_dynamic_info()."""
+        elf_file = make_elf(self.tmpdir + "/exe", b"/lib64/ld.so",
+                            b"/opt/lib:$ORIGIN")
+        info = udocker.ElfFile(elf_file).get_dynamic_info()
+        self.assertEqual(info, {"interp": b"/lib64/ld.so",
+                                "rpath": [b"/opt/lib:$ORIGIN"],
+                                "runpath": [],
+                                "needed": [], "class": 2, "machine": 62})
+        with open(self.tmpdir + "/script", "w") as filep:
+            filep.write("#!/bin/sh\n")
+        self.assertEqual(
+            udocker.ElfFile(self.tmpdir + "/script").get_dynamic_info(), None)
+
+    def test_02_root_prefix(self):
+        """Test02 ElfFile().root_prefix() set and restore."""
+        elf_file = make_elf(self.tmpdir + "/exe", b"/lib64/ld.so",
+                            b"/opt/lib:$ORIGIN")
+        os.chmod(elf_file, 0o555)
+        with open(elf_file, "rb") as filep:
+            orig_size = len(filep.read())
+        prefix = "/home/user/.udocker/containers/ID/ROOT"
+        self.assertTrue(udocker.ElfFile(elf_file).root_prefix(prefix))
+        info = udocker.ElfFile(elf_file).get_dynamic_info()
+        self.assertEqual(info["interp"], prefix.encode() + b"/lib64/ld.so")
+        self.assertEqual(info["rpath"],
+                         [prefix.encode() + b"/opt/lib:$ORIGIN"])
+        self.assertEqual(stat.S_IMODE(os.stat(elf_file).st_mode), 0o555)
+        with open(elf_file, "rb") as filep:
+            size = len(filep.read())
+        self.assertTrue(size > orig_size)
+        self.assertTrue(udocker.ElfFile(elf_file).root_prefix(prefix))
+        self.assertTrue(udocker.ElfFile(elf_file).root_prefix(prefix, True))
+        info = udocker.ElfFile(elf_file).get_dynamic_info()
+        self.assertEqual(info, {"interp": b"/lib64/ld.so",
+                                "rpath": [b"/opt/lib:$ORIGIN"],
+                                "runpath": [],
+                                "needed": [], "class": 2, "machine": 62})
+        self.assertTrue(udocker.ElfFile(elf_file).root_prefix(prefix))
+        with open(elf_file, "rb") as filep:
+            self.assertEqual(len(filep.read()), size)
+        self.assertEqual(udocker.ElfFile(elf_file).root_prefix(
+            prefix + "/longer/path/than/before"), None)
+        self.assertFalse(udocker.ElfFile(self.tmpdir).root_prefix(prefix))
+
+    def test_03_root_prefix_padded(self):
+        """Test03 ElfFile().root_prefix() padded over unpadded prefix."""
+        elf_file = self.tmpdir + "/ls"
+        shutil.copy("/bin/ls", elf_file)
+        orig = udocker.ElfFile(elf_file).get_dynamic_info()
+        if not (orig and orig["interp"]):
+            self.skipTest("/bin/ls is not a dynamic ELF executable")
+        container_dir = "/home/u/.udocker/containers/ID"
+        legacy = container_dir + "/ROOT"
+        padded = udocker.ElfPatcher._patch_root(container_dir)
+        self.assertTrue(udocker.ElfFile(elf_file).root_prefix(legacy))
+        self.assertEqual(
+            udocker.ElfFile(elf_file).get_dynamic_info()["interp"],
+            legacy.encode() + orig["interp"])
+        self.assertTrue(udocker.ElfFile(elf_file).root_prefix(padded))
+        self.assertEqual(
+            udocker.ElfFile(elf_file).get_dynamic_info()["interp"],
+            padded.encode() + orig["interp"])
+        self.assertTrue(udocker.ElfFile(elf_file).root_prefix(padded))
+        self.assertEqual(
+            udocker.ElfFile(elf_file).get_dynamic_info()["interp"],
+            padded.encode() + orig["interp"])
+        self.assertTrue(udocker.ElfFile(elf_file).root_prefix(padded, True))
+        self.assertEqual(udocker.ElfFile(elf_file).get_dynamic_info(), orig)
+        self.assertTrue(udocker.ElfFile(elf_file).root_prefix(legacy))
+        self.assertTrue(udocker.ElfFile(elf_file).root_prefix(padded, True))
+        self.assertEqual(udocker.ElfFile(elf_file).get_dynamic_info(), orig)
+
+    def test_04_root_prefix_rename(self):
+        """Test04 ElfFile().root_prefix() replaces the file by a copy."""
+        elf_file = make_elf(self.tmpdir + "/exe", b"/lib64/ld.so",
+                            b"/opt/lib")
+        os.chmod(elf_file, 0o555)
+        prefix = "/home/user/.udocker/containers/ID/ROOT"
+        inode = os.stat(elf_file).st_ino
+        self.assertTrue(udocker.ElfFile(elf_file).root_prefix(prefix))
+        self.assertNotEqual(os.stat(elf_file).st_ino, inode)
+        self.assertEqual(stat.S_IMODE(os.stat(elf_file).st_mode), 0o555)
+        self.assertEqual(os.listdir(self.tmpdir), ["exe"])
+        inode = os.stat(elf_file).st_ino
+        self.assertTrue(udocker.ElfFile(elf_file).root_prefix(prefix))
+        self.assertEqual(os.stat(elf_file).st_ino, inode)
+        with mock.patch('udocker.os.rename', side_effect=OSError):
+            self.assertEqual(udocker.ElfFile(elf_file).root_prefix(
+                prefix, True), None)
+        self.assertEqual(os.listdir(self.tmpdir), ["exe"])
+        self.assertEqual(
+            udocker.ElfFile(elf_file).get_dynamic_info()["interp"],
+            prefix.encode() + b"/lib64/ld.so")
+
+
+class ContainerIndexTestCase(unittest.TestCase):
+    """Test ContainerIndex() classification of the container files."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Setup test."""
+        set_env()
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = self.tmpdir + "/ROOT"
+        os.makedirs(self.root + "/usr/bin")
+        os.makedirs(self.root + "/usr/lib")
+        make_elf(self.root + "/usr/bin/prog", b"/lib64/ld.so", b"/usr/lib")
+        with open(self.root + "/usr/bin/script", "w") as filep:
+            filep.write("#!/bin/sh\n")
+        open(self.root + "/usr/lib/README", "w").close()
+        os.symlink("usr/bin", self.root + "/bin")
+        os.symlink("/usr/bin/prog", self.root + "/usr/lib/prog")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_01_entries(self):
+        """Test01 ContainerIndex().entries() and links()."""
+        cindex = udocker.ContainerIndex(self.tmpdir)
+        entries = [entry[:3] for entry in cindex.entries()]
+        self.assertEqual(entries, [
+            (self.root, "bin", 'l'),
+            (self.root + "/usr/bin", "prog", 'e'),
+            (self.root + "/usr/bin", "script", 's'),
+            (self.root + "/usr/lib", "README", 'f'),
+            (self.root + "/usr/lib", "prog", 'l'), ])
+        self.assertEqual(cindex.links(),
+                         [self.root + "/bin", self.root + "/usr/lib/prog"])
+        self.assertTrue(os.path.exists(self.tmpdir + "/files.index"))
+
+    def test_02_refresh(self):
+        """Test02 ContainerIndex().refresh() reads changed dirs only."""
+        udocker.ContainerIndex(self.tmpdir).refresh()
+        os.remove(self.root + "/usr/lib/README")
+        past = time.time() - 100
+        os.utime(self.root + "/usr/lib", (past, past))
+        cindex = udocker.ContainerIndex(self.tmpdir)
+        with mock.patch.object(udocker.ContainerIndex, '_scan_dir',
+                               wraps=cindex._scan_dir) as mock_scan:
+            dirs = cindex.refresh()
+            mock_scan.assert_called_once_with("/usr/lib")
+        self.assertEqual(dirs["/usr/lib"][2][0][:2], ["prog", 'l'])
+        self.assertEqual(sorted(dirs.keys()), ["", "/usr", "/usr/bin",
+                                               "/usr/lib"])
+
+    def test_03_refresh_rebuild(self):
+        """Test03 ContainerIndex().refresh() rebuild sees chmod."""
+        cindex = udocker.ContainerIndex(self.tmpdir)
+        cindex.refresh()
+        mode = os.stat(self.root + "/usr/bin/script").st_mode & 0o777
+        os.chmod(self.root + "/usr/bin/script", 0o700)
+        dirs = cindex.refresh()
+        self.assertEqual(dirs["/usr/bin"][2][1][2] & 0o777, mode)
+        cindex.refresh(rebuild=True)
+        cindex = udocker.ContainerIndex(self.tmpdir)
+        modes = dict([(entry[1], entry[3] & 0o777)
+                      for entry in cindex.entries()])
+        self.assertEqual(modes["script"], 0o700)
+
+
 class ElfPatcherTestCase(unittest.TestCase):
     """Test ElfPatcher: Patch container executables."""
 
@@ -1963,39 +2523,35 @@ class ElfPatcherTestCase(unittest.TestCase):
         status = elfp._replace(cmd, path)
         self.assertEqual(status, ["/bin/ls", "-al"])
 
-    @mock.patch('udocker.os.path.islink')
-    @mock.patch('udocker.os.path.stat')
-    @mock.patch('udocker.os.path')
-    @mock.patch('udocker.os.walk')
-    @mock.patch('udocker.os.access')
-    @mock.patch('udocker.LocalRepository')
-    def test_04__walk_fs(self, mock_local, mock_access, mock_walk,
-                         mock_path, mock_stat, mock_islink):
-        """Test04 ElfPatcher()._walk_fs()."""
-        container_id = "SOME-RANDOM-ID"
-        mock_walk.return_value = [('/tmp', ('dir',), ('file',)), ]
-        mock_islink.return_value = False
-        mock_stat.return_value.st_uid = ""
-        elfp = udocker.ElfPatcher(mock_local, container_id)
-        status = elfp._walk_fs("cmd", "/tmp", elfp.BIN)
-        self.assertFalse(status)
-
-    @mock.patch('udocker.os.path')
+    @mock.patch('udocker.ElfFile')
+    @mock.patch('udocker.ContainerIndex')
     @mock.patch('udocker.LocalRepository')
-    @mock.patch('udocker.ElfPatcher._walk_fs')
-    @mock.patch('udocker.ElfPatcher.select_patchelf')
-    def test_05_guess_elf_loader(self, mock_spelf, mock_walk,
-                                 mock_local, mock_path):
+    def test_05_guess_elf_loader(self, mock_local, mock_index, mock_elffile):
         """Test05 ElfPatcher().guess_elf_loader()."""
-        container_id = "SOME-RANDOM-ID"
-        mock_spelf.return_value = "ld.so"
-        mock_walk.return_value = ""
-        elfp = udocker.ElfPatcher(mock_local, container_id)
+        mock_local.cd_container.return_value = "/C"
+        elfp = udocker.ElfPatcher(mock_local, "SOME-RANDOM-ID")
+        mock_index.return_value.entries.return_value = []
         self.assertEqual(elfp.guess_elf_loader(), "")
 
-        mock_walk.return_value = "ld.so"
-        elfp = udocker.ElfPatcher(mock_local, container_id)
-        self.assertEqual(elfp.guess_elf_loader(), "ld.so")
+        uid = elfp._uid
+        mock_index.return_value.entries.side_effect = lambda: iter([
+            ("/C/ROOT/etc", "conf", 'f', 0o755, uid),
+            ("/C/ROOT/usr/bin", "other", 'e', 0o755, uid + 1),
+            ("/C/ROOT/usr/bin", "ls", 'e', 0o755, uid),
+            ("/C/ROOT/usr/bin", "sh", 'e', 0o755, uid), ])
+        interps = {"/C/ROOT/usr/bin/ls": b"/lib64/ld-linux-x86-64.so.2"}
+        mock_elffile.side_effect = lambda f_path: mock.Mock(
+            get_dynamic_info=mock.Mock(
+                return_value={"interp": interps.get(f_path)}))
+        stats = {"/C/ROOT/usr/bin/other": (0o755, uid + 1),
+                 "/C/ROOT/usr/bin/ls": (0o755, uid),
+                 "/C/ROOT/usr/bin/sh": (0o644, uid)}   # chmod after index
+        with mock.patch('udocker.os.lstat') as mock_lstat:
+            mock_lstat.side_effect = lambda f_path: mock.Mock(
+                st_mode=stats[f_path][0], st_uid=stats[f_path][1])
+            self.assertEqual(elfp.guess_elf_loader(),
+                             "/lib64/ld-linux-x86-64.so.2")
+        mock_elffile.assert_called_once_with("/C/ROOT/usr/bin/ls")
 
     @mock.patch('udocker.os.path')
     @mock.patch('udocker.os.path.exists')
@@ -2174,25 +2730,48 @@ class ElfPatcherTestCase(unittest.TestCase):
         elfp = udocker.ElfPatcher(mock_local, container_id)
         self.assertTrue(elfp.restore_ld())
 
-    @mock.patch('udocker.os.path')
-    @mock.patch('udocker.os.path.exists')
+    @mock.patch('udocker.Config')
     @mock.patch('udocker.LocalRepository')
-    @mock.patch('udocker.Uprocess.get_output')
-    def test_15__get_ld_config(self, mock_upout,
-                               mock_local, mock_exists, mock_path):
-        """Test15 ElfPatcher()._get_ld_config()."""
-        container_id = "SOME-RANDOM-ID"
-        mock_upout.return_value = []
-        elfp = udocker.ElfPatcher(mock_local, container_id)
-        status = elfp._get_ld_config()
-        self.assertEqual(status, [])
-
-        mock_upout.return_value = \
-            "ld.so.cache => /tmp/ROOT/etc/ld.so.cache\n" \
-            "ld.so.cache => /tmp/ROOT/etc/ld.so"
-        elfp = udocker.ElfPatcher(mock_local, container_id)
-        status = elfp._get_ld_config()
-        self.assertIsInstance(status, list)
+    def test_15__get_ld_config(self, mock_local, mock_config):
+        """Test15 ElfPatcher()._get_ld_config(). Parse ld.so.cache"""
+        mock_config.ld_so_cache = "/etc/ld.so.cache"
+        mock_config.patch_root_len = 256
+        libs = [b"/lib64/libc.so.6", b"/usr/lib64/libz.so.1",
+                b"/lib64/libm.so.6"]
+        strings = b"".join([lib + b"\0" for lib in libs])
+        offsets = [strings.index(lib) for lib in libs]
+        new_hdr = b"glibc-ld.so.cache1.1" + struct.pack("=II", 3, len(strings))
+        new_hdr += b"\0" * (48 - len(new_hdr))
+        new_cache = new_hdr + b"".join(
+            [struct.pack("=iIIIQ", 1, 0, 48 + 3 * 24 + off, 0, 0)
+             for off in offsets]) + strings
+        old_cache = b"ld.so-1.7.0\0" + struct.pack("=I", 3) + b"".join(
+            [struct.pack("=iII", 1, 0, off) for off in offsets]) + strings
+        saved = dict()
+        mock_local.load_json.side_effect = saved.get
+        mock_local.save_json.side_effect = (
+            lambda filename, data: saved.update({filename: data}) or True)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            mock_local.cd_container.return_value = tmpdir
+            elfp = udocker.ElfPatcher(mock_local, "ID")
+            root = elfp._container_root
+            self.assertEqual(elfp._get_ld_config(), [])
+            os.makedirs(root + "/etc")
+            for cache in (new_cache, old_cache):
+                saved.clear()
+                with open(root + "/etc/ld.so.cache", "wb") as filep:
+                    filep.write(cache)
+                self.assertEqual(elfp._get_ld_config(),
+                                 [root + "/lib64", root + "/usr/lib64"])
+            with mock.patch.object(udocker.ElfPatcher,
+                                   '_ld_cache_libs') as mock_libs:
+                self.assertEqual(elfp._get_ld_config(),
+                                 [root + "/lib64", root + "/usr/lib64"])
+                self.assertFalse(mock_libs.called)
+            self.assertEqual(udocker.ElfPatcher._ld_cache_libs(b"junk"), [])
+        finally:
+            shutil.rmtree(tmpdir)
 
     @mock.patch('udocker.os.path.realpath')
     @mock.patch('udocker.os.path')
@@ -2258,6 +2837,311 @@ class ElfPatcherTestCase(unittest.TestCase):
         status = elfp.get_ld_library_path()
         self.assertEqual(status, '/lib:/usr/lib:')
 
+    @mock.patch('udocker.LocalRepository')
+    def test_19__scan_container(self, mock_local):
+        """Test19 ElfPatcher()._scan_container(). Single walk"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            mock_local.cd_container.return_value = tmpdir
+            root = os.path.realpath(tmpdir) + "/ROOT"
+            os.makedirs(root + "/usr/lib")
+            os.makedirs(root + "/bin")
+            for f_name in ("/usr/lib/libc.so.6", "/bin/ls"):
+                with open(root + f_name, "wb") as filep:
+                    filep.write(b"\x7fELF")
+            open(root + "/bin/README", "w").close()
+            open(root + "/bin/script", "w").close()
+            os.chmod(root + "/bin/ls", 0o755)
+            os.chmod(root + "/bin/script", 0o755)
+            os.symlink("/usr/lib", root + "/lib")
+            os.symlink("libc.so.6", root + "/usr/lib/libc.so")
+            elfp = udocker.ElfPatcher(mock_local, "ID")
+            elfp._uid = os.getuid()
+            (links, lib_files, patch_list) = elfp._scan_container()
+            self.assertEqual(sorted(links),
+                             [root + "/lib", root + "/usr/lib/libc.so"])
+            self.assertEqual(sorted(lib_files),
+                             [(root + "/usr/lib", root + "/usr/lib/libc.so"),
+                              (root + "/usr/lib", root + "/usr/lib/libc.so.6")])
+            self.assertEqual(sorted(patch_list),
+                             [root + "/bin/ls", root + "/usr/lib/libc.so.6"])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    @mock.patch('udocker.Config')
+    @mock.patch('udocker.Uprocess')
+    @mock.patch('udocker.FileUtil')
+    @mock.patch.object(udocker.ElfPatcher, '_patch_done')
+    @mock.patch.object(udocker.ElfPatcher, 'get_container_loader')
+    @mock.patch.object(udocker.ElfPatcher, 'select_patchelf')
+    @mock.patch.object(udocker.ElfPatcher, 'patch_ld')
+    @mock.patch.object(udocker.ElfPatcher, '_scan_container')
+    @mock.patch.object(udocker.ElfPatcher, 'check_container_path')
+    @mock.patch('udocker.os.path')
+    @mock.patch('udocker.LocalRepository')
+    def test_20_patch_container(self, mock_local, mock_path, mock_chkpath,
+                                mock_scan, mock_patchld, mock_select,
+                                mock_gcl, mock_done, mock_futil, mock_uproc,
+                                mock_config):
+        """Test20 ElfPatcher().patch_container(). F3 setup in one walk"""
+        mock_config.patch_root_len = 256
+        mock_chkpath.return_value = True
+        mock_scan.return_value = (["/R/lib"], [("/R/usr/lib", "/R/usr/lib/libc.so")],
+                                  ["/R/bin/ls", "/R/usr/lib/libc.so"])
+        mock_path.isfile.return_value = True
+        mock_path.realpath.return_value = "/C"
+        mock_futil.return_value.links_conv.return_value = None
+        elfp = udocker.ElfPatcher(mock_local, "ID")
+        self.assertFalse(elfp.patch_container(True))
+        self.assertFalse(mock_patchld.called)
+
+        mock_futil.return_value.links_conv.return_value = []
+        mock_patchld.return_value = True
+        mock_select.return_value = "patchelf"
+        mock_done.return_value = True
+        elfp = udocker.ElfPatcher(mock_local, "ID")
+        with mock.patch('udocker.os.access', return_value=True):
+            self.assertTrue(elfp.patch_container(True))
+        mock_futil.return_value.links_conv.assert_called_with(
+            False, True, "", ["/R/lib"])
+        mock_futil.return_value.putdata.assert_called_with("/R/usr/lib")
+        # unpadded prefix restored and padded prefix set for each file
+        self.assertEqual(mock_uproc.return_value.get_output.call_count, 4)
+
+    @mock.patch('udocker.Uprocess')
+    @mock.patch('udocker.ElfFile')
+    @mock.patch.object(udocker.ElfPatcher, 'select_patchelf')
+    @mock.patch('udocker.os.path')
+    @mock.patch('udocker.LocalRepository')
+    def test_21__patch_files(self, mock_local, mock_path, mock_select,
+                             mock_elffile, mock_uproc):
+        """Test21 ElfPatcher()._patch_files(). patchelf only as fallback"""
+        mock_select.return_value = "patchelf"
+        mock_elffile.side_effect = lambda f_path: mock.Mock(
+            root_prefix=mock.Mock(return_value=(
+                None if f_path == "/R/odd" else True)))
+        elfp = udocker.ElfPatcher(mock_local, "ID")
+        status = elfp._patch_files(["/R/bin/ls", "/R/odd", "/R/lib/x.so"],
+                                   "/R")
+        self.assertEqual(status, 2)
+        mock_uproc.return_value.get_output.assert_called_once_with(
+            ["patchelf", "--set-root-prefix", "/R", "/R/odd"])
+
+        mock_uproc.reset_mock()
+        status = elfp._patch_files(["/R/odd"], "/OLD/ROOT", True)
+        self.assertEqual(status, 0)
+        mock_uproc.return_value.get_output.assert_called_once_with(
+            ["patchelf", "--restore-root-prefix", "/OLD/ROOT", "/R/odd"])
+
+        mock_uproc.reset_mock()
+        status = elfp._patch_files(["/R/odd"], "/C/////ROOT")
+        self.assertEqual(mock_uproc.return_value.get_output.call_args_list, [
+            mock.call(["patchelf", "--restore-root-prefix", "/C/ROOT",
+                       "/R/odd"]),
+            mock.call(["patchelf", "--set-root-prefix", "/C/////ROOT",
+                       "/R/odd"])])
+
+        mock_uproc.reset_mock()
+        with mock.patch.object(udocker.WorkerPool, 'map',
+                               side_effect=lambda function, args_list: [
+                                   function(arg) for arg in args_list]
+                               ) as mock_map:
+            status = elfp._patch_files(["/R/odd", "/R/bin/ls", "/R/odd2"],
+                                       "/R")
+        self.assertEqual(status, 2)
+        self.assertEqual(mock_map.call_count, 2)
+        self.assertEqual(mock_map.call_args[0][1], ["/R/odd"])
+        mock_uproc.return_value.get_output.assert_called_once_with(
+            ["patchelf", "--set-root-prefix", "/R", "/R/odd"])
+
+    @mock.patch.object(udocker.ElfPatcher, '_patch_done')
+    @mock.patch.object(udocker.ElfPatcher, 'guess_elf_loader')
+    @mock.patch.object(udocker.ElfPatcher, 'get_original_loader')
+    @mock.patch.object(udocker.ElfPatcher, 'get_container_loader')
+    @mock.patch.object(udocker.ElfPatcher, 'get_patch_last_time')
+    @mock.patch.object(udocker.ElfPatcher, 'get_patch_last_path')
+    @mock.patch('udocker.LocalRepository')
+    def test_23_patch_list(self, mock_local, mock_lpath, mock_ltime,
+                           mock_gcl, mock_gol, mock_guess, mock_done):
+        """Test23 ElfPatcher() incremental patch with a manifest."""
+        tmpdir = tempfile.mkdtemp()
+        saved = dict()
+        try:
+            mock_local.cd_container.return_value = tmpdir
+            mock_local.load_json.side_effect = (
+                lambda filename: json.loads(json.dumps(saved.get(filename))))
+            mock_local.save_json.side_effect = (
+                lambda filename, data: saved.update({filename: data}) or True)
+            mock_lpath.return_value = ""
+            mock_ltime.return_value = "0"
+            mock_gol.return_value = mock_guess.return_value = "/lib64/ld.so"
+            mock_done.return_value = True
+            root = os.path.realpath(tmpdir) + "/ROOT"
+            os.makedirs(root + "/bin")
+            make_elf(root + "/bin/prog", b"/lib64/ld.so", b"/usr/lib")
+            open(root + "/bin/README", "w").close()
+            elfp = udocker.ElfPatcher(mock_local, "ID")
+            elfp._uid = os.getuid()
+            self.assertTrue(elfp.patch_binaries())
+            manifest = saved[elfp._container_patch_list]
+            self.assertEqual(list(manifest.keys()), ["/bin/prog"])
+            self.assertEqual(manifest["/bin/prog"][3:],
+                             [elfp._container_patch_root + "/lib64/ld.so",
+                              elfp._container_patch_root])
+            mock_ltime.return_value = str(int(time.time()) + 10)
+            (manifest, since) = elfp._load_patch_list()
+            self.assertEqual(elfp._scan_container(manifest, since)[2], [])
+            os.utime(root + "/bin/prog", (since + 5, since + 5))
+            self.assertEqual(elfp._scan_container(manifest, since)[2],
+                             [root + "/bin/prog"])
+            with mock.patch('udocker.FileUtil') as mock_futil:
+                self.assertTrue(elfp.restore_binaries())
+                mock_futil.assert_any_call(elfp._container_patch_list)
+            info = udocker.ElfFile(root + "/bin/prog").get_dynamic_info()
+            self.assertEqual(info["interp"], b"/lib64/ld.so")
+        finally:
+            shutil.rmtree(tmpdir)
+
+    @mock.patch.object(udocker.ElfPatcher, 'get_ld_libdirs')
+    @mock.patch('udocker.Config')
+    @mock.patch('udocker.LocalRepository')
+    def test_24_get_ld_closure(self, mock_local, mock_config, mock_libdirs):
+        """Test24 ElfPatcher().get_ld_library_path() from DT_NEEDED."""
+        tmpdir = tempfile.mkdtemp()
+        saved = dict()
+        try:
+            mock_local.cd_container.return_value = tmpdir
+            mock_local.load_json.side_effect = (
+                lambda filename: json.loads(json.dumps(saved.get(filename))))
+            mock_local.save_json.side_effect = (
+                lambda filename, data: saved.update({filename: data}) or True)
+            mock_config.ld_so_cache = "/etc/ld.so.cache"
+            mock_config.patch_root_len = 256
+            mock_config.lib_dirs_list_essential = ("/lib64", "/usr/lib")
+            mock_config.lib_dirs_list_append = (".", )
+            elfp = udocker.ElfPatcher(mock_local, "ID")
+            root = elfp._container_root
+            for dir_name in ("/etc", "/usr/bin", "/usr/rlib", "/opt/bar",
+                             "/usr/lib/x86_64", "/opt/foo/lib", "/opt/other"):
+                os.makedirs(root + dir_name)
+            make_ld_cache(root + "/etc/ld.so.cache", [
+                (b"libc.so.6", b"/usr/lib/x86_64/libc.so.6"),
+                (b"libbar.so", b"/opt/bar/libbar.so")])
+            mock_libdirs.return_value = [root + "/opt/foo/lib",
+                                         root + "/usr/lib/x86_64",
+                                         root + "/opt/other"]
+            make_elf(root + "/usr/bin/prog", b"/lib64/ld.so",
+                     b"$ORIGIN/../rlib",
+                     [b"libfoo.so.1", b"libc.so.6", b"librp.so"])
+            make_elf(root + "/usr/bin/prog2", b"/lib64/ld.so", b"",
+                     [b"libmissing.so"])
+            make_elf(root + "/usr/rlib/librp.so", b"", b"")
+            make_elf(root + "/usr/lib/x86_64/libc.so.6", b"", b"")
+            make_elf(root + "/opt/bar/libbar.so", b"", b"", [b"libc.so.6"])
+            make_elf(root + "/opt/foo/lib/libfoo.so.1", b"", b"",
+                     [b"libbar.so", b"librp.so"])
+            ld_path = elfp.get_ld_library_path(root + "/usr/bin/prog")
+            self.assertEqual(
+                ld_path,
+                ":".join([root + "/opt/foo/lib", root + "/usr/lib/x86_64",
+                          root + "/opt/bar", root + "/usr/lib", "."]))
+            ld_orig = elfp.get_ld_library_path()
+            self.assertTrue(root + "/opt/other" in ld_orig.split(":"))
+            self.assertTrue(set(ld_path.split(":")) <
+                            set(ld_orig.split(":")))
+            # RUNPATH is searched after LD_LIBRARY_PATH, RPATH before
+            make_elf(root + "/usr/rlib/libc.so.6", b"", b"")
+            make_elf(root + "/usr/bin/prog3", b"/lib64/ld.so",
+                     b"$ORIGIN/../rlib", [b"libc.so.6", b"librp.so"], True)
+            self.assertEqual(elfp.get_ld_closure(root + "/usr/bin/prog3"),
+                             ["/usr/lib/x86_64"])
+            make_elf(root + "/usr/bin/prog4", b"/lib64/ld.so",
+                     b"$ORIGIN/../rlib", [b"libc.so.6"])
+            self.assertEqual(elfp.get_ld_closure(root + "/usr/bin/prog4"),
+                             [])
+            with mock.patch.object(udocker.ElfPatcher,
+                                   '_get_ld_closure') as mock_closure:
+                self.assertEqual(elfp.get_ld_closure(root + "/usr/bin/prog"),
+                                 ["/opt/foo/lib", "/usr/lib/x86_64",
+                                  "/opt/bar"])
+                self.assertFalse(mock_closure.called)
+            self.assertEqual(elfp.get_ld_closure(root + "/usr/bin/prog2"),
+                             None)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    @mock.patch.object(udocker.ElfPatcher, 'get_patch_last_path')
+    @mock.patch('udocker.Config')
+    @mock.patch('udocker.LocalRepository')
+    def test_25_relocate_binaries(self, mock_local, mock_config, mock_lpath):
+        """Test25 ElfPatcher().relocate_binaries() of a moved container."""
+        tmpdir = tempfile.mkdtemp()
+        saved = dict()
+        try:
+            mock_local.load_json.side_effect = (
+                lambda filename: json.loads(json.dumps(saved.get(filename))))
+            mock_local.save_json.side_effect = (
+                lambda filename, data: saved.update({filename: data}) or True)
+            mock_config.patch_root_len = 256
+            mock_config.tmpdir = tmpdir
+            old_dir = os.path.realpath(tmpdir) + "/old"
+            new_dir = os.path.realpath(tmpdir) + "/new_container"
+            os.makedirs(old_dir + "/ROOT/bin")
+            make_elf(old_dir + "/ROOT/bin/prog", b"/lib64/ld.so", b"/usr/lib")
+            mock_local.cd_container.return_value = old_dir
+            elfp = udocker.ElfPatcher(mock_local, "ID")
+            elfp._uid = os.getuid()
+            manifest = dict()
+            self.assertEqual(elfp._patch_files(
+                [old_dir + "/ROOT/bin/prog"], elfp._container_patch_root,
+                manifest=manifest), 1)
+            elfp._save_patch_list(manifest)
+            old_root = elfp._container_patch_root
+            with open(old_dir + "/ld.lib.dirs", "w") as filep:
+                filep.write(old_dir + "/ROOT/usr/lib:/host/lib")
+            size = os.path.getsize(old_dir + "/ROOT/bin/prog")
+            make_elf(old_dir + "/ROOT/bin/f4prog", b"/lib64/ld.so", b"")
+            self.assertTrue(udocker.ElfFile(
+                old_dir + "/ROOT/bin/f4prog").root_prefix(old_dir + "/ROOT"))
+            os.rename(old_dir, new_dir)
+            saved = dict([(f_name.replace(old_dir, new_dir), data)
+                          for (f_name, data) in saved.items()])
+            mock_local.cd_container.return_value = new_dir
+            mock_lpath.return_value = old_dir
+            elfp = udocker.ElfPatcher(mock_local, "ID")
+            elfp._uid = os.getuid()
+            self.assertEqual(len(elfp._container_patch_root), len(old_root))
+            f4prog = new_dir + "/ROOT/bin/f4prog"
+            with mock.patch.object(udocker.ElfPatcher,
+                                   '_patch_files') as mock_patch, \
+                    mock.patch.object(udocker.FileUtil, 'links_conv',
+                                      return_value=[]) as mock_links:
+                self.assertTrue(elfp.relocate_binaries())
+                self.assertEqual(mock_patch.call_args_list, [
+                    mock.call([f4prog], old_root, True),
+                    mock.call([f4prog], elfp._container_patch_root,
+                              manifest=mock.ANY)])
+                self.assertEqual(mock_links.call_args[0][:3],
+                                 (False, True, old_dir + "/ROOT"))
+            prog = new_dir + "/ROOT/bin/prog"
+            info = udocker.ElfFile(prog).get_dynamic_info()
+            self.assertEqual(info["interp"], (elfp._container_patch_root +
+                                              "/lib64/ld.so").encode())
+            self.assertEqual(info["rpath"], [(elfp._container_patch_root +
+                                              "/usr/lib").encode()])
+            self.assertEqual(os.path.getsize(prog), size)
+            manifest = saved[elfp._container_patch_list]
+            self.assertEqual(manifest["/bin/prog"][4],
+                             elfp._container_patch_root)
+            self.assertFalse("/bin/f4prog" in manifest)
+            with open(new_dir + "/ld.lib.dirs") as filep:
+                self.assertEqual(filep.read(),
+                                 new_dir + "/ROOT/usr/lib:/host/lib")
+            with open(new_dir + "/patch.path") as filep:
+                self.assertEqual(filep.read(), new_dir)
+        finally:
+            shutil.rmtree(tmpdir)
+
 
 class NixAuthenticationTestCase(unittest.TestCase):
     """Test NixAuthentication() *nix authentication portably."""
@@ -4440,8 +5324,7 @@ class ExecutionModeTestCase(unittest.TestCase):
         self.assertTrue(mock_elfp.return_value.patch_ld.called)
 
         uexm.set_mode("F3")
-        self.assertTrue(mock_elfp.return_value.patch_ld.called and
-                        mock_elfp.return_value.patch_binaries.called)
+        self.assertTrue(mock_elfp.return_value.patch_container.called)
 
         status = uexm.set_mode("F3")
         self.assertTrue(status)
@@ -4736,6 +5619,207 @@ class ContainerStructureTestCase(unittest.TestCase):
     #     pass
 
 
+class LayerIndexTestCase(unittest.TestCase):
+    """Test LayerIndex() index of image layer members."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Setup test."""
+        set_env()
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @mock.patch('udocker.Msg')
+    def test_01_build(self, mock_msg):
+        """Test01 LayerIndex().build()."""
+        mock_msg.level = 0
+        layer_file = make_layer(self.tmpdir, "layer.tar.gz", [
+            ("./usr/bin/ls", b"ELF", tarfile.REGTYPE, ""),
+            ("bin", None, tarfile.SYMTYPE, "usr/bin"), ], "w:gz")
+        lindex = udocker.LayerIndex(layer_file)
+        self.assertTrue(lindex.build())
+        self.assertEqual(lindex.compression, "gzip")
+        self.assertEqual(lindex.get("/usr/bin/ls")[0:2], ['f', 3])
+        self.assertEqual(lindex.get("bin")[0], 'l')
+        self.assertEqual(lindex.get("usr")[0], 'd')
+        self.assertTrue(os.path.exists(layer_file + ".idx"))
+
+    @mock.patch('udocker.Msg')
+    def test_02_load(self, mock_msg):
+        """Test02 LayerIndex().load()."""
+        mock_msg.level = 0
+        layer_file = make_layer(self.tmpdir, "layer.tar", [
+            ("etc/hosts", b"localhost", tarfile.REGTYPE, ""), ])
+        self.assertTrue(udocker.LayerIndex(layer_file).load())
+        self.assertTrue(mock_msg.return_value.out.called)
+        mock_msg.reset_mock()
+        lindex = udocker.LayerIndex(layer_file)
+        self.assertTrue(lindex.load())
+        self.assertFalse(mock_msg.return_value.out.called)
+        self.assertEqual(lindex.compression, "")
+        os.utime(layer_file, (1, 1))
+        self.assertTrue(udocker.LayerIndex(layer_file).load())
+        self.assertTrue(mock_msg.return_value.out.called)
+
+    @mock.patch('udocker.Msg')
+    def test_03_hides(self, mock_msg):
+        """Test03 LayerIndex().hides()."""
+        mock_msg.level = 0
+        layer_file = make_layer(self.tmpdir, "layer.tar", [
+            ("etc/.wh.passwd", b"", tarfile.REGTYPE, ""),
+            ("opt/.wh..wh..opq", b"", tarfile.REGTYPE, ""), ])
+        lindex = udocker.LayerIndex(layer_file)
+        lindex.load()
+        self.assertTrue(lindex.hides("/etc/passwd"))
+        self.assertTrue(lindex.hides("/opt/app/bin"))
+        self.assertFalse(lindex.hides("/etc/group"))
+        self.assertFalse(lindex.hides("/opt"))
+
+    @mock.patch('udocker.Msg')
+    def test_04_getdata(self, mock_msg):
+        """Test04 LayerIndex().getdata()."""
+        mock_msg.level = 0
+        data = b"0123456789" * 200000
+        for (filename, mode) in (("layer.tar", "w"),
+                                 ("layer.tar.gz", "w:gz")):
+            layer_file = make_layer(self.tmpdir, filename, [
+                ("a", b"A", tarfile.REGTYPE, ""),
+                ("b", data, tarfile.REGTYPE, ""),
+                ("c", b"C", tarfile.REGTYPE, ""), ], mode)
+            lindex = udocker.LayerIndex(layer_file)
+            lindex.load()
+            self.assertEqual(lindex.getdata(lindex.get("b")), data)
+            self.assertEqual(lindex.getdata(lindex.get("c")), b"C")
+
+
+    @mock.patch('udocker.Msg')
+    def test_05_uncompress(self, mock_msg):
+        """Test05 LayerIndex().uncompress()."""
+        mock_msg.level = 0
+        layer_file = make_layer(self.tmpdir, "layer.tar.gz", [
+            ("a", b"A", tarfile.REGTYPE, ""), ], "w:gz")
+        outfp = io.BytesIO()
+        self.assertTrue(udocker.LayerIndex(layer_file).uncompress(outfp))
+        tarf = tarfile.open(fileobj=io.BytesIO(outfp.getvalue()), mode="r:")
+        self.assertEqual(tarf.getnames(), ["a"])
+
+    @mock.patch('udocker.Msg')
+    def test_06_verify(self, mock_msg):
+        """Test06 LayerIndex().verify() single read check."""
+        mock_msg.level = 0
+        data = os.urandom(3000000)
+        for (filename, mode) in (("layer.tar", "w"), ("layer.tgz", "w:gz"),
+                                 ("layer.tbz", "w:bz2")):
+            layer_file = make_layer(self.tmpdir, filename, [
+                ("a" * 150, b"A", tarfile.REGTYPE, ""),
+                ("b", data, tarfile.REGTYPE, ""),
+                ("c", None, tarfile.SYMTYPE, "b"), ], mode)
+            with open(layer_file, "rb") as layerfp:
+                layer_data = layerfp.read()
+            sha256sum = hashlib.sha256(layer_data).hexdigest()
+            self.assertEqual(udocker.LayerIndex(layer_file).verify(),
+                             (True, sha256sum))
+            with open(layer_file, "wb") as layerfp:
+                layerfp.write(layer_data[:len(layer_data) // 2])
+            self.assertFalse(udocker.LayerIndex(layer_file).verify()[0])
+            if mode != "w":     # tar complete, compressed stream truncated
+                with open(layer_file, "wb") as layerfp:
+                    layerfp.write(layer_data[:-4])
+                self.assertFalse(udocker.LayerIndex(layer_file).verify()[0])
+        with open(self.tmpdir + "/config", "wb") as configfp:
+            configfp.write(b'{"os": "linux"}')
+        status = udocker.LayerIndex(self.tmpdir + "/config").verify()
+        self.assertEqual(status[0], None)
+        self.assertEqual(udocker.LayerIndex(self.tmpdir + "/x").verify(),
+                         (False, ""))
+
+    def test_07_tarstreamcheck(self):
+        """Test07 TarStreamCheck() fed in small chunks."""
+        layer_file = make_layer(self.tmpdir, "layer.tar", [
+            ("a", b"A" * 1000, tarfile.REGTYPE, ""),
+            ("d", None, tarfile.DIRTYPE, ""), ])
+        with open(layer_file, "rb") as layerfp:
+            layer_data = layerfp.read()
+        tarcheck = udocker.TarStreamCheck()
+        for pos in range(0, len(layer_data), 100):
+            tarcheck.feed(layer_data[pos:pos + 100])
+        self.assertTrue(tarcheck.close())
+        corrupted = bytearray(layer_data)
+        corrupted[10] ^= 0xff
+        tarcheck = udocker.TarStreamCheck()
+        self.assertFalse(tarcheck.feed(bytes(corrupted)))
+        self.assertFalse(tarcheck.close())
+
+
+class ImageIndexTestCase(unittest.TestCase):
+    """Test ImageIndex() access to files in images."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Setup test."""
+        set_env()
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @mock.patch('udocker.Msg')
+    @mock.patch('udocker.LocalRepository')
+    def _select(self, mock_local, mock_msg):
+        """Select an image with two layers"""
+        mock_msg.level = 0
+        layer1 = make_layer(self.tmpdir, "layer1.tar.gz", [
+            ("etc/os-release", b"NAME=base", tarfile.REGTYPE, ""),
+            ("etc/gone", b"gone", tarfile.REGTYPE, ""),
+            ("usr/lib/os-release", b"NAME=lib", tarfile.REGTYPE, ""),
+            ("etc/hard", None, tarfile.LNKTYPE, "etc/gone"), ], "w:gz")
+        layer2 = make_layer(self.tmpdir, "layer2.tar", [
+            ("etc/.wh.gone", b"", tarfile.REGTYPE, ""),
+            ("lib", None, tarfile.SYMTYPE, "/usr/lib"),
+            ("etc/os-release", None, tarfile.SYMTYPE,
+             "../lib/os-release"), ])
+        mock_local.cd_imagerepo.return_value = "/tagdir"
+        mock_local.get_image_attributes.return_value = \
+            ({}, [layer1, layer2])
+        mock_local.get_uncompressed_layer.side_effect = lambda x: x
+        iindex = udocker.ImageIndex(mock_local)
+        self.assertTrue(iindex.select("IMAGE", "TAG"))
+        return iindex
+
+    @mock.patch('udocker.LocalRepository')
+    def test_01_select(self, mock_local):
+        """Test01 ImageIndex().select()."""
+        mock_local.cd_imagerepo.return_value = ""
+        iindex = udocker.ImageIndex(mock_local)
+        self.assertFalse(iindex.select("IMAGE", "TAG"))
+        iindex = self._select()
+        self.assertEqual(len(iindex.layers), 2)
+        self.assertTrue(iindex.layers[0].layer_file.endswith("layer2.tar"))
+
+    def test_02_resolve(self):
+        """Test02 ImageIndex().resolve()."""
+        iindex = self._select()
+        (dummy, entry) = iindex.resolve("/etc/gone")
+        self.assertEqual(entry, None)
+        (dummy, entry) = iindex.resolve("/etc/../lib/./os-release")
+        self.assertEqual(entry[0], 'f')
+        (dummy, entry) = iindex.resolve("/etc/nothere")
+        self.assertEqual(entry, None)
+
+    def test_03_getdata(self):
+        """Test03 ImageIndex().getdata()."""
+        iindex = self._select()
+        self.assertEqual(iindex.getdata("/etc/os-release"), b"NAME=lib")
+        self.assertEqual(iindex.getdata("/etc/hard"), b"gone")
+        self.assertEqual(iindex.getdata("/etc"), None)
+
+
 class LocalRepositoryTestCase(unittest.TestCase):
     """Test LocalRepositoryTestCase().
     Management of local repository of container
@@ -4914,19 +5998,44 @@ class LocalRepositoryTestCase(unittest.TestCase):
         status = localrepo.iswriteable_container(container_id)
         self.assertEqual(status, 0)
 
-    @mock.patch('udocker.Uprocess.get_output')
-    def test_13_get_size(self, mock_ugetout):
-        """Test12 LocalRepository().get_size()."""
+    @mock.patch('udocker.os.path.getmtime')
+    @mock.patch.object(udocker.LocalRepository, 'cd_container')
+    def test_13_get_size(self, mock_cd, mock_mtime):
+        """Test13 LocalRepository().get_size()."""
         localrepo = self._localrepo(UDOCKER_TOPDIR)
+        udocker.Config.disk_usage_max_age = 3600
         container_id = "d2578feb-acfc-37e0-8561-47335f85e46a"
-        mock_ugetout.return_value = "1024   ."
-        status = localrepo.get_size(container_id)
-        self.assertEqual(status, 1024)
+        mock_cd.return_value = ""
+        self.assertEqual(localrepo.get_size(container_id), -1)
+
+        mock_cd.return_value = "/CONTAINERS/" + container_id
+        mock_mtime.side_effect = lambda x: 20 if x.endswith("usage") else 10
+        udocker.FileUtil.return_value.getdata.return_value = "2097152"
+        with mock.patch('udocker.time.time', return_value=30):
+            self.assertEqual(localrepo.get_size(container_id), 2)
+        self.assertFalse(udocker.FileUtil.return_value.disk_usage.called)
+
+        udocker.FileUtil.return_value.disk_usage.return_value = 5242880
+        with mock.patch('udocker.time.time',
+                        return_value=20 + udocker.Config.disk_usage_max_age):
+            self.assertEqual(localrepo.get_size(container_id), 5)
+        self.assertTrue(udocker.FileUtil.return_value.disk_usage.called)
+
+        mock_mtime.side_effect = lambda x: 10 if x.endswith("usage") else 20
+        udocker.FileUtil.return_value.disk_usage.return_value = 3145729
+        self.assertEqual(localrepo.get_size(container_id), 4)
+        udocker.FileUtil.return_value.putdata.assert_called_with("3145729",
+                                                                 "w")
+
+        mock_mtime.side_effect = lambda x: 20 if x.endswith("usage") else 10
+        udocker.FileUtil.return_value.disk_usage.return_value = 1048576
+        self.assertEqual(localrepo.get_size(container_id, True), 1)
 
     @mock.patch.object(udocker.LocalRepository, 'get_container_name')
     def test_14_get_containers_list(self, mock_getname):
         """Test14 LocalRepository().get_containers_list()."""
         localrepo = self._localrepo(UDOCKER_TOPDIR)
+        self.addCleanup(mock.patch.stopall)
         mock_isdir = mock.patch('os.path.isdir').start()
         mock_isdir.return_value = True
         mock_listdir = mock.patch('os.listdir').start()
@@ -4949,6 +6058,16 @@ class LocalRepositoryTestCase(unittest.TestCase):
             self.assertEqual(os.path.basename(containers_list[0][1]),
                              "REPONAME")
 
+        with mock.patch.object(udocker.LocalRepository,
+                               '_containers_index') as mock_cindex:
+            mock_cindex.return_value = {
+                "containers": {u"ID1": u"R:T", u"ID2": u"R:T"},
+                "names": {u"N1": u"ID1"}}
+            containers_list = localrepo.get_containers_list(False)
+            self.assertEqual(containers_list,
+                             [("ID1", u"R:T", "['N1']"),
+                              ("ID2", u"R:T", "")])
+
     @mock.patch.object(udocker.LocalRepository, 'cd_container')
     @mock.patch.object(udocker.LocalRepository, 'get_containers_list')
     def test_15_del_container(self, mock_cdcont, mock_getcl):
@@ -4969,16 +6088,24 @@ class LocalRepositoryTestCase(unittest.TestCase):
         status = localrepo.del_container(container_id)
         self.assertTrue(status)
 
-    @mock.patch.object(udocker.LocalRepository, 'get_containers_list')
-    def test_16_cd_container(self, mock_getlist):
+    @mock.patch.object(udocker.LocalRepository, '_containers_index')
+    def test_16_cd_container(self, mock_cindex):
         """Test16 LocalRepository().cd_container()."""
         localrepo = self._localrepo(UDOCKER_TOPDIR)
         mock_exists = mock.patch('os.path.exists').start()
         mock_exists.return_value = True
-        mock_getlist.return_value = [localrepo.containersdir +
-                                     "/CONTAINERNAME"]
-        container_path = localrepo.cd_container("CONTAINERNAME")
-        self.assertEqual(container_path, mock_getlist.return_value[0])
+        mock_cindex.return_value = {"containers": {"CONTAINERID": "R:T"},
+                                    "names": {"NAME": "CONTAINERID"}}
+        container_path = localrepo.cd_container("CONTAINERID")
+        self.assertEqual(container_path,
+                         localrepo.containersdir + "/CONTAINERID")
+        container_path = localrepo.cd_container("NAME")
+        self.assertEqual(container_path, localrepo.containersdir + "/NAME")
+        self.assertEqual(mock_cindex.call_count, 2)
+
+        container_path = localrepo.cd_container("OTHER")
+        self.assertEqual(container_path, "")
+        mock_cindex.assert_called_with(rebuild=True)
 
     @mock.patch('udocker.os.symlink')
     @mock.patch('udocker.os.path.exists')
@@ -5201,6 +6328,14 @@ class LocalRepositoryTestCase(unittest.TestCase):
         out = localrepo._find(filename, folder)
         self.assertEqual(out, ["/tmp/file"])
 
+        mock_listdir.return_value = ["ID.layer"]
+        with mock.patch('udocker.os.readlink') as mock_readlink:
+            mock_readlink.return_value = "../../layers/sha256:aa"
+            out = localrepo._find("sha256:aa", folder)
+            self.assertEqual(out, ["/tmp/ID.layer"])
+            out = localrepo._find("sha256:bb", folder)
+            self.assertEqual(out, [])
+
         mock_islink.return_value = False
         mock_isdir.return_value = False
         out = localrepo._find(filename, folder)
@@ -5229,14 +6364,19 @@ class LocalRepositoryTestCase(unittest.TestCase):
         out = localrepo._inrepository(filename)
         self.assertEqual(out, [])
 
+    @mock.patch.object(udocker.LocalRepository, '_layer_alias_remove')
+    @mock.patch.object(udocker.LocalRepository, '_index_save')
+    @mock.patch.object(udocker.LocalRepository, '_layers_refs')
     @mock.patch('udocker.os.readlink')
     @mock.patch('udocker.os.path.islink')
     @mock.patch('udocker.os.listdir')
     @mock.patch.object(udocker.LocalRepository, '_inrepository')
     def test_31__remove_layers(self, mock_in,
-                               mock_listdir, mock_islink, mock_readlink):
+                               mock_listdir, mock_islink, mock_readlink,
+                               mock_refs, mock_save, mock_alias):
         """Test31 LocalRepository()._remove_layers()."""
         localrepo = self._localrepo(UDOCKER_TOPDIR)
+        mock_refs.return_value = {"layers": {}}
         mock_listdir.return_value = []
         status = localrepo._remove_layers("TAG_DIR", False)
         self.assertTrue(status)
@@ -5261,24 +6401,86 @@ class LocalRepositoryTestCase(unittest.TestCase):
         self.assertTrue(status)
 
         udocker.FileUtil.return_value.remove.return_value = False
-        mock_in.return_value = False
+        mock_in.return_value = []
         status = localrepo._remove_layers("TAG_DIR", True)
         self.assertTrue(status)
 
         udocker.FileUtil.return_value.remove.return_value = False
-        mock_in.return_value = False
+        mock_in.return_value = []
         status = localrepo._remove_layers("TAG_DIR", False)
         self.assertFalse(status)
 
         udocker.FileUtil.return_value.remove.return_value = False
-        mock_in.return_value = True
+        mock_in.return_value = ["/repo/tag/REALFILE"]
         status = localrepo._remove_layers("TAG_DIR", True)
         self.assertTrue(status)
 
+        mock_in.reset_mock()
+        mock_in.return_value = []
+        udocker.FileUtil.reset_mock()
+        udocker.FileUtil.return_value.remove.return_value = True
+        mock_listdir.return_value = ["sha256:aaa"]
+        mock_readlink.return_value = "../../layers/sha256:aaa"
+        layers = {"sha256:aaa": ["repo/tag", "other/tag"]}
+        mock_refs.return_value = {"layers": layers}
+        tag_dir = localrepo.reposdir + "/repo/tag"
+        status = localrepo._remove_layers(tag_dir, False)
+        self.assertTrue(status)
+        self.assertFalse(mock_in.called)
+        self.assertEqual(layers, {"sha256:aaa": ["other/tag"]})
+        self.assertEqual(udocker.FileUtil.return_value.remove.call_count, 1)
+
+        mock_alias.reset_mock()
+        udocker.FileUtil.reset_mock()
+        tag_dir = localrepo.reposdir + "/other/tag"
+        status = localrepo._remove_layers(tag_dir, False)
+        self.assertTrue(status)
+        self.assertFalse(mock_in.called)
+        self.assertEqual(layers, {})
+        self.assertEqual(udocker.FileUtil.return_value.remove.call_count, 5)
+        mock_alias.assert_called_once_with(["sha256:aaa"])
+        mock_save.assert_called_with(localrepo.layers_refs_file,
+                                     {"layers": {}})
+
+        mock_in.return_value = [localrepo.reposdir + "/third/tag/sha256:aaa"]
+        mock_alias.reset_mock()
+        udocker.FileUtil.reset_mock()
+        status = localrepo._remove_layers(tag_dir, False)
+        self.assertTrue(status)
+        mock_in.assert_called_once_with("sha256:aaa")
+        self.assertEqual(layers, {"sha256:aaa": ["third/tag"]})
+        self.assertEqual(udocker.FileUtil.return_value.remove.call_count, 1)
+        self.assertFalse(mock_alias.called)
+
+    @mock.patch.object(udocker.LocalRepository, '_index_save')
+    @mock.patch.object(udocker.LocalRepository, '_layers_refs_scan')
+    @mock.patch.object(udocker.LocalRepository, 'load_json')
+    def test_31__layers_refs(self, mock_loadjson, mock_scan, mock_save):
+        """Test31 LocalRepository()._layers_refs()."""
+        localrepo = self._localrepo(UDOCKER_TOPDIR)
+        mock_loadjson.return_value = {"version": 1, "layers": {"L1": ["R/T"]}}
+        status = localrepo._layers_refs()
+        self.assertEqual(status["layers"], {"L1": ["R/T"]})
+        self.assertFalse(mock_scan.called)
+
+        mock_scan.return_value = {"version": 1, "layers": {}}
+        status = localrepo._layers_refs(rebuild=True)
+        self.assertEqual(status["layers"], {})
+        mock_save.assert_called_with(localrepo.layers_refs_file,
+                                     mock_scan.return_value)
+
+        localrepo = self._localrepo(UDOCKER_TOPDIR)
+        mock_scan.reset_mock()
+        mock_loadjson.return_value = None
+        localrepo._layers_refs()
+        self.assertTrue(mock_scan.called)
+
+    @mock.patch.object(udocker.LocalRepository, '_tags_catalog_update')
     @mock.patch('udocker.FileUtil')
     @mock.patch.object(udocker.LocalRepository, '_remove_layers')
     @mock.patch.object(udocker.LocalRepository, 'cd_imagerepo')
-    def test_32_del_imagerepo(self, mock_cd, mock_rmlayers, mock_futil):
+    def test_32_del_imagerepo(self, mock_cd, mock_rmlayers, mock_futil,
+                              mock_catalog):
         """Test32 LocalRepository()._del_imagerepo()."""
         localrepo = self._localrepo(UDOCKER_TOPDIR)
         mock_cd.return_value = False
@@ -5346,12 +6548,87 @@ class LocalRepositoryTestCase(unittest.TestCase):
         self.assertEqual(self.iter, 2)
         self.assertEqual(status, [])
 
-    @mock.patch.object(udocker.LocalRepository, '_get_tags')
-    def test_34_get_imagerepos(self, mock_gtags):
+    def test_34_get_imagerepos(self):
         """Test34 LocalRepository().get_imagerepos()."""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            localrepo = self._localrepo(UDOCKER_TOPDIR)
+            localrepo.reposdir = tmpdir
+            localrepo.tags_catalog_file = tmpdir + "/.catalog"
+            os.mkdir(tmpdir + "/R1")
+            os.mkdir(tmpdir + "/R1/T1")
+            open(tmpdir + "/R1/T1/TAG", "w").close()
+            self.assertEqual(localrepo.get_imagerepos(), [("R1", "T1")])
+            self.assertTrue(os.path.exists(localrepo.tags_catalog_file))
+
+            reposdir = localrepo.reposdir
+            localrepo = self._localrepo(UDOCKER_TOPDIR)
+            localrepo.reposdir = reposdir
+            localrepo.tags_catalog_file = tmpdir + "/.catalog"
+            with mock.patch.object(udocker.LocalRepository,
+                                   '_tags_catalog_entry') as mock_entry:
+                self.assertEqual(localrepo.get_imagerepos(), [("R1", "T1")])
+                self.assertFalse(mock_entry.called)
+
+                for subdir in ("/library", "/library/R2", "/library/R2/T2"):
+                    os.mkdir(tmpdir + subdir)
+                open(tmpdir + "/library/R2/T2/TAG", "w").close()
+                mock_entry.return_value = {"imagerepo": "library/R2",
+                                           "tag": "T2", "mtime": None}
+                self.assertEqual(localrepo.get_imagerepos(),
+                                 [("R1", "T1"), ("library/R2", "T2")])
+                mock_entry.assert_called_once_with("library/R2/T2")
+
+                mock_entry.reset_mock()
+                open(tmpdir + "/R1/T1/v2", "w").close()
+                localrepo._tags_catalog_update(tmpdir + "/R1/T1",
+                                               version="v2")
+                self.assertFalse(mock_entry.called)
+                entry = localrepo.load_json(
+                    localrepo.tags_catalog_file)["tags"]["R1/T1"]
+                self.assertEqual(entry["version"], "v2")
+
+            shutil.rmtree(tmpdir + "/library")
+            self.assertEqual(localrepo.get_imagerepos(), [("R1", "T1")])
+
+            with mock.patch.object(udocker.LocalRepository,
+                                   '_tags_catalog_walk') as mock_walk:
+                os.mkdir(tmpdir + "/R1/T3")
+                open(tmpdir + "/R1/T3/TAG", "w").close()
+                self.assertTrue(
+                    localrepo._tags_catalog_update(tmpdir + "/R1/T3"))
+                shutil.rmtree(tmpdir + "/R1/T1")
+                self.assertTrue(
+                    localrepo._tags_catalog_update(tmpdir + "/R1/T1"))
+                localrepo._tags_catalog_cache = None
+                self.assertEqual(localrepo.get_imagerepos(), [("R1", "T3")])
+                self.assertFalse(mock_walk.called)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    @mock.patch('udocker.ChkSUM')
+    @mock.patch('udocker.os.path.islink')
+    @mock.patch('udocker.os.listdir')
+    @mock.patch.object(udocker.LocalRepository, '_is_tag')
+    def test_34__tags_catalog_entry(self, mock_istag, mock_listdir,
+                                    mock_islink, mock_chksum):
+        """Test34 LocalRepository()._tags_catalog_entry()."""
         localrepo = self._localrepo(UDOCKER_TOPDIR)
-        localrepo.get_imagerepos()
-        self.assertTrue(mock_gtags.called)
+        mock_istag.return_value = False
+        self.assertEqual(localrepo._tags_catalog_entry("R/T"), None)
+
+        mock_istag.return_value = True
+        mock_listdir.return_value = ["TAG", "v2", "manifest", "sha256:aa"]
+        mock_islink.side_effect = lambda x: x.endswith("sha256:aa")
+        mock_chksum.return_value.sha256.return_value = "1234"
+        udocker.FileUtil.return_value.size.return_value = 10
+        with mock.patch('udocker.os.stat') as mock_stat:
+            mock_stat.return_value.st_mtime = 10.5
+            entry = localrepo._tags_catalog_entry("library/R/T")
+        self.assertEqual(entry, {"imagerepo": "library/R", "tag": "T",
+                                 "version": "v2", "manifest": "sha256:1234",
+                                 "layers": [["sha256:aa", 10]],
+                                 "mtime": 10.5})
 
     @mock.patch('udocker.LocalRepository')
     @mock.patch.object(udocker.LocalRepository, 'cd_container')
@@ -5361,10 +6638,13 @@ class LocalRepositoryTestCase(unittest.TestCase):
         localrepo.get_layers("IMAGE", "TAG")
         self.assertTrue(mock_cd.called)
 
+    @mock.patch.object(udocker.LocalRepository, '_tags_catalog_update')
+    @mock.patch.object(udocker.LocalRepository, '_layers_refs_update')
     @mock.patch('udocker.os.path.islink')
     @mock.patch('udocker.os.path.exists')
     @mock.patch.object(udocker.LocalRepository, '_symlink')
-    def test_36_add_image_layer(self, mock_slink, mock_exists, mock_islink):
+    def test_36_add_image_layer(self, mock_slink, mock_exists, mock_islink,
+                                mock_refs, mock_catalog):
         """Test36 LocalRepository().add_image_layer()."""
         localrepo = self._localrepo(UDOCKER_TOPDIR)
         localrepo.cur_repodir = ""
@@ -5392,7 +6672,9 @@ class LocalRepositoryTestCase(unittest.TestCase):
         mock_islink.return_value = False
         udocker.FileUtil.reset_mock()
         status = localrepo.add_image_layer("FILE")
-        self.assertFalse(udocker.FileUtil.called)
+        self.assertFalse(udocker.FileUtil.return_value.remove.called)
+        mock_catalog.assert_called_with(
+            "TAG", layer=["FILE", udocker.FileUtil.return_value.size()])
         self.assertTrue(status)
 
     @mock.patch('udocker.os.makedirs')
@@ -5416,20 +6698,24 @@ class LocalRepositoryTestCase(unittest.TestCase):
         self.assertEqual(localrepo.cur_repodir, expected_directory)
         self.assertTrue(status)
 
+    @mock.patch.object(udocker.LocalRepository, '_tags_catalog_update')
     @mock.patch('udocker.os.makedirs')
     @mock.patch('udocker.os.path.exists')
-    def test_38_setup_tag(self, mock_exists, mock_makedirs):
+    def test_38_setup_tag(self, mock_exists, mock_makedirs, mock_catalog):
         """Test38 LocalRepository().setup_tag()."""
         localrepo = self._localrepo(UDOCKER_TOPDIR)
         mock_exists.return_value = False
         localrepo.cur_repodir = localrepo.reposdir + "/IMAGE"
-        with mock.patch(BUILTINS + '.open', mock.mock_open()) as mopen:
-            status = localrepo.setup_tag("NEWTAG")
-            self.assertTrue(mock_makedirs.called)
-            expected_directory = localrepo.reposdir + "/IMAGE/NEWTAG"
-            self.assertEqual(localrepo.cur_tagdir, expected_directory)
-            self.assertTrue(mopen.called)
-            self.assertTrue(status)
+        status = localrepo.setup_tag("NEWTAG")
+        self.assertTrue(mock_makedirs.called)
+        expected_directory = localrepo.reposdir + "/IMAGE/NEWTAG"
+        self.assertEqual(localrepo.cur_tagdir, expected_directory)
+        udocker.FileUtil.assert_called_with(expected_directory + "/TAG")
+        self.assertTrue(status)
+
+        with mock.patch('udocker.FileUtil') as mock_futil:
+            mock_futil.return_value.putdata.return_value = ""
+            self.assertFalse(localrepo.setup_tag("NEWTAG"))
 
     @mock.patch('udocker.os.listdir')
     @mock.patch('udocker.os.makedirs')
@@ -5520,9 +6806,13 @@ class LocalRepositoryTestCase(unittest.TestCase):
 
         mock_exists.reset_mock()
         with mock.patch(BUILTINS + '.open', mock.mock_open()) as mopen:
-            status = localrepo.save_json("/filename", "data")
-            self.assertTrue(mopen.called)
-            self.assertTrue(status)
+            with mock.patch('udocker.os.rename') as mock_rename:
+                status = localrepo.save_json("/filename", "data")
+                self.assertTrue(mopen.called)
+                self.assertTrue(status)
+                self.assertEqual(mock_rename.call_args[0][1], "/filename")
+                self.assertTrue(mopen.call_args[0][0].startswith(
+                    "/filename."))
 
         mock_exists.reset_mock()
         with mock.patch(BUILTINS + '.open', mock.mock_open()) as mopen:
@@ -5602,6 +6892,300 @@ class LocalRepositoryTestCase(unittest.TestCase):
         localrepo.verify_image()
         self.assertTrue(mock_lstruct.called)
 
+        mock_lstruct.return_value = {"repolayers": {
+            "sha256:aa": {"layer_f": "TAGDIR/sha256:aa"},
+            "sha256:bb": {"layer_f": "TAGDIR/sha256:bb"},
+            "sha256:cc": {}}}
+        verified = {os.path.realpath("TAGDIR/sha256:bb"): True}
+        with mock.patch.object(localrepo, "_verify_layer_file") as mock_vlf:
+            mock_vlf.return_value = True
+            self.assertFalse(localrepo.verify_image(verified))
+            mock_vlf.assert_called_once_with(mock_lstruct.return_value,
+                                             "sha256:aa")
+            self.assertTrue(verified[os.path.realpath("TAGDIR/sha256:aa")])
+            mock_vlf.reset_mock()
+            del mock_lstruct.return_value["repolayers"]["sha256:cc"]
+            self.assertTrue(localrepo.verify_image(verified))
+            self.assertFalse(mock_vlf.called)
+
+            verified = dict()
+            mock_lstruct.return_value["repolayers"]["sha256:dd"] = \
+                {"layer_f": "TAGDIR/sha256:aa"}
+            self.assertTrue(localrepo.verify_image(verified))
+            layer_ids = [call[0][1] for call in mock_vlf.call_args_list]
+            self.assertEqual(len(layer_ids), 2)     # aa and dd same file
+            self.assertTrue("sha256:bb" in layer_ids)
+
+    @mock.patch('udocker.os.path.getmtime')
+    def test_48_get_uncompressed_layer(self, mock_mtime):
+        """Test48 LocalRepository().get_uncompressed_layer()."""
+        localrepo = self._localrepo(UDOCKER_TOPDIR)
+        mock_mtime.side_effect = [2, 1]
+        status = localrepo.get_uncompressed_layer("/layers/sha256:123")
+        self.assertEqual(status, "/layers/sha256:123.tar")
+
+        mock_mtime.side_effect = [1, 2]
+        status = localrepo.get_uncompressed_layer("/layers/sha256:123")
+        self.assertEqual(status, "/layers/sha256:123")
+
+        mock_mtime.side_effect = OSError("fail")
+        status = localrepo.get_uncompressed_layer("/layers/sha256:123")
+        self.assertEqual(status, "/layers/sha256:123")
+
+    @mock.patch('udocker.os.rename')
+    @mock.patch('udocker.os.path.getmtime')
+    @mock.patch('udocker.LayerIndex')
+    @mock.patch('udocker.Msg')
+    def test_49_uncompress_layer(self, mock_msg, mock_lindex, mock_mtime,
+                                 mock_rename):
+        """Test49 LocalRepository().uncompress_layer()."""
+        mock_msg.level = 0
+        localrepo = self._localrepo(UDOCKER_TOPDIR)
+        mock_lindex.return_value.get_compression.return_value = ""
+        status = localrepo.uncompress_layer("/tmp/sha256:123")
+        self.assertFalse(status)
+
+        mock_lindex.return_value.get_compression.return_value = "gzip"
+        mock_mtime.side_effect = [2, 1]
+        status = localrepo.uncompress_layer("/tmp/sha256:123")
+        self.assertTrue(status)
+        self.assertFalse(mock_rename.called)
+
+        mock_mtime.side_effect = OSError("fail")
+        mock_lindex.return_value.uncompress.return_value = True
+        with mock.patch(BUILTINS + '.open', mock.mock_open()):
+            status = localrepo.uncompress_layer("/tmp/sha256:123")
+        self.assertTrue(status)
+        self.assertTrue(mock_rename.called)
+
+    @mock.patch.object(udocker.LocalRepository, 'lock_index')
+    @mock.patch.object(udocker.LocalRepository, '_index_save')
+    @mock.patch.object(udocker.LocalRepository, '_containers_scan')
+    @mock.patch.object(udocker.LocalRepository, 'load_json')
+    @mock.patch('udocker.os.path.isdir')
+    @mock.patch('udocker.os.listdir')
+    @mock.patch('udocker.os.stat')
+    def test_50__containers_index(self, mock_stat, mock_listdir, mock_isdir,
+                                  mock_loadjson, mock_scan, mock_save,
+                                  mock_lock):
+        """Test50 LocalRepository()._containers_index()."""
+        localrepo = self._localrepo(UDOCKER_TOPDIR)
+        mock_isdir.return_value = True
+        mock_stat.return_value.st_mtime = 10.5
+        mock_listdir.return_value = ["ID", "N", "F"]
+        mock_loadjson.return_value = {"version": 1, "mtime": 10.5,
+                                      "containers": {"ID": "R:T"},
+                                      "names": {"N": "ID"},
+                                      "ignored": ["F"]}
+        cindex = localrepo._containers_index()
+        self.assertEqual(cindex["containers"], {"ID": "R:T"})
+        self.assertFalse(mock_scan.called)
+        self.assertTrue(mock_lock.called)
+
+        mock_loadjson.reset_mock()
+        mock_stat.reset_mock()
+        cindex = localrepo._containers_index()
+        self.assertFalse(mock_loadjson.called)
+        self.assertFalse(mock_stat.called)
+
+        localrepo._containers_index_cache = None
+        mock_stat.return_value.st_mtime = 11.5
+        mock_scan.return_value = {"version": 1, "mtime": 10.5,
+                                  "containers": {"ID": "R:T", "ID2": "R:T"},
+                                  "names": {"N": "ID"}, "ignored": ["F"]}
+        cindex = localrepo._containers_index()
+        self.assertTrue(mock_scan.called)
+        self.assertEqual(cindex["containers"], {"ID": "R:T", "ID2": "R:T"})
+        mock_save.assert_called_with(localrepo.containers_index_file,
+                                     cindex)
+
+        mock_scan.reset_mock()
+        mock_loadjson.reset_mock()
+        localrepo._containers_index(rebuild=True)
+        self.assertTrue(mock_scan.called)
+        self.assertFalse(mock_loadjson.called)
+
+        mock_scan.reset_mock()
+        mock_isdir.return_value = False
+        localrepo._containers_index_cache = None
+        localrepo._containers_index()
+        self.assertTrue(mock_scan.called)
+
+    @mock.patch.object(udocker.LocalRepository, 'lock_index')
+    @mock.patch.object(udocker.LocalRepository, '_index_save')
+    @mock.patch.object(udocker.LocalRepository, '_containers_scan')
+    @mock.patch.object(udocker.LocalRepository, '_containers_index_valid')
+    @mock.patch.object(udocker.LocalRepository, '_containers_index_load')
+    @mock.patch('udocker.os.stat')
+    def test_51__containers_index_update(self, mock_stat, mock_load,
+                                         mock_valid, mock_scan, mock_save,
+                                         mock_lock):
+        """Test51 LocalRepository()._containers_index_update()."""
+        localrepo = self._localrepo(UDOCKER_TOPDIR)
+        cindex = {"version": 1, "mtime": 10.5,
+                  "containers": {"ID1": "R:T"}, "names": {"N1": "ID1"},
+                  "ignored": []}
+        mock_load.return_value = cindex
+        mock_valid.return_value = True
+        mock_stat.return_value.st_mtime = 12.5
+        mock_save.return_value = True
+        self.assertTrue(localrepo._containers_index_update("ID2", "R:T"))
+        self.assertEqual(cindex["containers"], {"ID1": "R:T", "ID2": "R:T"})
+        self.assertEqual(cindex["mtime"], 12.5)
+        self.assertTrue(mock_lock.called)
+        localrepo._containers_index_update("ID2", name="N2")
+        self.assertEqual(cindex["names"], {"N1": "ID1", "N2": "ID2"})
+        localrepo._containers_index_update(name="N1", remove=True)
+        localrepo._containers_index_update("ID1", remove=True)
+        self.assertEqual(cindex["containers"], {"ID2": "R:T"})
+        self.assertEqual(cindex["names"], {"N2": "ID2"})
+        self.assertFalse(mock_scan.called)
+
+        mock_valid.return_value = False
+        mock_scan.return_value = {"mtime": 13.5}
+        localrepo._containers_index_update("ID3", "R:T")
+        mock_save.assert_called_with(localrepo.containers_index_file,
+                                     {"mtime": 13.5})
+
+        mock_save.reset_mock()
+        mock_load.return_value = {"mtime": None}
+        self.assertFalse(localrepo._containers_index_update("ID3", "R:T"))
+        self.assertFalse(mock_save.called)
+
+    @mock.patch.object(udocker.LocalRepository, '_containers_scan')
+    @mock.patch.object(udocker.LocalRepository, '_layers_refs_scan')
+    @mock.patch('udocker.glob.glob')
+    @mock.patch('udocker.os.readlink')
+    @mock.patch('udocker.os.path.islink')
+    @mock.patch('udocker.os.lstat')
+    @mock.patch('udocker.os.path.getmtime')
+    @mock.patch('udocker.os.path.isdir')
+    @mock.patch('udocker.os.listdir')
+    def test_52_gc_garbage(self, mock_listdir, mock_isdir, mock_mtime,
+                           mock_lstat, mock_islink, mock_readlink,
+                           mock_glob, mock_refs, mock_scan):
+        """Test52 LocalRepository().gc_garbage()."""
+        localrepo = self._localrepo(UDOCKER_TOPDIR)
+        udocker.FileUtil.return_value.disk_usage.return_value = 10
+        mock_refs.return_value = {"layers": {"sha256:aa": ["R/T"]}}
+        mock_listdir.return_value = ["sha256:aa", "sha256:aa.idx",
+                                     "sha256:aa.tar", "sha256:bb",
+                                     "sha256:bb.idx", "sha256:cc",
+                                     "sha256:dd.tmp", "L1.layer", "L2.layer"]
+        mock_mtime.return_value = 0
+        mock_lstat.side_effect = lambda x: mock.Mock(
+            st_mtime=0 if "cc" not in x else 2e10)
+        mock_islink.side_effect = lambda x: x.endswith(".layer")
+        mock_readlink.side_effect = lambda x: (
+            "sha256:aa" if x.endswith("L1.layer") else "sha256:zz")
+        mock_glob.side_effect = lambda x: (
+            [localrepo.layersdir + "/sha256:dd.tmp"]
+            if x == localrepo.layersdir + "/*.tmp" else [])
+        mock_scan.return_value = {
+            "containers": {"ID1": "R:T", "ID2": "CLONING:inprogress",
+                           "ID3": "R:T"},
+            "names": {"N1": "ID1", "N2": "ID9"}}
+        mock_isdir.side_effect = lambda x: "ID3" not in x
+        with mock.patch.object(localrepo, "_isprotected") as mock_prot:
+            mock_prot.side_effect = lambda x: x.endswith("ID3")
+            garbage = localrepo.gc_garbage(60)
+        layersdir = localrepo.layersdir
+        self.assertEqual(sorted(garbage["layers"]),
+                         [(layersdir + "/L2.layer", 10),
+                          (layersdir + "/sha256:bb", 10),
+                          (layersdir + "/sha256:bb.idx", 10)])
+        self.assertEqual(garbage["tmp"], [(layersdir + "/sha256:dd.tmp", 10)])
+        self.assertEqual(garbage["containers"],
+                         [(localrepo.containersdir + "/ID2", 10)])
+        self.assertEqual(garbage["names"],
+                         [(localrepo.containersdir + "/N2", 0)])
+
+        mock_listdir.side_effect = OSError("no dir")
+        self.assertEqual(localrepo.gc_garbage(60), None)
+
+    @mock.patch.object(udocker.LocalRepository, '_layer_alias')
+    @mock.patch('udocker.os.remove')
+    @mock.patch('udocker.os.rename')
+    @mock.patch('udocker.os.path.exists')
+    @mock.patch('udocker.os.path.islink')
+    @mock.patch('udocker.ChkSUM')
+    @mock.patch('udocker.Msg')
+    def test_53_store_layer(self, mock_msg, mock_chksum, mock_islink,
+                            mock_exists, mock_rename, mock_remove,
+                            mock_alias):
+        """Test53 LocalRepository().store_layer()."""
+        localrepo = self._localrepo(UDOCKER_TOPDIR)
+        layer_file = localrepo.layersdir + "/sha256:aa"
+        mock_islink.return_value = False
+        mock_chksum.return_value.sha256.return_value = ""
+        self.assertEqual(localrepo.store_layer("/tmp/L.layer"), "")
+
+        mock_chksum.return_value.sha256.return_value = "aa"
+        mock_exists.return_value = False
+        status = localrepo.store_layer("/tmp/L.layer", "L.layer")
+        self.assertEqual(status, layer_file)
+        mock_rename.assert_called_once_with("/tmp/L.layer", layer_file)
+        mock_alias.assert_called_once_with(layer_file, "L.layer")
+
+        mock_rename.reset_mock()
+        mock_alias.reset_mock()
+        mock_exists.return_value = True
+        status = localrepo.store_layer("/tmp/L.layer")
+        self.assertEqual(status, layer_file)
+        self.assertFalse(mock_rename.called)
+        mock_remove.assert_called_once_with("/tmp/L.layer")
+        self.assertFalse(mock_alias.called)
+
+        mock_remove.reset_mock()
+        status = localrepo.store_layer("/tmp/L.layer", move=False)
+        self.assertEqual(status, layer_file)
+        self.assertFalse(mock_remove.called)
+
+        mock_exists.return_value = False
+        udocker.FileUtil.return_value.copyto.return_value = False
+        status = localrepo.store_layer("/tmp/L.layer", move=False)
+        self.assertEqual(status, "")
+        self.assertFalse(mock_rename.called)
+
+    @mock.patch('udocker.os.listdir')
+    @mock.patch('udocker.os.stat')
+    def test_54__containers_index_valid(self, mock_stat, mock_listdir):
+        """Test54 LocalRepository()._containers_index_valid()."""
+        localrepo = self._localrepo(UDOCKER_TOPDIR)
+        mock_stat.return_value.st_mtime = 10.5
+        cindex = {"version": localrepo.CONTAINERS_INDEX_VERSION,
+                  "mtime": 10.5, "containers": {"ID": "R:T"},
+                  "names": {"N": "ID"}, "ignored": []}
+        self.assertTrue(localrepo._containers_index_valid(cindex))
+        self.assertEqual(mock_stat.call_count, 1)
+        self.assertFalse(mock_listdir.called)
+        mock_stat.return_value.st_mtime = 11.5
+        self.assertFalse(localrepo._containers_index_valid(cindex))
+        mock_stat.side_effect = OSError
+        self.assertFalse(localrepo._containers_index_valid(cindex))
+        mock_stat.side_effect = None
+        self.assertFalse(localrepo._containers_index_valid(None))
+        self.assertFalse(localrepo._containers_index_valid({}))
+
+    def test_55__layer_alias_remove(self):
+        """Test55 LocalRepository()._layer_alias_remove()."""
+        localrepo = self._localrepo(UDOCKER_TOPDIR)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            localrepo.layersdir = tmpdir
+            for fname in ("sha256:aa", "sha256:bb"):
+                open(tmpdir + '/' + fname, "w").close()
+            os.symlink("sha256:aa", tmpdir + "/ID1.layer")
+            os.symlink("sha256:bb", tmpdir + "/ID2.layer")
+            os.remove(tmpdir + "/sha256:aa")
+            self.assertTrue(localrepo._layer_alias_remove(["sha256:aa"]))
+            self.assertEqual(sorted(os.listdir(tmpdir)),
+                             ["ID2.layer", "sha256:bb"])
+        finally:
+            shutil.rmtree(tmpdir)
+        localrepo.layersdir = tmpdir
+        self.assertFalse(localrepo._layer_alias_remove(["sha256:aa"]))
+
 
 class CurlHeaderTestCase(unittest.TestCase):
     """Test CurlHeader() http header parser."""
@@ -5986,6 +7570,8 @@ class DockerIoAPITestCase(unittest.TestCase):
         self.assertTrue(uia.search_pause)
         self.assertEqual(uia.search_page, 0)
         self.assertFalse(uia.search_ended)
+        self.assertFalse(mock_geturl.called)
+        self.assertEqual(uia.curl, mock_geturl.return_value)
         self.assertTrue(mock_geturl.called)
 
     @mock.patch('udocker.GetURL')
@@ -6317,6 +7903,17 @@ class DockerIoAPITestCase(unittest.TestCase):
         out = doia.get_v2_layers_all(imagerepo, fslayers)
         self.assertEqual(out, [])
 
+        mock_v2img.return_value = True
+        mock_local.layersdir = "/LAYERS"
+        fslayers = [{"digest": "sha256:aa"}, {"blobSum": "sha256:bb"}]
+        with mock.patch('udocker.ChkSUM') as mock_chksum:
+            with mock.patch('udocker.os.path.exists') as mock_exists:
+                mock_exists.side_effect = lambda x: x.endswith("aa")
+                out = doia.get_v2_layers_all(imagerepo, fslayers)
+            mock_chksum.return_value.hash_many.assert_called_once_with(
+                ["/LAYERS/sha256:aa"], "sha256")
+        self.assertEqual(out, ["sha256:bb", "sha256:aa"])
+
         # mock_v2img.return_value = True
         # imagerepo = "docker.io"
         # fslayers = ["a", "b"]
@@ -6828,11 +8425,14 @@ class DockerLocalFileAPITestCase(unittest.TestCase):
         mock_local.setup_tag.return_value = "TAGDIR"
         mock_local.set_version.return_value = True
         mock_unique.return_value.layer_v1.return_value = "LAYERID"
+        mock_local.store_layer.return_value = "LAYERDIR/sha256:aa"
         status = dlocapi.import_toimage("TARFILE", "IMAGE", "TAG")
         self.assertEqual(status, "LAYERID")
-        self.assertTrue(mock_rename.called)
+        mock_local.store_layer.assert_called_with("TARFILE", "LAYERID.layer",
+                                                  True)
+        mock_local.add_image_layer.assert_any_call("LAYERDIR/sha256:aa",
+                                                   "LAYERID.layer")
 
-        mock_rename.reset_mock()
         dlocapi = udocker.DockerLocalFileAPI(mock_local)
         mock_exists.return_value = True
         mock_local.cd_imagerepo.return_value = ""
@@ -6841,7 +8441,12 @@ class DockerLocalFileAPITestCase(unittest.TestCase):
         mock_unique.return_value.layer_v1.return_value = "LAYERID"
         status = dlocapi.import_toimage("TARFILE", "IMAGE", "TAG", False)
         self.assertEqual(status, "LAYERID")
-        self.assertFalse(mock_rename.called)
+        mock_local.store_layer.assert_called_with("TARFILE", "LAYERID.layer",
+                                                  False)
+
+        mock_local.store_layer.return_value = ""
+        status = dlocapi.import_toimage("TARFILE", "IMAGE", "TAG")
+        self.assertFalse(status)
 
     # def test_12_import_tocontainer(self):
     #     """Test12 DockerLocalFileAPI().import_tocontainer()."""
@@ -6855,6 +8460,75 @@ class DockerLocalFileAPITestCase(unittest.TestCase):
     #     """Test14 DockerLocalFileAPI().clone_container()."""
     #     pass
 
+    @mock.patch('udocker.LocalRepository')
+    def test_15__squash_hidden(self, mock_local):
+        """Test15 DockerLocalFileAPI()._squash_hidden()."""
+        self._init()
+        dlocapi = udocker.DockerLocalFileAPI(mock_local)
+        hidden = (set(["etc/b"]), set(["opt"]), set(["lib"]))
+        self.assertTrue(dlocapi._squash_hidden("etc/b", *hidden))
+        self.assertTrue(dlocapi._squash_hidden("etc/b/c", *hidden))
+        self.assertTrue(dlocapi._squash_hidden("opt/x", *hidden))
+        self.assertTrue(dlocapi._squash_hidden("lib/x", *hidden))
+        self.assertFalse(dlocapi._squash_hidden("opt", *hidden))
+        self.assertFalse(dlocapi._squash_hidden("lib", *hidden))
+        self.assertFalse(dlocapi._squash_hidden("etc/a", *hidden))
+
+    @mock.patch('udocker.Msg')
+    @mock.patch('udocker.LocalRepository')
+    def test_16__squash_layers(self, mock_local, mock_msg):
+        """Test16 DockerLocalFileAPI()._squash_layers()."""
+        self._init()
+        mock_msg.level = 0
+        mock_local.get_uncompressed_layer.side_effect = lambda x: x
+        tmpdir = tempfile.mkdtemp()
+        layer1 = make_layer(tmpdir, "layer1", [
+            ("etc/a", b"a1", tarfile.REGTYPE, ""),
+            ("etc/b", b"b1", tarfile.REGTYPE, ""),
+            ("opt/x", b"x", tarfile.REGTYPE, ""),
+            ("hard", None, tarfile.LNKTYPE, "etc/a"), ], "w:gz")
+        layer2 = make_layer(tmpdir, "layer2", [
+            ("etc/a", b"a2", tarfile.REGTYPE, ""),
+            ("etc/.wh.b", b"", tarfile.REGTYPE, ""),
+            ("opt/.wh..wh..opq", b"", tarfile.REGTYPE, ""),
+            ("opt/y", b"y", tarfile.REGTYPE, ""), ])
+        squashed = tmpdir + "/squashed"
+        dlocapi = udocker.DockerLocalFileAPI(mock_local)
+        status = dlocapi._squash_layers([layer1, layer2], squashed)
+        self.assertTrue(status)
+        tarf = tarfile.open(squashed)
+        members = dict([(tarinfo.name, tarf.extractfile(tarinfo).read())
+                        for tarinfo in tarf if tarinfo.isreg()])
+        tarf.close()
+        self.assertEqual(members, {"etc/a": b"a2", "opt/y": b"y",
+                                   "hard": b"a1"})
+        layer3 = tmpdir + "/layer3"
+        with open(layer3, "wb") as filep:
+            filep.write(b"not a tar file")
+        status = dlocapi._squash_layers([layer1, layer3], squashed)
+        self.assertFalse(status)
+        tarf = tarfile.open(squashed)
+        self.assertEqual(tarf.getmembers(), [])
+        tarf.close()
+        for filename in (layer1, layer2, layer3, squashed):
+            os.remove(filename)
+        os.rmdir(tmpdir)
+
+    @mock.patch('udocker.time.gmtime')
+    @mock.patch('udocker.LocalRepository')
+    def test_17__squash_config(self, mock_local, mock_gmtime):
+        """Test17 DockerLocalFileAPI()._squash_config()."""
+        self._init()
+        mock_gmtime.return_value = time.struct_time(
+            (2019, 1, 2, 3, 4, 5, 2, 2, 0))
+        dlocapi = udocker.DockerLocalFileAPI(mock_local)
+        config = dlocapi._squash_config(
+            {"id": "X", "architecture": "amd64", "os": "linux"}, "sha256:D")
+        self.assertEqual(config["history"][0]["created"],
+                         "2019-01-02T03:04:05.000000000Z")
+        self.assertEqual(config["rootfs"]["diff_ids"], ["sha256:D"])
+        self.assertFalse("id" in config)
+
 
 ##
 ## OciLocalFileAPITestCase
@@ -7282,25 +8956,93 @@ class UdockerTestCase(unittest.TestCase):
         mock_msg.level = 0
         udoc = udocker.Udocker(mock_local)
         mock_cmdp.missing_options.return_value = True
-        mock_cmdp.get.side_effect = ["", "", "" "", "", ]
+        mock_cmdp.get.side_effect = ["", "", "", "", "", ]
         mock_create.return_value = ""
         status = udoc.do_create(mock_cmdp)
         self.assertFalse(status)
 
         udoc = udocker.Udocker(mock_local)
         mock_cmdp.missing_options.return_value = False
-        mock_cmdp.get.side_effect = ["", "", "" "", "", ]
+        mock_cmdp.get.side_effect = ["", "", "", "", "", ]
         mock_create.return_value = ""
         status = udoc.do_create(mock_cmdp)
         self.assertFalse(status)
 
         udoc = udocker.Udocker(mock_local)
         mock_cmdp.missing_options.return_value = False
-        mock_cmdp.get.side_effect = ["", "", "" "", "", ]
+        mock_cmdp.get.side_effect = ["", "", "", "", "", ]
         mock_create.return_value = "CONTAINER_ID"
         status = udoc.do_create(mock_cmdp)
         self.assertTrue(status)
 
+        udoc = udocker.Udocker(mock_local)
+        mock_cmdp.get.side_effect = ["IMAGE", "", "0", "job", "", ]
+        status = udoc.do_create(mock_cmdp)
+        self.assertFalse(status)
+
+        udoc = udocker.Udocker(mock_local)
+        mock_cmdp.get.side_effect = ["IMAGE", "", "3", "job", "f3", ]
+        mock_create.return_value = "CONTAINER_ID"
+        with mock.patch.object(udoc, "_create_many") as mock_many:
+            mock_many.return_value = True
+            status = udoc.do_create(mock_cmdp)
+            self.assertTrue(status)
+            mock_many.assert_called_with("CONTAINER_ID", 3, "job", "F3")
+
+        udoc = udocker.Udocker(mock_local)
+        mock_cmdp.get.side_effect = ["IMAGE", "", "", "", "X9", ]
+        mock_create.reset_mock()
+        status = udoc.do_create(mock_cmdp)
+        self.assertFalse(status)
+        self.assertFalse(mock_create.called)
+
+        udoc = udocker.Udocker(mock_local)
+        mock_cmdp.get.side_effect = ["IMAGE", "", "", "", "F3", ]
+        mock_create.return_value = "CONTAINER_ID"
+        with mock.patch.object(udoc, "_create_setmode") as mock_setmode:
+            mock_setmode.return_value = [False]
+            status = udoc.do_create(mock_cmdp)
+            self.assertFalse(status)
+            mock_setmode.assert_called_with(["CONTAINER_ID"], "F3")
+
+    @mock.patch('udocker.ContainerStructure')
+    @mock.patch('udocker.Msg')
+    @mock.patch('udocker.LocalRepository')
+    def test_13__create_many(self, mock_local, mock_msg, mock_cstruct):
+        """Test13 Udocker()._create_many()."""
+        self._init()
+        mock_msg.level = 0
+        udoc = udocker.Udocker(mock_local)
+        mock_cstruct.return_value.clone_many.return_value = ["ID2", "ID3"]
+        mock_local.set_container_name.return_value = True
+        status = udoc._create_many("ID1", 3, "job")
+        self.assertTrue(status)
+        mock_cstruct.return_value.clone_many.assert_called_with(2)
+        mock_local.set_container_name.assert_called_with("ID3", "job-3")
+
+        mock_cstruct.return_value.clone_many.return_value = ["ID2", False]
+        status = udoc._create_many("ID1", 3, "")
+        self.assertFalse(status)
+
+    @mock.patch('udocker.Msg')
+    @mock.patch('udocker.ExecutionMode')
+    @mock.patch('udocker.LocalRepository')
+    def test_13__create_setmode(self, mock_local, mock_xmode, mock_msg):
+        """Test13 Udocker()._create_setmode()."""
+        self._init()
+        udoc = udocker.Udocker(mock_local)
+        self.assertEqual(udoc._create_setmode(["ID1"], None), ["ID1"])
+        self.assertFalse(mock_xmode.called)
+
+        xmodes = {"ID1": mock.MagicMock(), "ID3": mock.MagicMock()}
+        xmodes["ID1"].set_mode.return_value = True
+        xmodes["ID3"].set_mode.return_value = False
+        mock_xmode.side_effect = lambda localrepo, cid: xmodes[cid]
+        status = udoc._create_setmode(["ID1", False, "ID3"], "F3")
+        self.assertEqual(status, ["ID1", False, False])
+        xmodes["ID1"].set_mode.assert_called_with("F3")
+        mock_local.del_container.assert_called_once_with("ID3", force=True)
+
     @mock.patch('udocker.ContainerStructure')
     @mock.patch('udocker.Udocker._check_imagespec')
     @mock.patch('udocker.DockerIoAPI')
@@ -7633,6 +9375,13 @@ class UdockerTestCase(unittest.TestCase):
         status = udoc.do_rmi(mock_cmdp)
         self.assertTrue(status)
 
+        udoc = udocker.Udocker(mock_local)
+        mock_cmdp.get.side_effect = ["", True, "", ]
+        mock_local.rebuild_layers_refs.return_value = True
+        status = udoc.do_rmi(mock_cmdp)
+        self.assertTrue(status)
+        self.assertTrue(mock_local.rebuild_layers_refs.called)
+
     @mock.patch('udocker.Udocker._check_imagespec')
     @mock.patch('udocker.CmdParser')
     @mock.patch('udocker.KeyStore')
@@ -7908,6 +9657,17 @@ class UdockerTestCase(unittest.TestCase):
         status = udoc.do_verify(mock_cmdp)
         self.assertTrue(status)
 
+        udoc = udocker.Udocker(mock_local)
+        mock_cmdp.get.side_effect = [True, ]
+        mock_local.get_imagerepos.return_value = [("I1", "T1"), ("I2", "T2")]
+        mock_local.verify_image.reset_mock()
+        mock_local.verify_image.side_effect = [True, False]
+        status = udoc.do_verify(mock_cmdp)
+        self.assertFalse(status)
+        verified = mock_local.verify_image.call_args_list[0][0][0]
+        self.assertTrue(verified is
+                        mock_local.verify_image.call_args_list[1][0][0])
+
     # @mock.patch('udocker.ExecutionMode')
     # @mock.patch('udocker.CmdParser')
     # @mock.patch('udocker.KeyStore')
@@ -8025,6 +9785,121 @@ class UdockerTestCase(unittest.TestCase):
         version = udoc.do_version(mock_cmdp)
         self.assertIsNotNone(version)
 
+    @mock.patch('udocker.Udocker._check_imagespec')
+    @mock.patch('udocker.CmdParser')
+    @mock.patch('udocker.KeyStore')
+    @mock.patch('udocker.LocalFileAPI')
+    @mock.patch('udocker.DockerIoAPI')
+    @mock.patch('udocker.Msg')
+    @mock.patch('udocker.LocalRepository')
+    def test_32_do_squash(self, mock_local, mock_msg, mock_dioapi,
+                          mock_locapi, mock_ks, mock_cmdp, mock_chkimg):
+        """Test32 Udocker().do_squash()."""
+        self._init()
+        mock_msg.level = 0
+        udoc = udocker.Udocker(mock_local)
+        mock_cmdp.missing_options.return_value = False
+        mock_cmdp.get.side_effect = ["IMAGE:TAG", "", ]
+        mock_chkimg.return_value = ("IMAGE", "TAG")
+        mock_local.isprotected_imagerepo.return_value = True
+        status = udoc.do_squash(mock_cmdp)
+        self.assertFalse(status)
+
+        mock_cmdp.get.side_effect = ["IMAGE:TAG", "NEWTAG", ]
+        mock_locapi.return_value.squash.return_value = True
+        status = udoc.do_squash(mock_cmdp)
+        self.assertTrue(status)
+        mock_locapi.return_value.squash.assert_called_with(
+            "IMAGE", "TAG", None, "NEWTAG")
+
+        mock_cmdp.get.side_effect = ["IMAGE:TAG", "NEWIMAGE:NEWTAG", ]
+        mock_chkimg.side_effect = [("IMAGE", "TAG"), ("NEWIMAGE", "NEWTAG")]
+        mock_locapi.return_value.squash.return_value = False
+        status = udoc.do_squash(mock_cmdp)
+        self.assertFalse(status)
+        mock_locapi.return_value.squash.assert_called_with(
+            "IMAGE", "TAG", "NEWIMAGE", "NEWTAG")
+
+    @mock.patch('udocker.ImageIndex')
+    @mock.patch('udocker.Udocker._check_imagespec')
+    @mock.patch('udocker.CmdParser')
+    @mock.patch('udocker.KeyStore')
+    @mock.patch('udocker.DockerLocalFileAPI')
+    @mock.patch('udocker.DockerIoAPI')
+    @mock.patch('udocker.Msg')
+    @mock.patch('udocker.LocalRepository')
+    def test_31_do_cat(self, mock_local, mock_msg, mock_dioapi,
+                       mock_dlocapi, mock_ks, mock_cmdp, mock_chkimg,
+                       mock_iindex):
+        """Test31 Udocker().do_cat()."""
+        self._init()
+        mock_msg.level = 0
+        udoc = udocker.Udocker(mock_local)
+        mock_cmdp.missing_options.return_value = True
+        mock_cmdp.get.side_effect = ["IMAGE:TAG", "/etc/os-release", ]
+        status = udoc.do_cat(mock_cmdp)
+        self.assertFalse(status)
+
+        mock_cmdp.missing_options.return_value = False
+        mock_cmdp.get.side_effect = ["IMAGE:TAG", "", ]
+        mock_chkimg.return_value = ("IMAGE", "TAG")
+        status = udoc.do_cat(mock_cmdp)
+        self.assertFalse(status)
+
+        mock_cmdp.get.side_effect = ["IMAGE:TAG", "/etc/os-release", ]
+        mock_iindex.return_value.select.return_value = False
+        status = udoc.do_cat(mock_cmdp)
+        self.assertFalse(status)
+
+        mock_cmdp.get.side_effect = ["IMAGE:TAG", "/etc/os-release", ]
+        mock_iindex.return_value.select.return_value = True
+        mock_iindex.return_value.copyto.return_value = False
+        status = udoc.do_cat(mock_cmdp)
+        self.assertFalse(status)
+
+        mock_cmdp.get.side_effect = ["IMAGE:TAG", "/etc/os-release", ]
+        mock_iindex.return_value.copyto.return_value = True
+        status = udoc.do_cat(mock_cmdp)
+        self.assertTrue(status)
+        self.assertEqual(mock_iindex.return_value.copyto.call_args[0][0],
+                         "/etc/os-release")
+
+    @mock.patch('udocker.CmdParser')
+    @mock.patch('udocker.KeyStore')
+    @mock.patch('udocker.DockerLocalFileAPI')
+    @mock.patch('udocker.DockerIoAPI')
+    @mock.patch('udocker.Msg')
+    @mock.patch('udocker.LocalRepository')
+    def test_33_do_gc(self, mock_local, mock_msg, mock_dioapi,
+                      mock_dlocapi, mock_ks, mock_cmdp):
+        """Test33 Udocker().do_gc()."""
+        self._init()
+        mock_msg.level = 0
+        udoc = udocker.Udocker(mock_local)
+        mock_cmdp.missing_options.return_value = False
+        mock_cmdp.get.side_effect = [False, "x", ]
+        status = udoc.do_gc(mock_cmdp)
+        self.assertFalse(status)
+
+        garbage = {"layers": [("/L/sha256:aa", 2048)], "tmp": [],
+                   "containers": [("/C/ID", 4096)], "names": []}
+        mock_local.gc_garbage.return_value = garbage
+        mock_cmdp.get.side_effect = [True, "", ]
+        status = udoc.do_gc(mock_cmdp)
+        self.assertTrue(status)
+        mock_local.gc_garbage.assert_called_with(None)
+        self.assertFalse(mock_local.gc_remove.called)
+
+        mock_cmdp.get.side_effect = [False, "60", ]
+        mock_local.gc_remove.return_value = True
+        status = udoc.do_gc(mock_cmdp)
+        self.assertTrue(status)
+        mock_local.gc_garbage.assert_called_with(60)
+        self.assertEqual(sorted(mock_local.gc_remove.call_args_list),
+                         [mock.call("containers", "/C/ID"),
+                          mock.call("layers", "/L/sha256:aa")])
+
+
 
 class CmdParserTestCase(unittest.TestCase):
     """Test CmdParserTestCase() command line interface."""
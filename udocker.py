@@ -24,6 +24,7 @@ import sys
 import os
 import stat
 import string
+import struct
 import re
 import subprocess
 import time
@@ -34,6 +35,9 @@ import glob
 import select
 import ast
 import ctypes
+import tarfile
+import threading
+import zlib
 
 __author__ = "udocker@lip.pt"
 __copyright__ = "Copyright 2019, LIP"
@@ -56,25 +60,33 @@ try:
 except ImportError:
     from io import BytesIO as cStringIO
 try:
-    import pycurl
+    import random
 except ImportError:
     pass
 try:
-    import uuid
+    import base64
 except ImportError:
     pass
 try:
-    import random
+    import hashlib
 except ImportError:
     pass
 try:
-    import base64
+    import fcntl
 except ImportError:
     pass
 try:
-    import hashlib
+    import bz2
 except ImportError:
     pass
+try:
+    import lzma
+except ImportError:
+    pass
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 try:
     from getpass import getpass
 except ImportError:
@@ -92,6 +104,33 @@ except ImportError:
         pass
 
 
+class LazyImport(object):
+    """Module imported when one of its attributes is first used, for
+    modules that are slow to load and not needed by most commands.
+    If the module is not available NameError is raised on use, as for
+    a name that was not imported.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        """Import the module and get the attribute"""
+        if attr.startswith("__") or attr in ("_name", "_module"):
+            raise AttributeError(attr)
+        if self._module is None:
+            try:
+                self._module = __import__(self._name)
+            except ImportError:
+                raise NameError("name '%s' is not defined" % self._name)
+        return getattr(self._module, attr)
+
+
+pycurl = LazyImport("pycurl")
+uuid = LazyImport("uuid")
+
+
 class Config(object):
     """Default configuration values for the whole application. Changes
     to these values should be made via a configuration file read via
@@ -136,6 +175,9 @@ class Config(object):
     config = "udocker.conf"
     keystore = "keystore"
 
+    # host capabilities cached in topdir, empty disables the file
+    host_cache = "host.cache"
+
     # for tmp files only
     tmpdir = "/tmp"
 
@@ -182,6 +224,10 @@ class Config(object):
     # translate symbolic links in pathnames None means automatic
     fakechroot_expand_symlinks = None
 
+    # F3 and F4 modes pad the container root path set in the executables
+    # to this length so that moved containers can be changed in place
+    patch_root_len = 256
+
     # sharable library directories
     lib_dirs_list_x86_64 = (
         "/usr/lib/x86_64-linux-gnu", "/usr/lib64",
@@ -234,6 +280,10 @@ class Config(object):
     timeout = 12                  # default timeout (secs)
     download_timeout = 30 * 60    # file download timeout (secs)
     ctimeout = 6                  # default TCP connect timeout (secs)
+    workers = 0                   # parallel workers, 0 = number of cpus
+    uncompressed_layers = False   # keep uncompressed copy of layers
+    gc_grace = 3600               # gc ignores files newer than (seconds)
+    disk_usage_max_age = 3600     # cached container sizes expire (seconds)
     http_agent = ""
     http_insecure = False
     use_curl_executable = ""
@@ -299,6 +349,10 @@ class Config(object):
         Config.fakechroot_so = os.getenv("UDOCKER_FAKECHROOT_SO",
                                          Config.fakechroot_so)
         Config.tmpdir = os.getenv("UDOCKER_TMP", Config.tmpdir)
+        try:
+            Config.workers = int(os.getenv("UDOCKER_WORKERS", Config.workers))
+        except (TypeError, ValueError):
+            Msg().err("Error: in UDOCKER_WORKERS")
         Config.keystore = os.getenv("UDOCKER_KEYSTORE", Config.keystore)
         Config.use_curl_executable = os.getenv("UDOCKER_USE_CURL_EXECUTABLE",
                                                Config.use_curl_executable)
@@ -446,11 +500,148 @@ class Uprocess(object):
         return not (proc_1.returncode or proc_2.returncode)
 
 
+class WorkerPool(object):
+    """Apply a function to a list of arguments using a pool of threads.
+    The work done by udocker in parallel is I/O or runs in external
+    processes, therefore threads are enough to use several cpus.
+    Results are returned in the same order as the arguments.
+    """
+
+    def __init__(self, workers=None):
+        try:
+            workers = int(workers or Config.workers or HostInfo().cpu_count())
+        except (TypeError, ValueError):
+            workers = 1
+        self.workers = max(workers, 1)
+        self._stop = threading.Event()
+        self._error = []
+
+    def _worker(self, function, work, results, stop_on):
+        """Thread processing arguments from the work queue"""
+        while not self._stop.is_set():
+            try:
+                (idx, arg) = work.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[idx] = function(arg)
+            except Exception as error:            # re-raised by map()
+                self._error.append(error)
+                self._stop.set()
+                return
+            if stop_on is not None and stop_on(results[idx]):
+                self._stop.set()
+
+    def map(self, function, args_list, stop_on=None):
+        """Apply function to each argument and return the list of results.
+        If stop_on(result) is True the remaining arguments are not
+        processed and their results are None.
+        """
+        args_list = list(args_list)
+        results = [None] * len(args_list)
+        self._stop.clear()
+        self._error = []
+        if self.workers == 1 or len(args_list) < 2:
+            for (idx, arg) in enumerate(args_list):
+                results[idx] = function(arg)
+                if stop_on is not None and stop_on(results[idx]):
+                    break
+            return results
+        work = queue.Queue()
+        for (idx, arg) in enumerate(args_list):
+            work.put((idx, arg))
+        threads = []
+        for dummy in range(min(self.workers, len(args_list))):
+            thread = threading.Thread(target=self._worker,
+                                      args=(function, work, results, stop_on))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            self._stop.set()
+            raise
+        if self._error:
+            raise self._error[0]
+        return results
+
+
 class HostInfo(object):
-    """Get information from the host system"""
+    """Get information from the host system.
+    Facts that need subprocesses or system calls are kept in a cache
+    shared by all instances and stored in Config.topdir. The cache is
+    discarded when the kernel changes, each entry also has a stamp such
+    as the mtime of the executable that was probed.
+    """
 
     uid = os.getuid()
     gid = os.getgid()
+    _cache = None
+    _cache_lock = threading.Lock()
+
+    def _cache_file(self):
+        """Pathname of the cache file or empty if not to be stored"""
+        try:
+            if (isinstance(Config.topdir, str) and
+                    isinstance(Config.host_cache, str) and
+                    Config.host_cache and os.path.isdir(Config.topdir)):
+                return Config.topdir + '/' + Config.host_cache
+        except (TypeError, AttributeError):
+            pass
+        return ""
+
+    def _cache_load(self):
+        """Load the cache file, return empty if for another kernel"""
+        host = list(os.uname()[2:])
+        cache = None
+        cache_file = self._cache_file()
+        if cache_file:
+            try:
+                with open(cache_file) as filep:
+                    cache = json.load(filep)
+            except (IOError, OSError, TypeError, ValueError, NameError):
+                pass
+        if not (isinstance(cache, dict) and cache.get("host") == host):
+            cache = {"host": host}
+        return cache
+
+    def _cache_save(self, cache):
+        """Write the cache file replacing the previous one"""
+        cache_file = self._cache_file()
+        if not cache_file:
+            return False
+        tmp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+        try:
+            with open(tmp_file, "w") as filep:
+                json.dump(cache, filep)
+            os.rename(tmp_file, cache_file)
+        except (IOError, OSError, TypeError, ValueError, NameError):
+            try:
+                os.remove(tmp_file)
+            except (IOError, OSError):
+                pass
+            return False
+        return True
+
+    def cached(self, section, key, stamp, func):
+        """Get a value from the cache, func() is called to obtain the
+        value if the entry does not exist or has a different stamp
+        """
+        with HostInfo._cache_lock:
+            if HostInfo._cache is None:
+                HostInfo._cache = self._cache_load()
+            entry = HostInfo._cache.get(section, {}).get(key)
+        if entry and entry[0] == stamp:
+            return entry[1]
+        value = func()
+        with HostInfo._cache_lock:
+            HostInfo._cache.setdefault(section, {})[key] = [stamp, value]
+            cache = json.loads(json.dumps(HostInfo._cache))
+        self._cache_save(cache)
+        return value
 
     def username(self):
         """Get username"""
@@ -461,6 +652,10 @@ class HostInfo(object):
 
     def arch(self):
         """Get the host system architecture"""
+        return self.cached("platform", "arch", sys.executable, self._arch)
+
+    def _arch(self):
+        """Get the host system architecture from platform"""
         arch = ""
         try:
             machine = platform.machine()
@@ -483,6 +678,10 @@ class HostInfo(object):
 
     def osversion(self):
         """Get operating system"""
+        return self.cached("platform", "osversion", None, self._osversion)
+
+    def _osversion(self):
+        """Get operating system from platform"""
         try:
             return platform.system().lower()
         except (NameError, AttributeError):
@@ -490,11 +689,20 @@ class HostInfo(object):
 
     def osdistribution(self):
         """Get operating system distribution"""
+        return tuple(self.cached("platform", "osdistribution", None,
+                                 self._osdistribution))
+
+    def _osdistribution(self):
+        """Get operating system distribution from platform"""
         (distribution, version, dummy) = platform.linux_distribution()
         return (distribution.split(' ')[0], version.split('.')[0])
 
     def oskernel(self):
         """Get operating system"""
+        return self.cached("platform", "oskernel", None, self._oskernel)
+
+    def _oskernel(self):
+        """Get operating system kernel release from platform"""
         try:
             return platform.release()
         except (NameError, AttributeError):
@@ -511,8 +719,17 @@ class HostInfo(object):
                 return False
         return True
 
+    def _cmd_options(self, cmd):
+        """Get the words in the help output of a command"""
+        out = Uprocess().get_output(cmd)
+        if not out:
+            return []
+        return [word for word in re.split(r"[=|\*\[\]\n,; ]+", out) if word]
+
     def cmd_has_option(self, executable, search_option, arg=None):
-        """Check if executable has a given cli option"""
+        """Check if executable has a given cli option, the help output
+        is cached per executable pathname and mtime
+        """
         if not executable:
             return False
         arg_list = []
@@ -520,10 +737,31 @@ class HostInfo(object):
             arg_list = [arg]
         elif isinstance(arg, list):
             arg_list = arg
-        out = Uprocess().get_output([executable] + arg_list + ["--help"])
-        if out and search_option in re.split(r"[=|\*\[\]\n,; ]*", out):
-            return True
-        return False
+        cmd = [executable] + arg_list + ["--help"]
+        exec_path = executable
+        if '/' not in executable:
+            for directory in os.getenv("PATH", "").split(':'):
+                if os.access(directory + '/' + executable, os.X_OK):
+                    exec_path = directory + '/' + executable
+                    break
+        try:
+            stamp = os.stat(exec_path).st_mtime
+        except (OSError, TypeError):
+            return search_option in self._cmd_options(cmd)
+        return search_option in self.cached(
+            "options", ' '.join([exec_path] + cmd[1:]), stamp,
+            lambda: self._cmd_options(cmd))
+
+    def cpu_count(self):
+        """Get the number of cpus available to this process"""
+        try:
+            return len(os.sched_getaffinity(0))
+        except (AttributeError, OSError):
+            pass
+        try:
+            return max(int(os.sysconf("SC_NPROCESSORS_ONLN")), 1)
+        except (AttributeError, OSError, ValueError):
+            return 1
 
     def termsize(self):
         """Get guest operating system terminal size"""
@@ -554,6 +792,53 @@ class GuestInfo(object):
     def __init__(self, root_dir):
         self._root_dir = root_dir
 
+    _magic = ((b"\x1f\x8b", "gzip compressed data"),
+              (b"\x28\xb5\x2f\xfd", "Zstandard compressed data"),
+              (b"BZh", "bzip2 compressed data"),
+              (b"\xfd7zXZ\x00", "XZ compressed data"), )
+    _shells = {"sh": "POSIX shell", "bash": "Bourne-Again shell",
+               "zsh": "Paul Falstad's zsh", "csh": "C shell",
+               "tcsh": "Tenex C shell", }
+
+    @staticmethod
+    def _get_filetype(filename):
+        """Identify a file from its content like the file command does
+        for ELF files, compressed data, tar archives and scripts
+        """
+        filetype = ElfFile(filename).get_filetype()
+        if filetype:
+            return filetype
+        try:
+            with open(filename, "rb") as filep:
+                data = filep.read(512)
+        except (IOError, OSError):
+            return "cannot open"
+        if not data:
+            return "empty"
+        for (magic, filetype) in GuestInfo._magic:
+            if data.startswith(magic):
+                return filetype
+        if data[257:265] == b"ustar  \0":
+            return "POSIX tar archive (GNU)"
+        if data[257:262] == b"ustar":
+            return "POSIX tar archive"
+        if data.startswith(b"#!"):
+            hashbang = data[2:].split(b"\n", 1)[0].strip()
+            if not isinstance(hashbang, str):
+                hashbang = hashbang.decode("utf-8", "replace")
+            shell = os.path.basename(hashbang.split(' ')[0])
+            if shell in GuestInfo._shells:
+                filetype = GuestInfo._shells[shell] + " script"
+            else:
+                filetype = "a %s script" % hashbang
+            if os.access(filename, os.X_OK):
+                return filetype + ", ASCII text executable"
+            return filetype + ", ASCII text"
+        if not bytearray(data).translate(None, bytearray(b"\t\n\r") +
+                                         bytearray(range(32, 127))):
+            return "ASCII text"
+        return "data"
+
     def get_filetype(self, filename):
         """Get the file architecture"""
         if not filename.startswith(self._root_dir):
@@ -564,7 +849,7 @@ class GuestInfo(object):
                 f_path = os.path.dirname(filename) + '/' + f_path
             return self.get_filetype(f_path)
         if os.path.isfile(filename):
-            return Uprocess().get_output(["file", filename])
+            return filename + ": " + self._get_filetype(filename)
         return ""
 
     def arch(self):
@@ -923,7 +1208,20 @@ class Unique(object):
 
 
 class ChkSUM(object):
-    """Checksumming for files"""
+    """Checksumming for files. Computed digests of the files in the
+    cache_dir (the layers directory) are cached in an extended attribute
+    of the file or if not supported in the sidecar cache_file, keyed by
+    device, inode, size and mtime. While the key does not change the
+    digest is not computed again. Other files are never cached.
+    """
+
+    CHUNK = 1024 * 1024
+    CACHE_MAX = 10000
+    XATTR = "user.udocker."
+    cache_file = None
+    cache_dir = None
+    _cache = None
+    _cache_lock = threading.Lock()
 
     def __init__(self):
         self._algorithms = dict()
@@ -942,7 +1240,7 @@ class ChkSUM(object):
         """hash calculation using hashlib"""
         try:
             with open(filename, "rb") as filep:
-                for chunk in iter(lambda: filep.read(4096), b""):
+                for chunk in iter(lambda: filep.read(ChkSUM.CHUNK), b""):
                     algorithm.update(chunk)
             return algorithm.hexdigest()
         except (IOError, OSError):
@@ -977,17 +1275,170 @@ class ChkSUM(object):
 
     def sha256(self, filename):
         """Call the actual implementation selected in __init__"""
-        return self._algorithms["sha256"](filename)
+        return self.hash(filename, "sha256")
 
     def sha512(self, filename):
         """Call the actual implementation selected in __init__"""
-        return self._algorithms["sha512"](filename)
+        return self.hash(filename, "sha512")
+
+    def _cache_key(self, filename):
+        """Key identifying the current content of a file, empty for
+        files outside of the cache_dir
+        """
+        try:
+            if not (ChkSUM.cache_dir and
+                    os.path.dirname(os.path.realpath(filename)) ==
+                    os.path.realpath(ChkSUM.cache_dir)):
+                return ""
+            f_stat = os.stat(filename)
+        except (IOError, OSError, TypeError):
+            return ""
+        mtime_ns = getattr(f_stat, "st_mtime_ns",
+                           int(f_stat.st_mtime * 1000000000))
+        return "%d:%d:%d:%d" % (f_stat.st_dev, f_stat.st_ino,
+                                f_stat.st_size, mtime_ns)
+
+    def _cache_load(self):
+        """Load the sidecar cache once per process"""
+        if ChkSUM._cache is None:
+            ChkSUM._cache = dict()
+            try:
+                with open(ChkSUM.cache_file, 'r') as cachefp:
+                    cache = json.load(cachefp)
+                if isinstance(cache, dict):
+                    ChkSUM._cache = cache
+            except (IOError, OSError, AttributeError, ValueError,
+                    TypeError):
+                pass
+        return ChkSUM._cache
+
+    def _cache_get(self, filename, algorithm, key):
+        """Get a cached digest valid for the key"""
+        try:
+            (cached_key, digest) = os.getxattr(
+                filename, ChkSUM.XATTR + algorithm).decode().split(' ')
+            if cached_key == key:
+                return digest
+        except (AttributeError, IOError, OSError, ValueError):
+            pass
+        if not ChkSUM.cache_file:
+            return ""
+        with ChkSUM._cache_lock:
+            return self._cache_load().get(key + ':' + algorithm, "")
+
+    def _cache_put(self, filename, algorithm, key, digest):
+        """Store a digest in the file xattr or in the sidecar cache"""
+        try:
+            os.setxattr(filename, ChkSUM.XATTR + algorithm,
+                        ("%s %s" % (key, digest)).encode())
+            return True
+        except (AttributeError, IOError, OSError):
+            pass
+        if not ChkSUM.cache_file:
+            return False
+        with ChkSUM._cache_lock, FileLock(ChkSUM.cache_file + ".lock"):
+            ChkSUM._cache = None        # other processes may have changed it
+            cache = self._cache_load()
+            if len(cache) >= ChkSUM.CACHE_MAX:
+                cache.clear()
+            cache[key + ':' + algorithm] = digest
+            tmp_file = "%s.%d.%d.tmp" % (ChkSUM.cache_file, os.getpid(),
+                                         threading.current_thread().ident)
+            try:
+                with open(tmp_file, 'w') as cachefp:
+                    json.dump(cache, cachefp)
+                os.rename(tmp_file, ChkSUM.cache_file)
+            except (IOError, OSError, ValueError, TypeError):
+                try:
+                    os.remove(tmp_file)
+                except (IOError, OSError):
+                    pass
+                return False
+        return True
+
+    def store(self, filename, algorithm, digest):
+        """Cache a digest computed elsewhere from the file content"""
+        key = self._cache_key(filename)
+        if key and digest:
+            return self._cache_put(filename, algorithm, key, digest)
+        return False
 
     def hash(self, filename, algorithm):
-        """Compute hash algorithm for file"""
-        if algorithm in self._algorithms:
+        """Compute hash algorithm for file, reusing the cached digest
+        if the file did not change
+        """
+        if algorithm not in self._algorithms:
+            return ""
+        key = self._cache_key(filename)
+        if not key:
             return self._algorithms[algorithm](filename)
-        return ""
+        digest = self._cache_get(filename, algorithm, key)
+        if not digest:
+            digest = self._algorithms[algorithm](filename)
+            if digest and key == self._cache_key(filename):
+                self._cache_put(filename, algorithm, key, digest)
+        return digest
+
+    def hash_many(self, files, algorithm, workers=None):
+        """Compute hash algorithm for several files concurrently, with
+        hashlib in threads otherwise in parallel openssl processes.
+        Returns a dict filename: digest.
+        """
+        files = list(files)
+        digests = WorkerPool(workers).map(
+            lambda filename: self.hash(filename, algorithm), files)
+        return dict(zip(files, digests))
+
+
+class FileLock(object):
+    """Exclusive lock on a lock file shared by processes using
+    fcntl.lockf() and by threads of the same process. Used as
+    context manager. If the lock file cannot be created as in
+    read-only repositories the lock is not taken.
+    """
+
+    _thread_locks = dict()
+    _thread_locks_lock = threading.Lock()
+
+    def __init__(self, lockfile):
+        self.lockfile = os.path.abspath(lockfile)
+        self._filep = None
+        with FileLock._thread_locks_lock:
+            if self.lockfile not in FileLock._thread_locks:
+                FileLock._thread_locks[self.lockfile] = threading.Lock()
+            self._thread_lock = FileLock._thread_locks[self.lockfile]
+
+    def acquire(self):
+        """Wait for the lock"""
+        self._thread_lock.acquire()
+        try:
+            self._filep = open(self.lockfile, "a")
+            fcntl.lockf(self._filep, fcntl.LOCK_EX)
+            os.utime(self.lockfile, None)     # in use, not garbage
+        except (IOError, OSError, NameError, TypeError, ValueError):
+            if self._filep:
+                self._filep.close()
+                self._filep = None
+            return False
+        return True
+
+    def release(self):
+        """Release the lock"""
+        if self._filep:
+            try:
+                fcntl.lockf(self._filep, fcntl.LOCK_UN)
+            except (IOError, OSError, TypeError, ValueError):
+                pass
+            self._filep.close()
+            self._filep = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
 
 
 class FileUtil(object):
@@ -1250,6 +1701,19 @@ class FileUtil(object):
             Msg().err("Error: copying:", sourcedir, " to ", destdir, l=Msg.VER)
         return status
 
+    def clonedir(self, destdir, sourcedir=None):
+        """Copy directories using copy on write reflinks when supported
+        by the filesystem, otherwise fall back to a normal copy.
+        """
+        if sourcedir is None:
+            sourcedir = self.filename
+        if HostInfo().cmd_has_option("cp", "--reflink"):
+            cmd = ["cp", "-a", "-x", "--reflink=auto",
+                   sourcedir + "/.", destdir + '/']
+            if not Uprocess().call(cmd, stderr=Msg.chlderr, close_fds=True):
+                return True
+        return self.copydir(destdir, sourcedir)
+
     def cleanup(self):
         """Delete all temporary files"""
         tmptrash_copy = dict(FileUtil.tmptrash)
@@ -1273,6 +1737,61 @@ class FileUtil(object):
         except (IOError, OSError, TypeError):
             return -1
 
+    def _disk_usage_level(self, dir_path):
+        """Disk space used by the entries of a directory without
+        descending, returns (bytes, list of subdirectories)
+        """
+        total = 0
+        subdirs = []
+        try:
+            if hasattr(os, "scandir"):
+                for entry in os.scandir(dir_path):
+                    total += entry.stat(follow_symlinks=False).st_blocks * 512
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+            else:
+                for f_name in os.listdir(dir_path):
+                    f_path = dir_path + '/' + f_name
+                    f_stat = os.lstat(f_path)
+                    total += f_stat.st_blocks * 512
+                    if stat.S_ISDIR(f_stat.st_mode):
+                        subdirs.append(f_path)
+        except (IOError, OSError):
+            pass
+        return (total, subdirs)
+
+    def _disk_usage_tree(self, dir_path):
+        """Disk space used by the entries of a directory tree"""
+        total = 0
+        dirs = [dir_path]
+        while dirs:
+            (size, subdirs) = self._disk_usage_level(dirs.pop())
+            total += size
+            dirs.extend(subdirs)
+        return total
+
+    def disk_usage(self):
+        """Disk space in bytes used by a file or directory tree,
+        the first two levels are read and the subtrees below them
+        are walked in parallel
+        """
+        try:
+            f_stat = os.lstat(self.filename)
+        except (IOError, OSError, TypeError):
+            return -1
+        total = f_stat.st_blocks * 512
+        if not stat.S_ISDIR(f_stat.st_mode):
+            return total
+        dirs = [self.filename]
+        for dummy in range(2):
+            subdirs = []
+            for dir_path in dirs:
+                (size, level_dirs) = self._disk_usage_level(dir_path)
+                total += size
+                subdirs.extend(level_dirs)
+            dirs = subdirs
+        return total + sum(WorkerPool().map(self._disk_usage_tree, dirs))
+
     def getdata(self, mode="rb"):
         """Read file content to a buffer"""
         try:
@@ -1296,15 +1815,41 @@ class FileUtil(object):
             return buf
 
     def putdata(self, buf, mode="wb"):
-        """Write buffer to file"""
+        """Write buffer to file, unless appending the file is
+        written to a temporary file that then replaces it
+        """
+        if 'a' in mode or os.path.islink(self.filename):
+            out_filename = self.filename
+        else:
+            out_filename = "%s.%d.%d.tmp" % (
+                self.filename, os.getpid(), threading.current_thread().ident)
         try:
-            filep = open(self.filename, mode)
+            filep = open(out_filename, mode)
         except (IOError, OSError, TypeError):
             return ""
-        else:
-            filep.write(buf)
-            filep.close()
-            return buf
+        renamed = False
+        try:
+            try:
+                filep.write(buf)
+            finally:
+                filep.close()
+            if out_filename != self.filename:
+                try:
+                    os.chmod(out_filename,
+                             stat.S_IMODE(os.stat(self.filename).st_mode))
+                except (IOError, OSError):
+                    pass
+                os.rename(out_filename, self.filename)
+            renamed = True
+        except (IOError, OSError, TypeError):
+            return ""
+        finally:
+            if not renamed and out_filename != self.filename:
+                try:
+                    os.remove(out_filename)
+                except (IOError, OSError):
+                    pass
+        return buf
 
     def getvalid_path(self):
         """Get the portion of a pathname that exists"""
@@ -1329,6 +1874,19 @@ class FileUtil(object):
         return ""
 
     def find_exec(self):
+        """Find an executable pathname by using which or type -p, the
+        result is cached until PATH or one of its directories change
+        """
+        path = os.getenv("PATH", "")
+        stamp = [path]
+        for directory in path.split(':'):
+            try:
+                stamp.append(os.stat(directory).st_mtime)
+            except OSError:
+                stamp.append(None)
+        return HostInfo().cached("exec", self.basename, stamp, self._which)
+
+    def _which(self):
         """Find an executable pathname by using which or type -p"""
         cmd = self._find_exec(["which", self.basename])
         if cmd:
@@ -1502,8 +2060,18 @@ class FileUtil(object):
             return True
         return False
 
-    def links_conv(self, force=False, to_container=True, orig_path=""):
+    def _links_walk(self, root_path):
+        """Generator of the symbolic links in the directory tree"""
+        for dir_path, dirs, files in os.walk(root_path):
+            for f_name in files + dirs:
+                f_path = dir_path + '/' + f_name
+                if os.path.islink(f_path):
+                    yield f_path
+
+    def links_conv(self, force=False, to_container=True, orig_path="",
+                   links_list=None):
         """ Convert absolute symbolic links to relative symbolic links
+        links_list: links already found by the caller, avoids the walk
         """
         root_path = os.path.realpath(self.filename)
         links = []
@@ -1511,22 +2079,20 @@ class FileUtil(object):
             Msg().err("Error: links convertion outside of directory tree: ",
                       root_path)
             return None
-        for dir_path, dirs, files in os.walk(root_path):
-            for f_name in files + dirs:
-                try:
-                    f_path = dir_path + '/' + f_name
-                    if not os.path.islink(f_path):
-                        continue
-                    if os.lstat(f_path).st_uid != HostInfo.uid:
-                        continue
-                    if to_container:
-                        if self._link_set(f_path, orig_path, root_path, force):
-                            links.append(f_path)
-                    else:
-                        if self._link_restore(f_path, orig_path, root_path, force):
-                            links.append(f_path)
-                except OSError:
+        if links_list is None:
+            links_list = self._links_walk(root_path)
+        for f_path in links_list:
+            try:
+                if os.lstat(f_path).st_uid != HostInfo.uid:
                     continue
+                if to_container:
+                    if self._link_set(f_path, orig_path, root_path, force):
+                        links.append(f_path)
+                else:
+                    if self._link_restore(f_path, orig_path, root_path, force):
+                        links.append(f_path)
+            except OSError:
+                continue
         return links
 
     def match(self):
@@ -1556,7 +2122,19 @@ class UdockerTools(object):
         self._installinfo = Config.installinfo  # URL or file
         self._tarball_release = Config.tarball_release
         self._install_json = dict()
-        self.curl = GetURL()
+        self._curl = None
+
+    @property
+    def curl(self):
+        """GetURL object created when first used"""
+        if self._curl is None:
+            self._curl = GetURL()
+        return self._curl
+
+    @curl.setter
+    def curl(self, curl):
+        """Set the GetURL object"""
+        self._curl = curl
 
     def _instructions(self):
         """
@@ -1766,6 +2344,638 @@ class UdockerTools(object):
         return False
 
 
+class ElfFile(object):
+    """Read and change the interpreter and the RPATH/RUNPATH of an
+    ELF executable or library in place, used to set or remove the
+    container root prefix without running patchelf for each file.
+    Strings that no longer fit are moved to a new loadable segment
+    appended to the file that reuses a PT_NOTE program header.
+    Files that cannot be changed this way are left to patchelf.
+    """
+
+    PT_LOAD = 1
+    PT_DYNAMIC = 2
+    PT_INTERP = 3
+    PT_NOTE = 4
+    PF_R = 4
+    DT_NULL = 0
+    DT_NEEDED = 1
+    DT_STRTAB = 5
+    DT_STRSZ = 10
+    DT_RPATH = 15
+    DT_RUNPATH = 29
+    DT_FLAGS_1 = 0x6ffffffb
+    DF_1_PIE = 0x08000000
+    SHT_STRTAB = 3
+    ET_NAMES = {1: "relocatable", 2: "executable", 3: "shared object",
+                4: "core file", }
+    EM_NAMES = {2: "SPARC", 3: "Intel 80386", 8: "MIPS, MIPS-I",
+                20: "PowerPC or cisco 4500", 21: "64-bit PowerPC or cisco 7500",
+                22: "IBM S/390", 40: "ARM", 43: "SPARC V9",
+                62: "x86-64", 183: "ARM aarch64", 243: "UCB RISC-V", }
+    OSABI_NAMES = {0: "SYSV", 3: "GNU/Linux", 9: "FreeBSD", }
+    PHDR_FIELDS = {
+        1: ("p_type", "p_offset", "p_vaddr", "p_paddr", "p_filesz",
+            "p_memsz", "p_flags", "p_align"),
+        2: ("p_type", "p_flags", "p_offset", "p_vaddr", "p_paddr",
+            "p_filesz", "p_memsz", "p_align"), }
+    SHDR_FIELDS = ("sh_name", "sh_type", "sh_flags", "sh_addr", "sh_offset",
+                   "sh_size", "sh_link", "sh_info", "sh_addralign",
+                   "sh_entsize")
+    FORMATS = {
+        1: {"ehdr": "HHIIIIIHHHHHH", "phdr": "IIIIIIII",
+            "shdr": "IIIIIIIIII", "dyn": "iI"},
+        2: {"ehdr": "HHIQQQIHHHHHH", "phdr": "IIQQQQQQ",
+            "shdr": "IIQQQQIIQQ", "dyn": "qQ"}, }
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._filep = None
+        self._fmt = None
+        self._endian = '<'
+        self._elfclass = 0
+        self.ehdr = None
+        self.phdrs = []
+        self.shdrs = []
+        self.dynamic = []
+
+    def _unpack(self, fmt, offset):
+        """Read and unpack a structure at a file offset"""
+        fmt = self._endian + fmt
+        self._filep.seek(offset)
+        return struct.unpack(fmt, self._filep.read(struct.calcsize(fmt)))
+
+    def _pack(self, fmt, offset, values):
+        """Pack and write a structure at a file offset"""
+        self._filep.seek(offset)
+        self._filep.write(struct.pack(self._endian + fmt, *values))
+
+    def _read(self, offset, size):
+        """Read bytes at a file offset"""
+        self._filep.seek(offset)
+        return self._filep.read(size)
+
+    def _load(self):
+        """Parse the ELF, program and section headers and the dynamic
+        section. Returns False if not an ELF file.
+        """
+        ident = self._read(0, 16)
+        if len(ident) < 16 or ident[:4] != b"\x7fELF":
+            return False
+        self._elfclass = bytearray(ident)[4]
+        if self._elfclass not in (1, 2) or bytearray(ident)[5] not in (1, 2):
+            return False
+        self._endian = '<' if bytearray(ident)[5] == 1 else '>'
+        self._fmt = ElfFile.FORMATS[self._elfclass]
+        self.ehdr = dict(zip(
+            ("e_type", "e_machine", "e_version", "e_entry", "e_phoff",
+             "e_shoff", "e_flags", "e_ehsize", "e_phentsize", "e_phnum",
+             "e_shentsize", "e_shnum", "e_shstrndx"),
+            self._unpack(self._fmt["ehdr"], 16)))
+        for idx in range(self.ehdr["e_phnum"]):
+            self.phdrs.append(dict(zip(
+                ElfFile.PHDR_FIELDS[self._elfclass],
+                self._unpack(self._fmt["phdr"], self.ehdr["e_phoff"] +
+                             idx * self.ehdr["e_phentsize"]))))
+        if self.ehdr["e_shoff"]:
+            for idx in range(self.ehdr["e_shnum"]):
+                self.shdrs.append(dict(zip(
+                    ElfFile.SHDR_FIELDS,
+                    self._unpack(self._fmt["shdr"], self.ehdr["e_shoff"] +
+                                 idx * self.ehdr["e_shentsize"]))))
+        dyn_size = struct.calcsize(self._fmt["dyn"])
+        for phdr in self._segments(ElfFile.PT_DYNAMIC):
+            for idx in range(phdr["p_filesz"] // dyn_size):
+                offset = phdr["p_offset"] + idx * dyn_size
+                (d_tag, d_val) = self._unpack(self._fmt["dyn"], offset)
+                if d_tag == ElfFile.DT_NULL:
+                    break
+                self.dynamic.append([d_tag, d_val, offset])
+        return True
+
+    def _segments(self, p_type):
+        """Program headers of a given type"""
+        return [phdr for phdr in self.phdrs if phdr["p_type"] == p_type]
+
+    def _dyn(self, d_tag):
+        """Get the entries of the dynamic section with a given tag"""
+        return [entry for entry in self.dynamic if entry[0] == d_tag]
+
+    def _vaddr_offset(self, vaddr):
+        """Convert a virtual address to a file offset"""
+        for phdr in self._segments(ElfFile.PT_LOAD):
+            if phdr["p_vaddr"] <= vaddr < phdr["p_vaddr"] + phdr["p_filesz"]:
+                return vaddr - phdr["p_vaddr"] + phdr["p_offset"]
+        return None
+
+    def _cstring(self, offset, maxsize=4096):
+        """Read a nul terminated string"""
+        data = self._read(offset, maxsize)
+        return data.split(b"\0", 1)[0]
+
+    def _strtab(self):
+        """Get the file offset and size of the dynamic string table"""
+        try:
+            vaddr = self._dyn(ElfFile.DT_STRTAB)[0][1]
+            size = self._dyn(ElfFile.DT_STRSZ)[0][1]
+        except IndexError:
+            return (None, 0)
+        return (self._vaddr_offset(vaddr), size)
+
+    def _get_interpreter(self):
+        """Get the interpreter (ld.so) pathname"""
+        for phdr in self._segments(ElfFile.PT_INTERP):
+            return self._cstring(phdr["p_offset"], phdr["p_filesz"])
+        return None
+
+    def _get_rpath(self, tags=(DT_RPATH, DT_RUNPATH)):
+        """Get the RPATH and RUNPATH, dict offset in strtab: string"""
+        rpaths = dict()
+        (strtab, dummy) = self._strtab()
+        if strtab is None:
+            return rpaths
+        for tag in tags:
+            for entry in self._dyn(tag):
+                rpaths[entry[1]] = self._cstring(strtab + entry[1])
+        return rpaths
+
+    def _rpath_room(self, strtab, strsz, str_offset, rpath):
+        """Space for an rpath string, a string at the end of the string
+        table as when moved by a previous change can use the padding
+        """
+        start = str_offset + len(rpath)
+        if 0 <= start < strsz:
+            tail = self._read(strtab + start, strsz - start)
+            if tail.count(b"\0") == len(tail):
+                return strsz - str_offset - 1
+        return len(rpath)
+
+    @staticmethod
+    def is_elf(filename):
+        """Check if a file starts with the ELF magic number"""
+        try:
+            with open(filename, "rb") as filep:
+                return filep.read(4) == b"\x7fELF"
+        except (IOError, OSError, TypeError):
+            return False
+
+    def get_dynamic_info(self):
+        """Get the interpreter, the RPATH and RUNPATH strings, the
+        DT_NEEDED libraries, the ELF class and machine of the file,
+        returns None if the file cannot be read or is not ELF
+        """
+        try:
+            self._filep = open(self.filename, "rb")
+        except (IOError, OSError, TypeError):
+            return None
+        try:
+            if not self._load():
+                return None
+            (strtab, dummy) = self._strtab()
+            needed = []
+            if strtab is not None:
+                needed = [self._cstring(strtab + entry[1])
+                          for entry in self._dyn(ElfFile.DT_NEEDED)]
+            return {"interp": self._get_interpreter(),
+                    "rpath": sorted(self._get_rpath(
+                        (ElfFile.DT_RPATH, )).values()),
+                    "runpath": sorted(self._get_rpath(
+                        (ElfFile.DT_RUNPATH, )).values()),
+                    "needed": needed, "class": self._elfclass,
+                    "machine": self.ehdr["e_machine"]}
+        except (IOError, OSError, struct.error, KeyError, IndexError,
+                TypeError, ValueError, MemoryError):
+            return None
+        finally:
+            self._filep.close()
+
+    def get_filetype(self):
+        """Describe the ELF class, type, machine and interpreter in
+        the format used by the file command, returns None if the file
+        cannot be read or is not ELF
+        """
+        try:
+            self._filep = open(self.filename, "rb")
+        except (IOError, OSError, TypeError):
+            return None
+        try:
+            if not self._load():
+                return None
+            osabi = bytearray(self._read(0, 16))[7]
+            e_type = ElfFile.ET_NAMES.get(self.ehdr["e_type"], "unknown type")
+            if self.ehdr["e_type"] == 3 and [
+                    entry for entry in self._dyn(ElfFile.DT_FLAGS_1)
+                    if entry[1] & ElfFile.DF_1_PIE]:
+                e_type = "pie executable"
+            filetype = [
+                "ELF %d-bit %s %s" % (32 * self._elfclass,
+                                      "LSB" if self._endian == '<' else "MSB",
+                                      e_type),
+                ElfFile.EM_NAMES.get(self.ehdr["e_machine"],
+                                     "unknown arch 0x%x" %
+                                     self.ehdr["e_machine"]),
+                "version 1 (%s)" % ElfFile.OSABI_NAMES.get(osabi, "SYSV")]
+            interp = self._get_interpreter()
+            if interp:
+                if not isinstance(interp, str):
+                    interp = interp.decode("utf-8", "replace")
+                filetype.append("dynamically linked, interpreter " + interp)
+            elif self._segments(ElfFile.PT_DYNAMIC):
+                filetype.append("dynamically linked")
+            elif self.ehdr["e_type"] != 1:
+                filetype.append("statically linked")
+            return ", ".join(filetype)
+        except (IOError, OSError, struct.error, KeyError, IndexError,
+                TypeError, ValueError, MemoryError):
+            return None
+        finally:
+            self._filep.close()
+
+    @staticmethod
+    def _set_prefix(path, prefixes, restore):
+        """Add the first of prefixes to an absolute pathname or remove
+        it if restore is True. Any of the prefixes already present is
+        removed first so that a pathname is never prefixed twice.
+        """
+        orig_path = path
+        stripped = True
+        while stripped:
+            stripped = False
+            for prefix in prefixes:
+                if path == prefix or path.startswith(prefix + b'/'):
+                    path = path[len(prefix):] or b'/'
+                    stripped = True
+        if restore or not path.startswith(b'/'):
+            return path
+        if path == b'/' and orig_path != b'/':
+            return prefixes[0]
+        return prefixes[0] + path
+
+    @staticmethod
+    def _prefixes(prefix):
+        """The root prefix and its legacy form without the / padding,
+        as set by patchelf and used by fakechroot in FAKECHROOT_BASE
+        """
+        if not isinstance(prefix, bytes):
+            prefix = prefix.encode()
+        prefix = prefix.rstrip(b'/')
+        legacy = re.sub(b'/+', b'/', prefix)
+        return [prefix, legacy] if legacy != prefix else [prefix]
+
+    def _new_segment(self, data):
+        """Append data in a new read only loadable segment replacing
+        a PT_NOTE program header. Returns the (offset, vaddr) of the
+        data or None if there is no PT_NOTE to replace.
+        """
+        loads = self._segments(ElfFile.PT_LOAD)
+        notes = self._segments(ElfFile.PT_NOTE)
+        if not (loads and notes):
+            return None
+        align = max([phdr["p_align"] for phdr in loads] + [4096])
+        self._filep.seek(0, 2)
+        offset = (self._filep.tell() + 15) // 16 * 16
+        end = max([phdr["p_vaddr"] + phdr["p_memsz"] for phdr in loads])
+        vaddr = (end + align - 1) // align * align + offset % align
+        self._filep.seek(offset)
+        self._filep.write(data)
+        new_load = notes[0]
+        self.phdrs.remove(new_load)
+        new_load.update({"p_type": ElfFile.PT_LOAD, "p_flags": ElfFile.PF_R,
+                         "p_offset": offset, "p_vaddr": vaddr,
+                         "p_paddr": vaddr, "p_filesz": len(data),
+                         "p_memsz": len(data), "p_align": align})
+        last_load = max([self.phdrs.index(phdr) for phdr in loads])
+        self.phdrs.insert(last_load + 1, new_load)
+        for (idx, phdr) in enumerate(self.phdrs):
+            self._pack(self._fmt["phdr"], self.ehdr["e_phoff"] +
+                       idx * self.ehdr["e_phentsize"],
+                       [phdr[field]
+                        for field in ElfFile.PHDR_FIELDS[self._elfclass]])
+        return (offset, vaddr)
+
+    def _update_section(self, old_offset, offset, vaddr, size):
+        """Point the section header of a moved section to its new data"""
+        for (idx, shdr) in enumerate(self.shdrs):
+            if shdr["sh_offset"] == old_offset and shdr["sh_size"]:
+                shdr.update({"sh_offset": offset, "sh_addr": vaddr,
+                             "sh_size": size})
+                self._pack(self._fmt["shdr"], self.ehdr["e_shoff"] +
+                           idx * self.ehdr["e_shentsize"],
+                           [shdr[field] for field in ElfFile.SHDR_FIELDS])
+
+    def _new_paths(self, set_path):
+        """Convert the interpreter and rpath strings of a loaded file
+        with set_path(), only the ones that change are returned
+        """
+        interp = self._get_interpreter()
+        new_interp = None
+        if interp:
+            new_interp = set_path(interp)
+            if new_interp == interp:
+                new_interp = None
+        rpaths = self._get_rpath()
+        new_rpaths = dict()
+        for (str_offset, rpath) in rpaths.items():
+            new_rpath = b':'.join([set_path(path)
+                                   for path in rpath.split(b':')])
+            if new_rpath != rpath:
+                new_rpaths[str_offset] = new_rpath
+        return (rpaths, new_interp, new_rpaths)
+
+    def _change(self, set_path):
+        """Change the interpreter and rpath strings of a loaded file,
+        set_path() converts each pathname
+        """
+        (rpaths, new_interp, new_rpaths) = self._new_paths(set_path)
+        if new_interp is None and not new_rpaths:
+            return True
+        interp_phdr = self._segments(ElfFile.PT_INTERP)
+        (strtab, strsz) = self._strtab()
+        grow_interp = (new_interp is not None and
+                       len(new_interp) >= interp_phdr[0]["p_filesz"])
+        grow_rpath = [str_offset for (str_offset, new_rpath)
+                      in new_rpaths.items()
+                      if len(new_rpath) > self._rpath_room(
+                          strtab, strsz, str_offset, rpaths[str_offset])]
+        if grow_interp or grow_rpath:
+            data = b""
+            if grow_interp:
+                data += new_interp + b"\0"
+            if grow_rpath:
+                dynstr = self._read(strtab, strsz)
+                dynstr_pos = len(data)
+                new_offsets = dict()
+                for str_offset in grow_rpath:
+                    new_offsets[str_offset] = len(dynstr)
+                    dynstr += new_rpaths.pop(str_offset) + b"\0"
+                data += dynstr
+            location = self._new_segment(data)
+            if location is None:
+                return None
+            (offset, vaddr) = location
+            if grow_interp:
+                phdr = interp_phdr[0]
+                self._update_section(phdr["p_offset"], offset, vaddr,
+                                     len(new_interp) + 1)
+                phdr.update({"p_offset": offset, "p_vaddr": vaddr,
+                             "p_paddr": vaddr, "p_filesz": len(new_interp) + 1,
+                             "p_memsz": len(new_interp) + 1})
+                self._pack(self._fmt["phdr"], self.ehdr["e_phoff"] +
+                           self.phdrs.index(phdr) * self.ehdr["e_phentsize"],
+                           [phdr[field] for field in
+                            ElfFile.PHDR_FIELDS[self._elfclass]])
+                new_interp = None
+            if grow_rpath:
+                self._update_section(strtab, offset + dynstr_pos,
+                                     vaddr + dynstr_pos, len(dynstr))
+                for entry in self.dynamic:
+                    if entry[0] == ElfFile.DT_STRTAB:
+                        entry[1] = vaddr + dynstr_pos
+                    elif entry[0] == ElfFile.DT_STRSZ:
+                        entry[1] = len(dynstr)
+                    elif (entry[0] in (ElfFile.DT_RPATH, ElfFile.DT_RUNPATH)
+                          and entry[1] in new_offsets):
+                        entry[1] = new_offsets[entry[1]]
+                    else:
+                        continue
+                    self._pack(self._fmt["dyn"], entry[2], entry[:2])
+                strtab = offset + dynstr_pos
+        if new_interp is not None:
+            phdr = interp_phdr[0]
+            self._filep.seek(phdr["p_offset"])
+            self._filep.write(new_interp.ljust(phdr["p_filesz"], b"\0"))
+        for (str_offset, new_rpath) in new_rpaths.items():
+            self._filep.seek(strtab + str_offset)
+            self._filep.write(new_rpath + b"\0" * (
+                max(len(rpaths[str_offset]) - len(new_rpath), 0) + 1))
+        return True
+
+    def _update(self, set_path):
+        """Change the pathnames of the interpreter and RPATH/RUNPATH
+        entries with set_path(). The changes are made in a copy in the
+        same directory that is then renamed over the file, an interrupted
+        run never leaves a truncated binary behind.
+        """
+        try:
+            f_stat = os.stat(self.filename)
+            self._filep = open(self.filename, "rb")
+        except (IOError, OSError):
+            return None
+        tmp_file = "%s.%d.%d.tmp" % (self.filename, os.getpid(),
+                                     threading.current_thread().ident)
+        try:
+            if not self._load():
+                return False
+            (new_interp, new_rpaths) = self._new_paths(set_path)[1:]
+            if new_interp is None and not new_rpaths:
+                return True
+            self._filep.seek(0)
+            with open(tmp_file, "wb") as tmp_fp:
+                while True:
+                    data = self._filep.read(1024 * 1024)
+                    if not data:
+                        break
+                    tmp_fp.write(data)
+            self._filep.close()
+            self._filep = open(tmp_file, "r+b")
+            status = self._change(set_path)
+            self._filep.close()
+            if status:
+                os.chmod(tmp_file, stat.S_IMODE(f_stat.st_mode))
+                os.rename(tmp_file, self.filename)
+            return status
+        except (IOError, OSError, struct.error, KeyError, IndexError,
+                TypeError, ValueError, MemoryError):
+            return None
+        finally:
+            self._filep.close()
+            if os.path.exists(tmp_file):
+                try:
+                    os.remove(tmp_file)
+                except (IOError, OSError):
+                    pass
+
+    def root_prefix(self, prefix, restore=False):
+        """Add the prefix to the absolute pathnames of the interpreter
+        and RPATH/RUNPATH entries or remove it if restore is True.
+        The prefix without its / padding is also recognized.
+        Returns True if done or not needed, False for non ELF files
+        and None if the file must be changed with patchelf.
+        """
+        prefixes = self._prefixes(prefix)
+        if not prefixes[0]:
+            return True
+        return self._update(
+            lambda path: self._set_prefix(path, prefixes, restore))
+
+    def relocate(self, old_prefix, new_prefix):
+        """Replace the prefix old_prefix by new_prefix in the pathnames
+        of the interpreter and RPATH/RUNPATH entries. Prefixes with the
+        same length are replaced in place. Returns True if done, False
+        for non ELF files and for files without pathnames starting with
+        old_prefix, and None if the file must be changed with patchelf.
+        """
+        if not isinstance(old_prefix, bytes):
+            old_prefix = old_prefix.encode()
+        if not isinstance(new_prefix, bytes):
+            new_prefix = new_prefix.encode()
+        old_prefix = old_prefix.rstrip(b'/')
+        new_prefix = new_prefix.rstrip(b'/')
+        matched = []
+
+        def set_path(path):
+            """Replace the old prefix of a pathname"""
+            if path == old_prefix or path.startswith(old_prefix + b'/'):
+                matched.append(path)
+                return new_prefix + path[len(old_prefix):]
+            return path
+        status = self._update(set_path)
+        if status and not matched:
+            return False
+        return status
+
+
+class ContainerIndex(object):
+    """Index of the files in a container ROOT built in a single walk.
+    For each directory the index keeps its mtime, the subdirectories
+    and the file entries. Directories whose mtime did not change are
+    not read again when the index is refreshed. The index is stored in
+    the container directory in the file files.index.
+    File entries are lists: [name, type, mode, uid] where type is
+    e (ELF file), s (script starting with #!), f (other regular file),
+    l (symlink) or o (other).
+    Changes that do not modify the mtime of the directory such as
+    chmod, chown or rewriting a file in place are not seen, the users
+    stat the files again before relying on their mode and uid, and the
+    index is rebuilt with refresh(rebuild=True).
+    """
+
+    INDEX_VERSION = 1
+
+    def __init__(self, container_dir):
+        self.container_dir = container_dir
+        self.root = container_dir + "/ROOT"
+        self.index_file = container_dir + "/files.index"
+        self.dirs = None
+
+    @staticmethod
+    def _file_type(f_path, f_stat):
+        """Classify a file from its lstat and magic number"""
+        if stat.S_ISLNK(f_stat.st_mode):
+            return 'l'
+        if not stat.S_ISREG(f_stat.st_mode):
+            return 'o'
+        try:
+            with open(f_path, "rb") as filep:
+                magic = filep.read(4)
+        except (IOError, OSError):
+            return 'f'
+        if magic == b"\x7fELF":
+            return 'e'
+        if magic.startswith(b"#!"):
+            return 's'
+        return 'f'
+
+    def _read_index(self):
+        """Read the stored index"""
+        try:
+            with open(self.index_file, 'r') as indexfp:
+                index = json.load(indexfp)
+            if index["version"] == ContainerIndex.INDEX_VERSION:
+                return index["dirs"]
+        except (IOError, OSError, AttributeError, ValueError, TypeError,
+                KeyError):
+            pass
+        return dict()
+
+    def _write_index(self):
+        """Write the index, the rename makes the update atomic"""
+        index = {"version": ContainerIndex.INDEX_VERSION, "dirs": self.dirs}
+        tmp_file = "%s.%d.%d.tmp" % (self.index_file, os.getpid(),
+                                     threading.current_thread().ident)
+        try:
+            with open(tmp_file, 'w') as indexfp:
+                json.dump(index, indexfp)
+            os.rename(tmp_file, self.index_file)
+        except (IOError, OSError, AttributeError, ValueError, TypeError):
+            try:
+                os.remove(tmp_file)
+            except (IOError, OSError):
+                pass
+            return False
+        return True
+
+    def _scan_dir(self, rel_dir):
+        """Read a directory, returns [mtime, subdirs, file entries]"""
+        dir_path = self.root + rel_dir
+        dir_mtime = os.lstat(dir_path).st_mtime
+        subdirs = []
+        files = []
+        for f_name in sorted(os.listdir(dir_path)):
+            f_path = dir_path + '/' + f_name
+            try:
+                f_stat = os.lstat(f_path)
+            except OSError:
+                continue
+            if stat.S_ISDIR(f_stat.st_mode):
+                subdirs.append(f_name)
+            else:
+                files.append([f_name, self._file_type(f_path, f_stat),
+                              f_stat.st_mode, f_stat.st_uid])
+        return [dir_mtime, subdirs, files]
+
+    def refresh(self, rebuild=False):
+        """Update the index reading only the directories that changed,
+        with rebuild all the directories are read again
+        """
+        if rebuild:
+            old_dirs = dict()
+        elif self.dirs is None:
+            old_dirs = self._read_index()
+        else:
+            old_dirs = self.dirs
+        self.dirs = dict()
+        changed = rebuild
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            try:
+                dir_mtime = os.lstat(self.root + rel_dir).st_mtime
+                entry = old_dirs.get(rel_dir)
+                if not entry or entry[0] != dir_mtime:
+                    entry = self._scan_dir(rel_dir)
+                    changed = True
+            except (OSError, TypeError):
+                continue
+            self.dirs[rel_dir] = entry
+            stack.extend([rel_dir + '/' + f_name
+                          for f_name in reversed(entry[1])])
+        if changed or len(self.dirs) != len(old_dirs):
+            self._write_index()
+        return self.dirs
+
+    def entries(self):
+        """Generator of (dir_path, f_name, type, mode, uid) for all
+        the files and symlinks in the container, index is refreshed
+        """
+        dirs = self.refresh()
+        for rel_dir in sorted(dirs.keys()):
+            dir_path = self.root + rel_dir
+            for (f_name, f_type, f_mode, f_uid) in dirs[rel_dir][2]:
+                yield (dir_path, f_name, f_type, f_mode, f_uid)
+
+    def links(self):
+        """Get the symbolic links in the container"""
+        dirs = self.refresh()
+        links = []
+        for rel_dir in sorted(dirs.keys()):
+            dir_path = self.root + rel_dir
+            links.extend([dir_path + '/' + f_entry[0]
+                          for f_entry in dirs[rel_dir][2]
+                          if f_entry[1] == 'l'])
+        return links
+
+
 class ElfPatcher(object):
     """Patch container executables"""
 
@@ -1775,6 +2985,8 @@ class ElfPatcher(object):
     ABORT_ON_ERROR = 8
     ONE_SUCCESS = 16
     ONE_OUTPUT = 32
+    LD_CACHE_OLD = b"ld.so-1.7.0"
+    LD_CACHE_NEW = b"glibc-ld.so.cache1.1"
 
     def __init__(self, localrepo, container_id):
         self._localrepo = localrepo
@@ -1786,10 +2998,16 @@ class ElfPatcher(object):
         self._container_ld_so_path = self._container_dir + "/ld.so.path"
         self._container_ld_so_orig = self._container_dir + "/ld.so.orig"
         self._container_ld_libdirs = self._container_dir + "/ld.lib.dirs"
+        self._container_ld_cachedirs = self._container_dir + "/ld.cache.dirs"
+        self._container_ld_paths = self._container_dir + "/ld.lib.paths"
         self._container_patch_time = self._container_dir + "/patch.time"
         self._container_patch_path = self._container_dir + "/patch.path"
+        self._container_patch_list = self._container_dir + "/patch.list"
+        self._container_patch_lock = self._container_dir + "/patch.lock"
+        self._container_patch_root = self._patch_root(self._container_dir)
         self._shlib = re.compile(r"^lib\S+\.so(\.\d+)*$")
         self._uid = HostInfo.uid
+        self._index = ContainerIndex(self._container_dir)
 
     def select_patchelf(self):
         """Set patchelf executable"""
@@ -1818,48 +3036,35 @@ class ElfPatcher(object):
             cmd_out.append(arg)
         return cmd_out
 
-    def _walk_fs(self, cmd, root_path, action=BIN):
-        """Execute a shell command over each executable file in a given
-        dir_path, action can be ABORT_ON_ERROR, return upon first success
-        ONE_SUCCESS, or return upon the first non empty output. #f is the
-        placeholder for the filename.
-        """
-        status = False
-        for dir_path, dummy, files in os.walk(root_path):
-            for f_name in files:
-                try:
-                    f_path = dir_path + '/' + f_name
-                    if os.path.islink(f_path):
-                        continue
-                    if os.stat(f_path).st_uid != self._uid:
-                        if action & self.ABORT_ON_ERROR:
-                            return None
-                        else:
-                            continue
-                    if ((action & self.BIN and os.access(f_path, os.X_OK)) or
-                            (action & self.LIB and self._shlib.match(f_name))):
-                        out = Uprocess().get_output(self._replace(cmd, f_path))
-                        if out:
-                            status = out
-                    if action & self.ABORT_ON_ERROR and status is None:
-                        return None
-                    elif action & self.ONE_SUCCESS and status is not None:
-                        return status
-                    elif action & self.ONE_OUTPUT and status:
-                        return status
-                except OSError:
-                    pass
-        return status
-
     def guess_elf_loader(self):
         """Search for executables and try to read the ld.so pathname"""
-        patchelf_exec = self.select_patchelf()
-        cmd = [patchelf_exec, "-q", "--print-interpreter", "#f"]
-        for d_name in ("/bin", "/usr/bin", "/lib64"):
-            elf_loader = self._walk_fs(cmd, self._container_root + d_name,
-                                       self.ONE_OUTPUT | self.BIN)
-            if elf_loader and ".so" in elf_loader:
-                return elf_loader
+        search_dirs = [self._container_root + d_name
+                       for d_name in ("/bin", "/usr/bin", "/lib64")]
+        exec_files = dict([(d_name, []) for d_name in search_dirs])
+        for (dir_path, f_name, f_type, dummy, dummy) in \
+                self._index.entries():
+            if f_type != 'e':
+                continue
+            for d_name in search_dirs:
+                if dir_path == d_name or dir_path.startswith(d_name + '/'):
+                    f_path = dir_path + '/' + f_name
+                    try:
+                        f_stat = os.lstat(f_path)   # index may be stale
+                    except OSError:
+                        continue
+                    if (f_stat.st_uid == self._uid and
+                            f_stat.st_mode & stat.S_IXUSR):
+                        exec_files[d_name].append(f_path)
+        for d_name in search_dirs:
+            for f_path in exec_files[d_name]:
+                elf_loader = (ElfFile(f_path).get_dynamic_info() or
+                              {}).get("interp")
+                if elf_loader:
+                    if not isinstance(elf_loader, str):
+                        elf_loader = elf_loader.decode("utf-8", "replace")
+                    if ".so" in elf_loader:
+                        return elf_loader
+                    break
         return ""
 
     def get_original_loader(self):
@@ -1886,6 +3091,14 @@ class ElfPatcher(object):
             return last_path.strip()
         return ""
 
+    @staticmethod
+    def _patch_root(container_dir):
+        """Root prefix set in the patched files, the path to the container
+        ROOT padded with / to Config.patch_root_len
+        """
+        pad = Config.patch_root_len - len(container_dir) - len("/ROOT")
+        return container_dir + '/' * max(pad, 0) + "/ROOT"
+
     def check_container_path(self):
         """verify if path to container is ok"""
         last_path = self.get_patch_last_path()
@@ -1901,17 +3114,134 @@ class ElfPatcher(object):
         except ValueError:
             return '0'
 
+    def _load_patch_list(self):
+        """Get the manifest of the patched files and the time of the
+        last patch, the manifest maps pathnames relative to the container
+        ROOT to [inode, size, mtime, interpreter, root prefix]
+        """
+        manifest = self._localrepo.load_json(self._container_patch_list)
+        if not (manifest and isinstance(manifest, dict)):
+            return (dict(), 0)
+        return (manifest, int(self.get_patch_last_time()))
+
+    def _save_patch_list(self, manifest):
+        """Save the manifest of the patched files"""
+        for rel_path in list(manifest.keys()):
+            if not os.path.isfile(self._container_root + rel_path):
+                del manifest[rel_path]
+        return self._localrepo.save_json(self._container_patch_list,
+                                         manifest)
+
+    def _patch_entry(self, f_path, root_prefix):
+        """Manifest entry of a patched file"""
+        try:
+            f_stat = os.stat(f_path)
+        except OSError:
+            return None
+        interp = (ElfFile(f_path).get_dynamic_info() or {}).get("interp")
+        if interp is not None and not isinstance(interp, str):
+            interp = interp.decode("utf-8", "replace")
+        return [f_stat.st_ino, f_stat.st_size, f_stat.st_mtime, interp,
+                root_prefix]
+
+    def _patch_changed(self, manifest, f_path, f_stat, since):
+        """Check if a file may need patching, files in the manifest
+        that did not change are skipped as well as files not in the
+        manifest that are older than the last patch
+        """
+        entry = manifest.get(f_path[len(self._container_root):])
+        if entry is None:
+            return f_stat.st_mtime > since
+        return (entry[:3] != [f_stat.st_ino, f_stat.st_size,
+                              f_stat.st_mtime] or
+                entry[4] != self._container_patch_root)
+
+    def _patch_files(self, patch_list, root_prefix, restore=False,
+                     manifest=None):
+        """Set or restore the root prefix of executables and libraries
+        within this process using ElfFile, patchelf is only invoked
+        for the files that ElfFile cannot change. Both are run over
+        the files by a pool of Config.workers. The manifest of the
+        patched files is updated if given.
+        """
+        results = WorkerPool().map(
+            lambda f_path: ElfFile(f_path).root_prefix(root_prefix, restore),
+            patch_list)
+        fallback_list = [f_path for (f_path, status)
+                         in zip(patch_list, results) if status is None]
+        if fallback_list:
+            patchelf_exec = self.select_patchelf()
+            cmds = []
+            legacy_prefix = re.sub("/+", "/", root_prefix.rstrip('/'))
+            if legacy_prefix != root_prefix.rstrip('/'):
+                cmds.append([patchelf_exec, "--restore-root-prefix",
+                             legacy_prefix, "#f"])
+            if restore:
+                cmds.insert(0, [patchelf_exec, "--restore-root-prefix",
+                                root_prefix, "#f"])
+            else:
+                cmds.append([patchelf_exec, "--set-root-prefix",
+                             root_prefix, "#f"])
+            WorkerPool().map(
+                lambda f_path: [Uprocess().get_output(
+                    self._replace(cmd, f_path)) for cmd in cmds],
+                fallback_list)
+        if manifest is not None:
+            self._update_patch_list(
+                manifest, [f_path for (f_path, status)
+                           in zip(patch_list, results) if status is not False],
+                None if restore else root_prefix)
+        return len(patch_list) - len(fallback_list)
+
+    def _update_patch_list(self, manifest, done_list, root_prefix):
+        """Record the files in done_list in the manifest with the
+        root_prefix or remove them if root_prefix is None
+        """
+        if root_prefix is None:
+            entries = [None] * len(done_list)
+        else:
+            entries = WorkerPool().map(
+                lambda f_path: self._patch_entry(f_path, root_prefix),
+                done_list)
+        for (f_path, entry) in zip(done_list, entries):
+            rel_path = f_path[len(self._container_root):]
+            if entry:
+                manifest[rel_path] = entry
+            elif rel_path in manifest:
+                del manifest[rel_path]
+
+    def _patched_files(self, manifest, since):
+        """Files with the root prefix set, those in the manifest and
+        the ELF files created after the last patch
+        """
+        patch_list = self._scan_container(manifest, since)[2]
+        listed = set(patch_list)
+        for rel_path in sorted(manifest.keys()):
+            f_path = self._container_root + rel_path
+            if f_path not in listed and os.path.isfile(f_path):
+                patch_list.append(f_path)
+        return patch_list
+
     def patch_binaries(self):
-        """Set all executables and libs to the ld.so absolute pathname"""
-        if not self.check_container_path():
+        """Set all executables and libs to the ld.so absolute pathname,
+        only files that are new or changed since the last patch are
+        patched
+        """
+        if not (self.check_container_path() or self.relocate_binaries()):
             self.restore_binaries()
-        last_time = '0'
-        patchelf_exec = self.select_patchelf()
         elf_loader = self.get_container_loader()
-        cmd = [patchelf_exec, "--set-root-prefix", self._container_root, "#f"]
-        self._walk_fs(cmd, self._container_root, self.BIN | self.LIB)
+        (manifest, since) = self._load_patch_list()
+        self._patch_files(self._scan_container(manifest, since)[2],
+                          self._container_patch_root, manifest=manifest)
+        self._save_patch_list(manifest)
+        return self._patch_done(elf_loader)
+
+    def _patch_done(self, elf_loader):
+        """Check the patched loader and record time and path of the patch"""
+        last_time = '0'
         newly_set = self.guess_elf_loader()
-        if newly_set == elf_loader:
+        if newly_set and os.path.normpath(newly_set) == \
+                os.path.normpath(elf_loader):
             try:
                 last_time = str(int(time.time()))
             except ValueError:
@@ -1920,22 +3250,135 @@ class ElfPatcher(object):
                     FileUtil(self._container_patch_path).putdata(self._container_dir))
         return False
 
+    def _scan_container(self, manifest=None, since=0):
+        """Get from the container index the symbolic links, the candidate
+        library files and the ELF executables and libraries to be patched.
+        If a manifest is given only the files that may have changed since
+        the last patch are selected.
+        """
+        links = []
+        lib_files = []
+        patch_list = []
+        for (dir_path, f_name, f_type, dummy, dummy) in \
+                self._index.entries():
+            f_path = dir_path + '/' + f_name
+            if self._shlib.match(f_name):
+                lib_files.append((dir_path, f_path))
+            if f_type == 'l':
+                links.append(f_path)
+            elif f_type == 'e':
+                try:
+                    f_stat = os.lstat(f_path)       # index may be stale
+                except OSError:
+                    continue
+                if f_stat.st_uid != self._uid:
+                    continue
+                if (manifest is not None and not
+                        self._patch_changed(manifest, f_path, f_stat, since)):
+                    continue
+                patch_list.append(f_path)
+        return (links, lib_files, patch_list)
+
+    def patch_container(self, convert_links=True, force=False, orig_path=""):
+        """Setup for the F3 and F4 modes with a single walk over the
+        container: converts the symbolic links, finds the library
+        directories and patches ld.so, the executables and libraries
+        """
+        if not (self.check_container_path() or self.relocate_binaries()):
+            self.restore_binaries()
+        if force:
+            self._index.refresh(rebuild=True)
+        (manifest, since) = self._load_patch_list()
+        (links, lib_files, patch_list) = \
+            self._scan_container(manifest, since)
+        if convert_links:
+            if FileUtil(self._container_root).links_conv(
+                    force, True, orig_path, links) is None:
+                return False
+        ld_list = self._find_ld_libdirs(lib_files=lib_files)
+        FileUtil(self._container_ld_libdirs).putdata(':'.join(ld_list))
+        if not self.patch_ld():
+            return False
+        elf_loader = self.get_container_loader()
+        self._patch_files(patch_list, self._container_patch_root,
+                          manifest=manifest)
+        self._save_patch_list(manifest)
+        return self._patch_done(elf_loader)
+
     def restore_binaries(self):
-        """Restore all executables and libs to the original ld.so pathname"""
-        patchelf_exec = self.select_patchelf()
+        """Restore all executables and libs to the original ld.so pathname,
+        with a manifest only the patched files and the files created
+        after the last patch are restored
+        """
         elf_loader = self.get_original_loader()
-        last_path = self.get_patch_last_path()
-        if last_path:
-            cmd = [patchelf_exec, "--restore-root-prefix", last_path + "/ROOT", "#f"]
+        last_path = self.get_patch_last_path() or self._container_dir
+        (manifest, since) = self._load_patch_list()
+        if manifest:
+            patch_list = self._patched_files(manifest, since)
         else:
-            cmd = [patchelf_exec, "--restore-root-prefix", self._container_root, "#f"]
-        self._walk_fs(cmd, self._container_root, self.BIN | self.LIB)
+            patch_list = self._scan_container()[2]
+        self._patch_files(patch_list, self._patch_root(last_path), True,
+                          manifest)
         newly_set = self.guess_elf_loader()
         if newly_set == elf_loader:
             FileUtil(self._container_patch_path).remove()
             FileUtil(self._container_patch_time).remove()
+            FileUtil(self._container_patch_list).remove()
+        elif manifest:
+            self._save_patch_list(manifest)
         return newly_set == elf_loader
 
+    def relocate_binaries(self):
+        """Change the root prefix of the patched executables and libs
+        and the symbolic links of a container that was moved or copied.
+        The root prefix has a fixed length and is changed in place.
+        Returns False if the container must be restored and patched.
+        """
+        with FileLock(self._container_patch_lock):
+            last_path = self.get_patch_last_path()
+            if not last_path or last_path == self._container_dir:
+                return True
+            (manifest, since) = self._load_patch_list()
+            old_root = self._patch_root(last_path)
+            if not manifest:
+                return False
+            Msg().out("Info: relocating container from:", last_path,
+                      l=Msg.INF)
+            if FileUtil(self._container_root).links_conv(
+                    False, True, last_path + "/ROOT",
+                    self._index.links()) is None:
+                return False
+            patch_list = self._patched_files(manifest, since)
+            results = WorkerPool().map(
+                lambda f_path: ElfFile(f_path).relocate(
+                    old_root, self._container_patch_root), patch_list)
+            self._update_patch_list(
+                manifest, [f_path for (f_path, status)
+                           in zip(patch_list, results) if status is True],
+                self._container_patch_root)
+            fallback_list = [f_path for (f_path, status)
+                             in zip(patch_list, results) if status is None]
+            if fallback_list:
+                self._patch_files(fallback_list, old_root, True)
+                self._patch_files(fallback_list, self._container_patch_root,
+                                  manifest=manifest)
+            # not matched: patched at run time without padding by F4
+            unmatched_list = [f_path for (f_path, status)
+                              in zip(patch_list, results) if status is False]
+            if unmatched_list:
+                self._patch_files(unmatched_list, old_root, True)
+                self._patch_files(unmatched_list, self._container_patch_root,
+                                  manifest=manifest)
+            self._save_patch_list(manifest)
+            ld_str = FileUtil(self._container_ld_libdirs).getdata("r")
+            if ld_str:
+                FileUtil(self._container_ld_libdirs).putdata(':'.join(
+                    [self._container_root + ld_dir[len(last_path + "/ROOT"):]
+                     if ld_dir.startswith(last_path + "/ROOT") else ld_dir
+                     for ld_dir in ld_str.strip().split(':')]), "w")
+            return bool(FileUtil(self._container_patch_path).putdata(
+                self._container_dir, "w"))
+
     def patch_ld(self, output_elf=None):
         """Patch ld.so"""
         elf_loader = self.get_container_loader()
@@ -1974,39 +3417,99 @@ class ElfPatcher(object):
             return False
         return True
 
-    def _get_ld_config(self):
-        """Get get directories from container ld.so.cache"""
-        cmd = ["ldconfig", "-p", "-C", "%s/%s" % (self._container_root,
-                                                  Config.ld_so_cache)]
-        ld_dict = dict()
-        ld_data = Uprocess().get_output(cmd)
-        if not ld_data:
+    @staticmethod
+    def _ld_cache_libs(data):
+        """Get the (soname, pathname) of the libraries from the content
+        of a glibc ld.so.cache in the old, new or combined binary formats
+        """
+        libs = []
+        try:
+            if data.startswith(ElfPatcher.LD_CACHE_OLD):
+                (nlibs, ) = struct.unpack_from("=I", data, 12)
+                strings = 16 + nlibs * 12
+                new_start = (strings + 7) // 8 * 8
+                if not data[new_start:].startswith(ElfPatcher.LD_CACHE_NEW):
+                    for idx in range(nlibs):
+                        (dummy, key, value) = \
+                            struct.unpack_from("=iII", data, 16 + idx * 12)
+                        libs.append(
+                            (data[strings + key:].split(b"\0", 1)[0],
+                             data[strings + value:].split(b"\0", 1)[0]))
+                    return libs
+                data = data[new_start:]
+            if data.startswith(ElfPatcher.LD_CACHE_NEW):
+                (nlibs, ) = struct.unpack_from("=I", data, 20)
+                for idx in range(nlibs):
+                    (dummy, key, value, dummy, dummy) = \
+                        struct.unpack_from("=iIIIQ", data, 48 + idx * 24)
+                    libs.append((data[key:].split(b"\0", 1)[0],
+                                 data[value:].split(b"\0", 1)[0]))
+        except (struct.error, TypeError, AttributeError):
             return []
-        for line in ld_data.split('\n'):
-            match = re.search("([^ ]+) => ([^ ]+)", line)
-            if match:
-                ld_dict[self._container_root + \
-                        os.path.dirname(match.group(2))] = True
-        return ld_dict.keys()
-
-    # pylint: disable=too-many-nested-blocks
-    def _find_ld_libdirs(self, root_path=None):
-        """search for library directories in container"""
-        if root_path is None:
-            root_path = self._container_root
+        return libs
+
+    def _get_ld_cache(self):
+        """Get the container ld.so.cache as a dict with the key (size and
+        mtime of the cache file), the library directories and the paths
+        of each soname in cache order. The dict is kept in the container
+        dir until the ld.so.cache is changed.
+        """
+        ld_cache = "%s/%s" % (self._container_root, Config.ld_so_cache)
+        try:
+            cache_stat = os.stat(ld_cache)
+        except OSError:
+            return {"key": None, "dirs": [], "libs": {}}
+        cache_key = [cache_stat.st_size, cache_stat.st_mtime]
+        saved = self._localrepo.load_json(self._container_ld_cachedirs)
+        if (isinstance(saved, dict) and saved.get("key") == cache_key and
+                "libs" in saved):
+            return saved
+        try:
+            with open(ld_cache, "rb") as filep:
+                ld_data = filep.read()
+        except (IOError, OSError):
+            return {"key": None, "dirs": [], "libs": {}}
+        ld_dirs = []
+        ld_libs = dict()
+        for (soname, lib) in self._ld_cache_libs(ld_data):
+            if not isinstance(lib, str):
+                soname = soname.decode("utf-8", "replace")
+                lib = lib.decode("utf-8", "replace")
+            dir_name = os.path.dirname(lib)
+            if not dir_name.startswith('/'):
+                continue
+            if dir_name not in ld_dirs:
+                ld_dirs.append(dir_name)
+            ld_libs.setdefault(soname, []).append(lib)
+        saved = {"key": cache_key, "dirs": ld_dirs, "libs": ld_libs}
+        self._localrepo.save_json(self._container_ld_cachedirs, saved)
+        return saved
+
+    def _get_ld_config(self):
+        """Get directories from container ld.so.cache"""
+        return [self._container_root + dir_name
+                for dir_name in self._get_ld_cache()["dirs"]]
+
+    def _find_ld_libdirs(self, root_path=None, lib_files=None):
+        """search for library directories in container, lib_files are
+        (dir_path, f_path) pairs already found by the caller
+        """
+        if lib_files is None and root_path is None:
+            lib_files = self._scan_container()[1]
+        elif lib_files is None:
+            lib_files = []
+            for dir_path, dummy, files in os.walk(root_path):
+                lib_files.extend([(dir_path, dir_path + '/' + f_name)
+                                  for f_name in files
+                                  if self._shlib.match(f_name)])
         ld_list = []
-        for dir_path, dummy, files in os.walk(root_path):
-            for f_name in files:
-                try:
-                    f_path = dir_path + '/' + f_name
-                    if not os.access(f_path, os.R_OK):
-                        continue
-                    elif os.path.isfile(f_path):
-                        if self._shlib.match(f_name):
-                            if dir_path not in ld_list:
-                                ld_list.append(dir_path)
-                except OSError:
-                    continue
+        for (dir_path, f_path) in lib_files:
+            try:
+                if (dir_path not in ld_list and os.access(f_path, os.R_OK)
+                        and os.path.isfile(f_path)):
+                    ld_list.append(dir_path)
+            except OSError:
+                continue
         return ld_list
 
     def get_ld_libdirs(self, force=False):
@@ -2019,15 +3522,170 @@ class ElfPatcher(object):
         ld_str = FileUtil(self._container_ld_libdirs).getdata()
         return ld_str.split(':')
 
-    def get_ld_library_path(self):
-        """Get ld library paths"""
+    def _find_needed(self, soname, search, ld_cache, elf_id):
+        """Find a DT_NEEDED library in the order of the loader: the
+        DT_RPATH of the object and of its loaders (only if the object has
+        no DT_RUNPATH), the LD_LIBRARY_PATH, the DT_RUNPATH, the
+        ld.so.cache and the default directories. search has the lists of
+        directories (rpath, ld_library_path, runpath, default).
+        Returns (f_path, info, in_rpath).
+        """
+        (rpath_dirs, ld_path_dirs, runpath_dirs, default_dirs) = search
+        candidates = [(dir_name + '/' + soname, True)
+                      for dir_name in rpath_dirs]
+        candidates.extend([(dir_name + '/' + soname, False)
+                           for dir_name in ld_path_dirs])
+        candidates.extend([(dir_name + '/' + soname, True)
+                           for dir_name in runpath_dirs])
+        candidates.extend([(self._container_root + lib, False)
+                           for lib in ld_cache["libs"].get(soname, [])])
+        candidates.extend([(dir_name + '/' + soname, False)
+                           for dir_name in default_dirs])
+        for (f_path, in_rpath) in candidates:
+            if not os.path.isfile(f_path):
+                continue
+            info = ElfFile(f_path).get_dynamic_info()
+            if info and (info["class"], info["machine"]) == elf_id:
+                return (f_path, info, in_rpath)
+        return (None, None, False)
+
+    def _rpath_dirs(self, f_path, rpaths):
+        """Host pathnames of the RPATH/RUNPATH directories of an object"""
+        rpath_dirs = []
+        for rpath in rpaths:
+            if not isinstance(rpath, str):
+                rpath = rpath.decode("utf-8", "replace")
+            for dir_name in rpath.split(':'):
+                dir_name = dir_name.replace("${ORIGIN}", "$ORIGIN").replace(
+                    "$ORIGIN", os.path.dirname(f_path))
+                if not dir_name.startswith(self._container_root):
+                    dir_name = self._container_root + '/' + dir_name
+                rpath_dirs.append(os.path.normpath(dir_name))
+        return rpath_dirs
+
+    def _walk_needed(self, exec_path, exec_info, ld_path_dirs):
+        """Resolve the DT_NEEDED closure of an executable with the given
+        LD_LIBRARY_PATH, returns the directories of the libraries found
+        through the LD_LIBRARY_PATH, the ld.so.cache or the default
+        directories, in the order they are found
+        """
+        elf_id = (exec_info["class"], exec_info["machine"])
+        ld_cache = self._get_ld_cache()
+        default_dirs = [self._container_root + dir_name
+                        for dir_name in Config.lib_dirs_list_essential]
+        ld_dirs = []
+        found = set()
+        queue = [(exec_path, exec_info, [])]
+        while queue:
+            (f_path, info, loaders_rpath) = queue.pop(0)
+            if info["runpath"]:     # DT_RPATH ignored if there is RUNPATH
+                chain_rpath = loaders_rpath
+                search = ([], ld_path_dirs,
+                          self._rpath_dirs(f_path, info["runpath"]),
+                          default_dirs)
+            else:
+                chain_rpath = (self._rpath_dirs(f_path, info["rpath"]) +
+                               loaders_rpath)
+                search = (chain_rpath, ld_path_dirs, [], default_dirs)
+            for soname in info["needed"]:
+                if not isinstance(soname, str):
+                    soname = soname.decode("utf-8", "replace")
+                if soname in found or '/' in soname:
+                    continue
+                (lib_path, lib_info, in_rpath) = self._find_needed(
+                    soname, search, ld_cache, elf_id)
+                if not lib_path:
+                    return None
+                found.add(soname)
+                queue.append((lib_path, lib_info, chain_rpath))
+                dir_name = os.path.dirname(lib_path)[
+                    len(self._container_root):] or '/'
+                if not in_rpath and dir_name not in ld_dirs:
+                    ld_dirs.append(dir_name)
+        return ld_dirs
+
+    def _get_ld_closure(self, exec_path):
+        """Get the directories of the libraries in the DT_NEEDED closure
+        of an executable in the order they are found by the loader. The
+        directories are relative to the container root. Returns None if
+        the executable is not dynamic or a library cannot be found.
+        The LD_LIBRARY_PATH used has these directories first followed
+        by all the library directories, the closure is resolved again
+        until it does not change.
+        """
+        exec_info = ElfFile(exec_path).get_dynamic_info()
+        if not (exec_info and exec_info["needed"]):
+            return None
+        all_dirs = [dir_name for dir_name in self._get_ld_library_list()
+                    if dir_name.startswith(self._container_root)]
+        ld_path_dirs = all_dirs
+        ld_dirs = None
+        for dummy in range(3):
+            ld_dirs = self._walk_needed(exec_path, exec_info, ld_path_dirs)
+            if ld_dirs is None:
+                return None
+            closure = [self._container_root + dir_name
+                       for dir_name in ld_dirs]
+            closure.extend([dir_name for dir_name in all_dirs
+                            if dir_name not in closure])
+            if closure == ld_path_dirs:
+                break
+            ld_path_dirs = closure
+        return ld_dirs
+
+    def get_ld_closure(self, exec_path):
+        """Get the library directories needed by an executable, cached
+        per executable in the container dir. Returns None if they
+        cannot be determined.
+        """
+        try:
+            exec_stat = os.stat(exec_path)
+        except (OSError, TypeError):
+            return None
+        exec_key = [exec_stat.st_size, exec_stat.st_mtime,
+                    self._get_ld_cache()["key"]]
+        exec_name = exec_path[len(self._container_root):]
+        saved = self._localrepo.load_json(self._container_ld_paths)
+        if not isinstance(saved, dict):
+            saved = dict()
+        if exec_name in saved and saved[exec_name][0] == exec_key:
+            return saved[exec_name][1]
+        ld_dirs = self._get_ld_closure(exec_path)
+        if ld_dirs is not None:
+            saved[exec_name] = [exec_key, ld_dirs]
+            self._localrepo.save_json(self._container_ld_paths, saved)
+        return ld_dirs
+
+    def _get_ld_library_list(self):
+        """All the library directories of the container, the essential
+        directories first
+        """
         ld_list = self._get_ld_config()
         ld_list.extend(self.get_ld_libdirs())
         for ld_dir in Config.lib_dirs_list_essential:
-            ld_dir = self._container_root + '/' + ld_dir
+            ld_dir = self._container_root + ld_dir
             if ld_dir not in ld_list:
                 ld_list.insert(0, ld_dir)
         ld_list.extend(Config.lib_dirs_list_append)
+        return ld_list
+
+    def get_ld_library_path(self, exec_path=None):
+        """Get ld library paths, if the executable is given only the
+        directories of the libraries it needs, in the order they are
+        found, and the essential directories are returned. Otherwise
+        all the library directories of the container are returned.
+        """
+        ld_dirs = None
+        if exec_path:
+            ld_dirs = self.get_ld_closure(exec_path)
+        if ld_dirs is None:
+            return ':'.join(self._get_ld_library_list())
+        ld_list = [self._container_root + dir_name for dir_name in ld_dirs]
+        for ld_dir in Config.lib_dirs_list_essential:
+            ld_dir = self._container_root + ld_dir
+            if ld_dir not in ld_list and os.path.isdir(ld_dir):
+                ld_list.append(ld_dir)
+        ld_list.extend(Config.lib_dirs_list_append)
         return ':'.join(ld_list)
 
 
@@ -3992,8 +5650,10 @@ class FakechrootEngine(ExecutionEngineCommon):
                 file_list.append(c_path)
         return ':'.join(file_list)
 
-    def _fakechroot_env_set(self):
-        """fakechroot environment variables to set"""
+    def _fakechroot_env_set(self, exec_path=None):
+        """fakechroot environment variables to set, the LD_LIBRARY_PATH
+        starts with the library directories needed by exec_path
+        """
         (host_volumes, map_volumes) = self._get_volume_bindings()
         self._fakechroot_so = self.select_fakechroot_so()
         access_filesok = self._get_access_filesok()
@@ -4021,27 +5681,30 @@ class FakechrootEngine(ExecutionEngineCommon):
         if access_filesok:
             self.opt["env"].append("FAKECHROOT_ACCESS_FILESOK=" +
                                    access_filesok)
-        # execution mode
-        ld_library_real = self._elfpatcher.get_ld_library_path()
+        # execution mode, children get all the library directories
+        ld_library_orig = self._elfpatcher.get_ld_library_path()
+        ld_library_real = ld_library_orig
+        if exec_path:
+            ld_library_real = self._elfpatcher.get_ld_library_path(exec_path)
         xmode = self.exec_mode.get_mode()
         if xmode == "F1":
             self.opt["env"].append("FAKECHROOT_ELFLOADER=" +
                                    self._elfpatcher.get_container_loader())
-            self.opt["env"].append("LD_LIBRARY_PATH=" + ld_library_real)
+            self.opt["env"].append("LD_LIBRARY_PATH=" + ld_library_orig)
         elif xmode == "F2":
             self.opt["env"].append("FAKECHROOT_ELFLOADER=" +
                                    self._elfpatcher.get_container_loader())
-            self.opt["env"].append("FAKECHROOT_LIBRARY_ORIG=" + ld_library_real)
+            self.opt["env"].append("FAKECHROOT_LIBRARY_ORIG=" + ld_library_orig)
             self.opt["env"].append("LD_LIBRARY_REAL=" + ld_library_real)
             self.opt["env"].append("LD_LIBRARY_PATH=" + ld_library_real)
             #self.opt["env"].append("FAKECHROOT_DISALLOW_ENV_CHANGES=true")
         elif xmode == "F3":
-            self.opt["env"].append("FAKECHROOT_LIBRARY_ORIG=" + ld_library_real)
+            self.opt["env"].append("FAKECHROOT_LIBRARY_ORIG=" + ld_library_orig)
             self.opt["env"].append("LD_LIBRARY_REAL=" + ld_library_real)
             self.opt["env"].append("LD_LIBRARY_PATH=" + ld_library_real)
             #self.opt["env"].append("FAKECHROOT_DISALLOW_ENV_CHANGES=true")
         elif xmode == "F4":
-            self.opt["env"].append("FAKECHROOT_LIBRARY_ORIG=" + ld_library_real)
+            self.opt["env"].append("FAKECHROOT_LIBRARY_ORIG=" + ld_library_orig)
             self.opt["env"].append("LD_LIBRARY_REAL=" + ld_library_real)
             self.opt["env"].append("LD_LIBRARY_PATH=" + ld_library_real)
             self.opt["env"].append("FAKECHROOT_DISALLOW_ENV_CHANGES=true")
@@ -4115,13 +5778,15 @@ class FakechrootEngine(ExecutionEngineCommon):
         self._elfpatcher = ElfPatcher(self.localrepo, self.container_id)
 
         # verify if container pathnames are correct for this mode
-        if not self._elfpatcher.check_container_path():
+        if not (self._elfpatcher.check_container_path() or
+                (xmode in ("F3", "F4") and
+                 self._elfpatcher.relocate_binaries())):
             Msg().err("Warning: container path mismatch, use setup to convert",
                       l=Msg.WAR)
 
         # set basic environment variables
         self._run_env_set()
-        self._fakechroot_env_set()
+        self._fakechroot_env_set(exec_path)
         if not self._check_env():
             return 4
 
@@ -4318,6 +5983,9 @@ class ExecutionMode(object):
     S1: singularity
     """
 
+    valid_modes = ("P1", "P2", "F1", "F2", "F3", "F4", "R1",
+                   "R2", "R3", "S1")
+
     def __init__(self, localrepo, container_id):
         self.localrepo = localrepo               # LocalRepository object
         self.container_id = container_id         # Container id
@@ -4327,8 +5995,6 @@ class ExecutionMode(object):
         self.container_orig_root = self.container_dir + "/root.path"
         self.exec_engine = None
         self.force_mode = None                   # for overlay execution
-        self.valid_modes = ("P1", "P2", "F1", "F2", "F3", "F4", "R1",
-                            "R2", "R3", "S1")
 
     def get_mode(self):
         """Get execution mode"""
@@ -4353,10 +6019,11 @@ class ExecutionMode(object):
             return True
         if prev_xmode[0] in ('R', 'S') and xmode[0] != 'R':
             filebind.restore()
-        if xmode[0] == 'F':
+        if xmode in ('F1', 'F2'):
             if force or prev_xmode[0] in ('P', 'R', 'S'):
-                status = (FileUtil(self.container_root).links_conv(force, True,
-                                                                   orig_path)
+                links = ContainerIndex(self.container_dir).links()
+                status = (FileUtil(self.container_root).links_conv(
+                    force, True, orig_path, links)
                           and elfpatcher.get_ld_libdirs(force))
         if xmode in ('P1', 'P2', 'F1', 'R1', 'R2', 'R3', 'S1'):
             if prev_xmode in ('P1', 'P2', 'F1', 'R1', 'R2', 'R3', 'S1'):
@@ -4373,14 +6040,15 @@ class ExecutionMode(object):
                 status = elfpatcher.patch_ld()
         elif xmode in ('F3', 'F4'):
             if force or prev_xmode in ('P1', 'P2', 'F1', 'F2', 'R1', 'R2', 'R3', 'S1'):
-                status = (elfpatcher.patch_ld() and
-                          elfpatcher.patch_binaries())
+                status = elfpatcher.patch_container(
+                    force or prev_xmode[0] in ('P', 'R', 'S'), force, orig_path)
             elif prev_xmode in ('F3', 'F4'):
                 status = True
         if xmode[0] in ('P', 'R', 'S'):
             if force or (status and prev_xmode.startswith('F')):
-                status = FileUtil(self.container_root).links_conv(force, False,
-                                                                  orig_path)
+                links = ContainerIndex(self.container_dir).links()
+                status = FileUtil(self.container_root).links_conv(
+                    force, False, orig_path, links)
         if status or force:
             status = FileUtil(self.container_execmode).putdata(xmode)
         if status or force:
@@ -4484,6 +6152,8 @@ class ContainerStructure(object):
         elif not self._chk_container_root():
             Msg().err("Warning: check container content:", self.container_id,
                       l=Msg.WAR)
+        else:
+            self.localrepo.get_size(self.container_id, refresh=True)
         return self.container_id
 
     def create_fromlayer(self, imagerepo, tag, layer_file, container_json):
@@ -4525,7 +6195,9 @@ class ContainerStructure(object):
         status = self._untar_layers([clone_file, ], container_dir)
         if not status:
             Msg().err("Error: creating container clone:", self.container_id)
-        elif not self._chk_container_root():
+            return self.container_id
+        self.localrepo.refresh_container_index(self.container_id)
+        if not self._chk_container_root():
             Msg().err("Warning: check container content:", self.container_id,
                       l=Msg.WAR)
         return self.container_id
@@ -4578,6 +6250,7 @@ class ContainerStructure(object):
             wildcards = []
         for tarf in tarfiles:
             if tarf != '-':
+                tarf = self.localrepo.get_uncompressed_layer(tarf)
                 self._apply_whiteouts(tarf, destdir)
             verbose = ''
             if Msg.level >= Msg.VER:
@@ -4669,28 +6342,551 @@ class ContainerStructure(object):
             Msg().err("Error: exporting container as clone:", self.container_id)
         return self.container_id
 
-    def clone(self):
-        """Clone a container by creating a complete copy
-        """
-        source_container_dir = self.localrepo.cd_container(self.container_id)
-        if not source_container_dir:
-            Msg().err("Error: source container not found:", self.container_id)
-            return False
-        dest_container_id = Unique().uuid(os.path.basename(self.imagerepo))
+    def _clone_to(self, source_container_dir, dest_container_id):
+        """Copy a container directory into a new container"""
         dest_container_dir = self.localrepo.setup_container(
             "CLONING", "inprogress", dest_container_id)
         if not dest_container_dir:
             Msg().err("Error: create destination container: setting up")
             return False
-        status = FileUtil(source_container_dir).copydir(dest_container_dir)
+        status = FileUtil(source_container_dir).clonedir(dest_container_dir)
         if not status:
             Msg().err("Error: creating container:", dest_container_id)
             return False
+        self.localrepo.refresh_container_index(dest_container_id)
         if not self._chk_container_root(dest_container_id):
             Msg().err("Warning: check container content:", dest_container_id,
                       l=Msg.WAR)
         return dest_container_id
 
+    def clone(self):
+        """Clone a container by creating a complete copy
+        """
+        source_container_dir = self.localrepo.cd_container(self.container_id)
+        if not source_container_dir:
+            Msg().err("Error: source container not found:", self.container_id)
+            return False
+        return self._clone_to(source_container_dir,
+                              Unique().uuid(os.path.basename(self.imagerepo)))
+
+    def clone_many(self, count):
+        """Create several copies of a container in parallel,
+        returns the list of ids with False for failed copies
+        """
+        source_container_dir = self.localrepo.cd_container(self.container_id)
+        if not source_container_dir:
+            Msg().err("Error: source container not found:", self.container_id)
+            return []
+        dest_container_ids = [Unique().uuid(os.path.basename(self.imagerepo))
+                              for dummy in range(count)]
+        return WorkerPool().map(
+            lambda container_id: self._clone_to(source_container_dir,
+                                                container_id),
+            dest_container_ids)
+
+
+class TarStreamCheck(object):
+    """Check the structure of a tar stream fed in chunks of any
+    size. Header checksums are validated and member data is skipped
+    using the sizes from the headers including pax and base-256
+    sizes. The stream is valid if it does not end inside a member.
+    """
+
+    BLOCK = 512
+    NODATA_TYPES = b"123456"
+
+    def __init__(self):
+        self.pending = b""
+        self.skip = 0
+        self.pax_size = None
+        self.pax_data = None
+        self.sparse_ext = False
+        self.end = False
+        self.status = True
+
+    @staticmethod
+    def _number(field):
+        """Decode a numeric header field in octal or base-256"""
+        field = bytearray(field)
+        if field and field[0] & 0x80:
+            value = field[0] & 0x3f
+            for byte in field[1:]:
+                value = value * 256 + byte
+            return value
+        field = bytes(field).replace(b"\0", b" ").strip()
+        return int(field or b"0", 8)
+
+    def _header_ok(self, block):
+        """Validate the checksum of a header block"""
+        try:
+            chksum = self._number(block[148:156])
+        except ValueError:
+            return False
+        total = sum(bytearray(block[:148])) + 256 + \
+            sum(bytearray(block[156:]))
+        return chksum == total
+
+    def _header(self, block):
+        """Process a header block, returns the size of member data"""
+        if not self._header_ok(block):
+            self.status = False
+            return 0
+        mtype = block[156:157]
+        size = self._number(block[124:136])
+        if self.pax_size is not None:
+            size = self.pax_size
+            self.pax_size = None
+        if mtype == b'S' and bytearray(block[482:483]) == bytearray(b"\1"):
+            self.sparse_ext = True
+        if mtype in (b'x', b'X'):
+            self.pax_data = b""
+        elif mtype and mtype in TarStreamCheck.NODATA_TYPES:
+            return 0
+        return size
+
+    def _pax_end(self):
+        """Get the size of the next member from a pax header"""
+        for record in self.pax_data.split(b"\n"):
+            if b" size=" in record:
+                try:
+                    self.pax_size = int(record.split(b"=", 1)[1])
+                except ValueError:
+                    self.status = False
+        self.pax_data = None
+
+    def feed(self, data):
+        """Process a chunk of the uncompressed stream"""
+        if self.end or not self.status:
+            return self.status
+        if self.pending:
+            data = self.pending + data
+        pos = 0
+        while pos < len(data) and self.status:
+            if self.skip:
+                nbytes = min(self.skip, len(data) - pos)
+                if self.pax_data is not None:
+                    self.pax_data += data[pos:pos + nbytes]
+                pos += nbytes
+                self.skip -= nbytes
+                if not self.skip and self.pax_data is not None:
+                    self._pax_end()
+                continue
+            if len(data) - pos < TarStreamCheck.BLOCK:
+                break
+            block = data[pos:pos + TarStreamCheck.BLOCK]
+            pos += TarStreamCheck.BLOCK
+            if self.sparse_ext:
+                self.sparse_ext = bytearray(block[504:505]) == bytearray(b"\1")
+            elif block.count(b"\0") == TarStreamCheck.BLOCK:
+                self.end = True
+                break
+            else:
+                size = self._header(block)
+                self.skip = ((size + TarStreamCheck.BLOCK - 1) //
+                             TarStreamCheck.BLOCK * TarStreamCheck.BLOCK)
+        self.pending = b"" if self.end else data[pos:]
+        return self.status
+
+    def close(self):
+        """Check the end of the stream"""
+        return bool(self.status and (self.end or not (
+            self.skip or self.pending or self.sparse_ext)))
+
+
+class LayerIndex(object):
+    """Index of the members of an image layer tar file.
+    For each member the index keeps the type, size, data offset in
+    the uncompressed tar stream, link target and mode. The index is
+    stored next to the layer file with the suffix .idx and allows
+    reading single files from a layer without extracting it.
+    Member entries are lists: [type, size, offset, linkname, mode]
+    where type is f (file), d (directory), l (symlink), h (hardlink)
+    or o (other).
+    """
+
+    INDEX_VERSION = 1
+    CHUNK = 1024 * 1024
+    MAGIC = ((b"\x1f\x8b", "gzip"), (b"BZh", "bzip2"),
+             (b"\xfd7zXZ\x00", "xz"), )
+
+    def __init__(self, layer_file):
+        self.layer_file = os.path.realpath(layer_file)
+        self.index_file = self.layer_file + ".idx"
+        self.compression = ""
+        self.members = None
+
+    @staticmethod
+    def normpath(pathname):
+        """Normalize a member pathname, no leading or trailing /"""
+        pathname = os.path.normpath('/' + str(pathname)).lstrip('/')
+        return "" if pathname == '.' else pathname
+
+    def _layer_stat(self):
+        """Size and modification time used to validate the index"""
+        try:
+            layer_stat = os.stat(self.layer_file)
+        except (IOError, OSError):
+            return (-1, -1)
+        return (layer_stat.st_size, int(layer_stat.st_mtime))
+
+    def get_compression(self):
+        """Identify the compression of the layer from the magic bytes"""
+        try:
+            with open(self.layer_file, "rb") as layerfp:
+                magic = layerfp.read(6)
+        except (IOError, OSError):
+            return None
+        for (magic_bytes, compression) in LayerIndex.MAGIC:
+            if magic.startswith(magic_bytes):
+                return compression
+        return ""
+
+    def _decompressor(self):
+        """Get a decompressor object for the layer compression"""
+        if self.compression == "gzip":
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.compression == "bzip2":
+            return bz2.BZ2Decompressor()
+        elif self.compression == "xz":
+            return lzma.LZMADecompressor()
+        return None
+
+    @staticmethod
+    def _stream_end(dobj):
+        """Was the end of the compressed stream reached, the zlib and bz2
+        decompressors of python 2 have no eof attribute. A finished zlib
+        stream keeps further input as unused data and a finished bz2
+        stream refuses further input.
+        """
+        eof = getattr(dobj, "eof", None)
+        if eof is not None:
+            return bool(eof)
+        if hasattr(dobj, "copy"):
+            try:
+                probe = dobj.copy()
+                probe.decompress(b"\0")
+            except (zlib.error, ValueError):
+                return False
+            return len(probe.unused_data) > len(dobj.unused_data)
+        try:
+            dobj.decompress(b"")
+        except EOFError:
+            return True
+        return False
+
+    def _read_index(self):
+        """Read the index file if valid for the current layer file"""
+        try:
+            with open(self.index_file, 'r') as indexfp:
+                index = json.load(indexfp)
+        except (IOError, OSError, AttributeError, ValueError, TypeError):
+            return False
+        (size, mtime) = self._layer_stat()
+        try:
+            if (index["version"] != LayerIndex.INDEX_VERSION or
+                    index["size"] != size or index["mtime"] != mtime):
+                return False
+            self.compression = index["compression"]
+            self.members = index["members"]
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def _write_index(self, size, mtime):
+        """Write the index next to the layer, the rename makes the
+        update atomic for concurrent readers. If the layers directory
+        is not writable the index is only kept in memory.
+        """
+        index = {"version": LayerIndex.INDEX_VERSION, "size": size,
+                 "mtime": mtime, "compression": self.compression,
+                 "members": self.members, }
+        tmp_file = self.index_file + ".%d.tmp" % os.getpid()
+        try:
+            with open(tmp_file, 'w') as indexfp:
+                json.dump(index, indexfp)
+            os.rename(tmp_file, self.index_file)
+        except (IOError, OSError, AttributeError, ValueError, TypeError):
+            try:
+                os.remove(tmp_file)
+            except (IOError, OSError):
+                pass
+            return False
+        return True
+
+    def build(self):
+        """Scan the layer tar file and build the index"""
+        (size, mtime) = self._layer_stat()
+        self.compression = self.get_compression()
+        if self.compression is None:
+            return False
+        Msg().out("Info: indexing layer:", self.layer_file, l=Msg.INF)
+        members = dict()
+        try:
+            tarf = tarfile.open(self.layer_file, "r:*")
+            try:
+                while True:
+                    tarinfo = tarf.next()
+                    if tarinfo is None:
+                        break
+                    tarf.members = []          # do not keep TarInfo list
+                    if tarinfo.isreg():
+                        ftype = 'f'
+                    elif tarinfo.isdir():
+                        ftype = 'd'
+                    elif tarinfo.issym():
+                        ftype = 'l'
+                    elif tarinfo.islnk():
+                        ftype = 'h'
+                    else:
+                        ftype = 'o'
+                    members[self.normpath(tarinfo.name)] = \
+                        [ftype, tarinfo.size, tarinfo.offset_data,
+                         tarinfo.linkname, tarinfo.mode]
+            finally:
+                tarf.close()
+        except (tarfile.TarError, IOError, OSError, EOFError, zlib.error,
+                ValueError):
+            Msg().err("Error: indexing layer:", self.layer_file)
+            return False
+        for pathname in list(members.keys()):     # implicit directories
+            dirname = os.path.dirname(pathname)
+            while dirname and dirname not in members:
+                members[dirname] = ['d', 0, 0, "", 0o755]
+                dirname = os.path.dirname(dirname)
+        members.pop("", None)
+        self.members = members
+        self._write_index(size, mtime)
+        return True
+
+    def load(self):
+        """Load the index building it if missing or outdated"""
+        if self.members is not None:
+            return True
+        if self._read_index():
+            return True
+        return self.build()
+
+    def get(self, pathname):
+        """Get the index entry of a member pathname"""
+        return self.members.get(self.normpath(pathname))
+
+    def hides(self, pathname):
+        """True if pathname in lower layers is hidden by a whiteout
+        or opaque directory marker in this layer
+        """
+        dirname = ""
+        for component in self.normpath(pathname).split('/'):
+            if dirname and dirname + "/.wh..wh..opq" in self.members:
+                return True
+            if os.path.join(dirname, ".wh." + component) in self.members:
+                return True
+            dirname = os.path.join(dirname, component)
+        return False
+
+    def _chunks(self, offset, size):
+        """Generator of the data chunks in the uncompressed tar stream
+        from offset to offset+size. Uncompressed layers are accessed
+        directly, compressed layers are decompressed up to the end
+        of the requested range. A size of None reads to the end.
+        """
+        if size is None:
+            size = sys.maxsize
+        with open(self.layer_file, "rb") as layerfp:
+            if not self.compression:
+                layerfp.seek(offset)
+                while size > 0:
+                    buf = layerfp.read(min(size, LayerIndex.CHUNK))
+                    if not buf:
+                        break
+                    size -= len(buf)
+                    yield buf
+                return
+            dobj = self._decompressor()
+            position = 0
+            while size > 0:
+                buf = layerfp.read(LayerIndex.CHUNK)
+                if not buf:
+                    break
+                data = dobj.decompress(buf)
+                unused = getattr(dobj, "unused_data", b"")
+                if unused.startswith(b"\x1f\x8b"):   # multi member gzip
+                    dobj = self._decompressor()
+                    data += dobj.decompress(unused)
+                start = max(offset - position, 0)
+                position += len(data)
+                if position > offset:
+                    data = data[start:start + size]
+                    size -= len(data)
+                    yield data
+
+    def copyto(self, entry, outfp):
+        """Copy the data of a file member to an open file object"""
+        try:
+            for data in self._chunks(entry[2], entry[1]):
+                outfp.write(data)
+        except (IOError, OSError, EOFError, zlib.error, ValueError,
+                TypeError):
+            return False
+        return True
+
+    def uncompress(self, outfp):
+        """Write the whole uncompressed tar stream to an open file"""
+        self.compression = self.get_compression()
+        if self.compression is None:
+            return False
+        try:
+            for data in self._chunks(0, None):
+                outfp.write(data)
+        except (IOError, OSError, EOFError, zlib.error, ValueError,
+                TypeError):
+            return False
+        return True
+
+    def getdata(self, entry):
+        """Get the data of a file member"""
+        try:
+            return b"".join(self._chunks(entry[2], entry[1]))
+        except (IOError, OSError, EOFError, zlib.error, ValueError,
+                TypeError):
+            return None
+
+    def verify(self, algorithm="sha256"):
+        """Verify the layer in a single streaming read, the layer data
+        is hashed while the structure of the uncompressed tar stream
+        is checked. Returns (tar_status, digest), tar_status is None
+        if the layer is neither compressed nor a tar file and digest
+        is "" if the algorithm is not available.
+        """
+        self.compression = self.get_compression()
+        if self.compression is None:
+            return (False, "")
+        try:
+            hasher = hashlib.new(algorithm)
+        except (NameError, ValueError, TypeError):
+            hasher = None
+        tarcheck = TarStreamCheck()
+        dobj = self._decompressor()
+        try:
+            with open(self.layer_file, "rb") as layerfp:
+                buf = layerfp.read(LayerIndex.CHUNK)
+                if not (self.compression or buf[257:262] == b"ustar"):
+                    tarcheck = None
+                while buf:
+                    if hasher:
+                        hasher.update(buf)
+                    if tarcheck and tarcheck.status:
+                        try:
+                            data = dobj.decompress(buf) if dobj else buf
+                            unused = getattr(dobj, "unused_data", b"")
+                            if unused.startswith(b"\x1f\x8b"):
+                                dobj = self._decompressor()
+                                data += dobj.decompress(unused)
+                        except (IOError, OSError, EOFError, zlib.error,
+                                ValueError):
+                            tarcheck.status = False
+                        else:
+                            tarcheck.feed(data)
+                    buf = layerfp.read(LayerIndex.CHUNK)
+        except (IOError, OSError):
+            return (False, "")
+        digest = hasher.hexdigest() if hasher else ""
+        if tarcheck is None:
+            return (None, digest)
+        if dobj and tarcheck.status and not self._stream_end(dobj):
+            return (False, digest)      # truncated compressed stream
+        return (tarcheck.close(), digest)
+
+
+class ImageIndex(object):
+    """Random access to the files of an image without creating a
+    container. Pathnames are resolved across the layers starting
+    in the top layer honoring whiteouts and following symbolic links.
+    Layer indexes are only loaded when the search reaches the layer.
+    """
+
+    MAX_LINK_HOPS = 40
+
+    def __init__(self, localrepo):
+        self.localrepo = localrepo
+        self.layers = []
+
+    def select(self, imagerepo, tag):
+        """Select the image whose files are to be accessed"""
+        self.layers = []
+        if not self.localrepo.cd_imagerepo(imagerepo, tag):
+            return False
+        (dummy, layer_files) = self.localrepo.get_image_attributes()
+        if not layer_files:
+            return False
+        for layer_file in reversed(layer_files):      # top layer first
+            self.layers.append(LayerIndex(
+                self.localrepo.get_uncompressed_layer(layer_file)))
+        return True
+
+    def _lookup(self, pathname):
+        """Find a pathname without following symbolic links"""
+        for layer_index in self.layers:
+            if not layer_index.load():
+                break
+            entry = layer_index.get(pathname)
+            if entry:
+                return (layer_index, entry)
+            if layer_index.hides(pathname):
+                break
+        return (None, None)
+
+    def resolve(self, pathname):
+        """Resolve a pathname following symbolic links in all of its
+        components, returns the layer index and member entry
+        """
+        components = LayerIndex.normpath(pathname).split('/')
+        resolved = []
+        hops = 0
+        while components:
+            component = components.pop(0)
+            if component in ("", '.'):
+                continue
+            elif component == "..":
+                if resolved:
+                    resolved.pop()
+                continue
+            (layer_index, entry) = self._lookup('/'.join(resolved +
+                                                         [component]))
+            if not entry:
+                return (None, None)
+            elif entry[0] == 'l':
+                hops += 1
+                if hops > ImageIndex.MAX_LINK_HOPS:
+                    return (None, None)
+                if entry[3].startswith('/'):
+                    resolved = []
+                components = entry[3].split('/') + components
+            elif components and entry[0] != 'd':
+                return (None, None)
+            else:
+                resolved.append(component)
+        if not resolved:
+            return (None, None)
+        (layer_index, entry) = self._lookup('/'.join(resolved))
+        while entry and entry[0] == 'h' and hops < ImageIndex.MAX_LINK_HOPS:
+            hops += 1
+            entry = layer_index.get(entry[3])
+        return (layer_index, entry)
+
+    def copyto(self, pathname, outfp):
+        """Copy the content of a file in the image to a file object"""
+        (layer_index, entry) = self.resolve(pathname)
+        if not (entry and entry[0] == 'f'):
+            return False
+        return layer_index.copyto(entry, outfp)
+
+    def getdata(self, pathname):
+        """Get the content of a file in the image"""
+        (layer_index, entry) = self.resolve(pathname)
+        if not (entry and entry[0] == 'f'):
+            return None
+        return layer_index.getdata(entry)
+
 
 class LocalRepository(object):
     """Implements a basic repository for images and containers.
@@ -4706,8 +6902,17 @@ class LocalRepository(object):
                    and json metadata files.
     4. bin:        contains executables (PRoot)
     5. lib:        contains python libraries
+    The containers and their names are also kept in a JSON index
+    stored next to the containers directory, the image tags
+    referencing each layer in a JSON index next to the layers directory
+    and a catalog of the image tags in the repos directory.
     """
 
+    CONTAINERS_INDEX_VERSION = 1
+    LAYERS_REFS_VERSION = 1
+    TAGS_CATALOG_VERSION = 1
+    _index_lock = threading.RLock()
+
     def __init__(self, topdir=None):
         if topdir:
             self.topdir = topdir
@@ -4735,6 +6940,15 @@ class LocalRepository(object):
         self.cur_repodir = ""
         self.cur_tagdir = ""
         self.cur_containerdir = ""
+        self.containers_index_file = self.containersdir + ".idx"
+        self._containers_index_cache = None
+        self.layers_refs_file = self.layersdir + ".refs"
+        self.tags_catalog_file = self.reposdir + "/.catalog"
+        self._tags_catalog_cache = None
+        if ChkSUM.cache_file != self.layersdir + ".digests":
+            ChkSUM.cache_file = self.layersdir + ".digests"
+            ChkSUM.cache_dir = self.layersdir
+            ChkSUM._cache = None
 
         FileUtil(self.reposdir).register_prefix()
         FileUtil(self.layersdir).register_prefix()
@@ -4829,15 +7043,159 @@ class LocalRepository(object):
             return 1
         return 0
 
-    def get_size(self, container_id):
-        """See if a container root dir is writable by this user"""
-        container_root = self.cd_container(container_id) + "/ROOT"
-        try:
-            size, dummy = Uprocess().get_output(["du", "-s", "-m", "-x",
-                                                 container_root]).split()
-            return int(size)
-        except (ValueError, NameError, AttributeError):
+    def get_size(self, container_id, refresh=False):
+        """Disk usage of a container in MB, the value is cached in the
+        container directory and measured again if refresh is requested,
+        the cache was reset, the ROOT changed after the measurement or
+        the measurement is older than Config.disk_usage_max_age. The
+        value is an approximation: changes below the top of ROOT do not
+        change its mtime, the cache is reset by run and setup and
+        otherwise expires.
+        """
+        container_dir = self.cd_container(container_id)
+        if not container_dir:
+            return -1
+        size_file = container_dir + "/disk.usage"
+        if not refresh:
+            try:
+                size_mtime = os.path.getmtime(size_file)
+                if (size_mtime >=
+                        os.path.getmtime(container_dir + "/ROOT") and
+                        time.time() - size_mtime <
+                        Config.disk_usage_max_age):
+                    size = int(FileUtil(size_file).getdata())
+                    return (size + 1048575) // 1048576
+            except (IOError, OSError, ValueError, TypeError):
+                pass
+        size = FileUtil(container_dir + "/ROOT").disk_usage()
+        if size < 0:
             return -1
+        FileUtil(size_file).putdata(str(size), "w")
+        return (size + 1048575) // 1048576
+
+    def reset_size(self, container_id):
+        """Reset the cached disk usage after the container was used"""
+        container_dir = self.cd_container(container_id)
+        if not container_dir:
+            return False
+        return FileUtil(container_dir + "/disk.usage").remove()
+
+    def _containers_scan(self):
+        """Scan the containers directory to build the index of
+        containers (id: imagerepo name) and names (name: id)
+        """
+        cindex = {"version": self.CONTAINERS_INDEX_VERSION, "mtime": None,
+                  "containers": {}, "names": {}, "ignored": []}
+        if not os.path.isdir(self.containersdir):
+            return cindex
+        try:
+            dir_entries = os.listdir(self.containersdir)
+        except (IOError, OSError):
+            return cindex
+        try:
+            cindex["mtime"] = os.stat(self.containersdir).st_mtime
+        except (IOError, OSError):
+            pass
+        for fname in dir_entries:
+            container_dir = self.containersdir + '/' + fname
+            try:
+                if os.path.islink(container_dir):
+                    cindex["names"][fname] = \
+                        os.path.basename(os.readlink(container_dir))
+                    continue
+                if not os.path.isdir(container_dir):
+                    cindex["ignored"].append(fname)
+                    continue
+            except (IOError, OSError):
+                cindex["ignored"].append(fname)
+                continue
+            try:
+                filep = open(container_dir + "/imagerepo.name", 'r')
+            except (IOError, OSError):
+                reponame = ""
+            else:
+                reponame = filep.read()
+                filep.close()
+            cindex["containers"][fname] = reponame
+        return cindex
+
+    def _index_save(self, index_file, data):
+        """Write a repository index atomically"""
+        return self.save_json(index_file, data)
+
+    def lock_index(self, index_file):
+        """Lock to serialize the processes updating an index file"""
+        return FileLock(index_file + ".lock")
+
+    def _containers_index_valid(self, cindex):
+        """Does the index match the containers directory, checked with
+        a single stat of the directory against the mtime in the index
+        """
+        try:
+            return (cindex["version"] == self.CONTAINERS_INDEX_VERSION and
+                    cindex["mtime"] == os.stat(self.containersdir).st_mtime)
+        except (IOError, OSError, KeyError, TypeError):
+            return False
+
+    def _containers_index_load(self, rebuild=False):
+        """Read the index from its file or rebuild it if it does not
+        match the containers directory, invoked holding its lock
+        """
+        cindex = None
+        if not rebuild:
+            cindex = self.load_json(self.containers_index_file)
+        if not self._containers_index_valid(cindex):
+            cindex = self._containers_scan()
+            if cindex["mtime"] is not None:
+                self._index_save(self.containers_index_file, cindex)
+        return cindex
+
+    def _containers_index(self, rebuild=False):
+        """Get the index of containers and names, the index is rebuilt
+        when the containers directory was changed by other means. Once
+        validated the index is kept in memory for the rest of the command.
+        """
+        with self._index_lock:
+            cindex = self._containers_index_cache
+            if cindex is not None and not rebuild:
+                return cindex
+            if not os.path.isdir(self.containersdir):
+                return self._containers_scan()
+            with self.lock_index(self.containers_index_file):
+                cindex = self._containers_index_load(rebuild)
+            self._containers_index_cache = cindex
+        return cindex
+
+    def _containers_index_update(self, container_id=None, reponame=None,
+                                 name=None, remove=False):
+        """Update the containers index after a change in the containers
+        directory, add or remove a container id and/or a name. The index
+        is read again from its file holding the lock shared with other
+        processes. If the directory has other changes it is rebuilt.
+        """
+        with self._index_lock:
+            with self.lock_index(self.containers_index_file):
+                cindex = self._containers_index_load()
+                if cindex["mtime"] is None:
+                    return False
+                if remove:
+                    if container_id:
+                        cindex["containers"].pop(container_id, None)
+                    if name:
+                        cindex["names"].pop(name, None)
+                else:
+                    if container_id and reponame is not None:
+                        cindex["containers"][container_id] = reponame
+                    if container_id and name:
+                        cindex["names"][name] = container_id
+                try:
+                    cindex["mtime"] = os.stat(self.containersdir).st_mtime
+                except (IOError, OSError):
+                    return False
+                if not self._containers_index_valid(cindex):
+                    cindex = self._containers_scan()
+                self._containers_index_cache = cindex
+                return self._index_save(self.containers_index_file, cindex)
 
     def get_containers_list(self, dir_only=True):
         """Get a list of all containers in the local repo
@@ -4846,26 +7204,26 @@ class LocalRepository(object):
                   if False  an extended listing containing further
                   container information
         """
+        cindex = self._containers_index()
+        containers = cindex["containers"]
+        if dir_only:
+            entries = list(containers.keys())
+            entries.extend([name for (name, container_id) in
+                            cindex["names"].items()
+                            if container_id in containers])
+            return [self.containersdir + '/' + fname
+                    for fname in sorted(entries)]
+        container_names = dict()
+        for (name, container_id) in cindex["names"].items():
+            container_names.setdefault(container_id, []).append(name)
         containers_list = []
-        if not os.path.isdir(self.containersdir):
-            return []
-        for fname in os.listdir(self.containersdir):
-            container_dir = self.containersdir + '/' + fname
-            if os.path.isdir(container_dir):
-                try:
-                    filep = open(container_dir + "/imagerepo.name", 'r')
-                except (IOError, OSError):
-                    reponame = ""
-                else:
-                    reponame = filep.read()
-                    filep.close()
-                if dir_only:
-                    containers_list.append(container_dir)
-                elif not os.path.islink(container_dir):
-                    names = self.get_container_name(fname)
-                    if not names:
-                        names = ""
-                    containers_list.append((fname, reponame, str(names)))
+        for container_id in sorted(containers.keys()):
+            names = [str(name) for name in
+                     sorted(container_names.get(container_id, []))]
+            if not names:
+                names = ""
+            containers_list.append((str(container_id),
+                                    containers[container_id], str(names)))
         return containers_list
 
     def del_container(self, container_id, force=False):
@@ -4883,14 +7241,23 @@ class LocalRepository(object):
                                                    stat.S_IXUSR)
                 if FileUtil(container_dir).remove(recursive=True):
                     self.cur_containerdir = ""
+                    self._containers_index_update(
+                        os.path.basename(container_dir),
+                        name=os.path.basename(container_dir), remove=True)
                     return True
         return False
 
     def cd_container(self, container_id):
         """Select a container directory for further operations"""
-        container_dir = self.containersdir + '/' + str(container_id)
+        container_id = str(container_id)
+        container_dir = self.containersdir + '/' + container_id
         if os.path.exists(container_dir):
-            if container_dir in self.get_containers_list(True):
+            cindex = self._containers_index()
+            if not (container_id in cindex["containers"] or
+                    cindex["names"].get(container_id) in cindex["containers"]):
+                cindex = self._containers_index(rebuild=True)
+            if (container_id in cindex["containers"] or
+                    cindex["names"].get(container_id) in cindex["containers"]):
                 return container_dir
         return ""
 
@@ -4923,7 +7290,10 @@ class LocalRepository(object):
                 linkname = os.path.realpath(self.containersdir + '/' + name)
                 if os.path.exists(linkname):
                     return False
-                return self._symlink(container_dir, linkname)
+                if self._symlink(container_dir, linkname):
+                    self._containers_index_update(
+                        os.path.basename(container_dir), name=name)
+                    return True
         return False
 
     def del_container_name(self, name):
@@ -4931,7 +7301,9 @@ class LocalRepository(object):
         if self._name_is_valid(name):
             linkname = self.containersdir + '/' + name
             if os.path.islink(linkname):
-                return FileUtil(linkname).remove()
+                if FileUtil(linkname).remove():
+                    self._containers_index_update(name=name, remove=True)
+                    return True
         return False
 
     def get_container_id(self, container_name):
@@ -4946,16 +7318,9 @@ class LocalRepository(object):
 
     def get_container_name(self, container_id):
         """From a container_id obtain its name(s)"""
-        if not os.path.isdir(self.containersdir):
-            return []
-        link_list = []
-        for fname in os.listdir(self.containersdir):
-            container = self.containersdir + '/' + fname
-            if os.path.islink(container):
-                real_container = os.readlink(container)
-                if os.path.basename(real_container) == container_id:
-                    link_list.append(fname)
-        return link_list
+        cindex = self._containers_index()
+        return [str(name) for (name, link_id) in cindex["names"].items()
+                if link_id == container_id]
 
     def setup_container(self, imagerepo, tag, container_id):
         """Create the directory structure for a container"""
@@ -4963,15 +7328,128 @@ class LocalRepository(object):
         if os.path.exists(container_dir):
             return ""
         try:
-            os.makedirs(container_dir + "/ROOT")
-            out_imagerepo = open(container_dir + "/imagerepo.name", 'w')
+            os.makedirs(container_dir + "/ROOT")
+        except (IOError, OSError):
+            return None
+        if not FileUtil(container_dir + "/imagerepo.name").putdata(
+                imagerepo + ':' + tag, 'w'):
+            return None
+        else:
+            self.cur_containerdir = container_dir
+            self._containers_index_update(str(container_id),
+                                          imagerepo + ':' + tag)
+            return container_dir
+
+    def refresh_container_index(self, container_id):
+        """Update the index entry of a container after its directory
+        was replaced as in clone operations
+        """
+        try:
+            filep = open(self.containersdir + '/' + container_id +
+                         "/imagerepo.name", 'r')
+            reponame = filep.read()
+            filep.close()
+        except (IOError, OSError):
+            return False
+        return self._containers_index_update(container_id, reponame)
+
+    def _gc_layers(self, limit):
+        """Files in the layers directory not referenced by any image tag"""
+        garbage = []
+        referenced = self._layers_refs_scan()["layers"]
+        for fname in os.listdir(self.layersdir):
+            f_path = self.layersdir + '/' + fname
+            if fname in referenced or fname.endswith((".tmp", ".lock")):
+                continue
+            if (os.path.islink(f_path) and
+                    os.path.basename(os.readlink(f_path)) in referenced):
+                continue
+            for suffix in (".tar.idx", ".idx", ".tar"):
+                if fname.endswith(suffix):
+                    if fname[:-len(suffix)] in referenced:
+                        f_path = ""
+                    break
+            if f_path and os.lstat(f_path).st_mtime < limit:
+                garbage.append((f_path, FileUtil(f_path).disk_usage()))
+        return garbage
+
+    def _gc_tmp(self, limit):
+        """Temporary files left by interrupted downloads and updates
+        and lock files no longer in use
+        """
+        garbage = []
+        tmp_files = glob.glob(self.layersdir + "/*.tmp")
+        tmp_files.extend(glob.glob(self.layersdir + "/*.lock"))
+        tmp_files.extend(glob.glob(self.reposdir + "/.*.lock"))
+        for index_file in (self.containers_index_file, self.layers_refs_file,
+                           self.tags_catalog_file, ChkSUM.cache_file):
+            if index_file:
+                tmp_files.extend(glob.glob(index_file + ".*.tmp"))
+        for f_path in tmp_files:
+            if os.path.getmtime(f_path) < limit:
+                garbage.append((f_path, FileUtil(f_path).disk_usage()))
+        return garbage
+
+    def _gc_containers(self, limit):
+        """Containers left by interrupted create and clone operations
+        and names of containers that no longer exist
+        """
+        containers = []
+        names = []
+        cindex = self._containers_scan()
+        for (container_id, reponame) in cindex["containers"].items():
+            container_dir = self.containersdir + '/' + container_id
+            if self._isprotected(container_dir):
+                continue
+            if (reponame == "CLONING:inprogress" or
+                    not os.path.isdir(container_dir + "/ROOT")):
+                if os.path.getmtime(container_dir) < limit:
+                    containers.append(
+                        (container_dir, FileUtil(container_dir).disk_usage()))
+        for (name, container_id) in cindex["names"].items():
+            if container_id not in cindex["containers"]:
+                names.append((self.containersdir + '/' + name, 0))
+        return (containers, names)
+
+    def gc_garbage(self, grace=None):
+        """Find the garbage in the repository, files and containers older
+        than grace seconds that are not referenced. Returns a dict of
+        category: list of (pathname, size in bytes)
+        """
+        if grace is None:
+            grace = Config.gc_grace
+        limit = time.time() - int(grace)
+        garbage = {"layers": [], "tmp": [], "containers": [], "names": []}
+        try:
+            garbage["layers"] = self._gc_layers(limit)
+            garbage["tmp"] = self._gc_tmp(limit)
+            (garbage["containers"], garbage["names"]) = \
+                self._gc_containers(limit)
         except (IOError, OSError):
             return None
-        else:
-            out_imagerepo.write(imagerepo + ':' + tag)
-            out_imagerepo.close()
-            self.cur_containerdir = container_dir
-            return container_dir
+        return garbage
+
+    def gc_remove(self, category, pathname):
+        """Remove one item of garbage found by gc_garbage()"""
+        if category == "containers":
+            return self.del_container(os.path.basename(pathname), force=True)
+        elif category == "names":
+            try:
+                os.remove(pathname)     # dangling link
+            except (IOError, OSError):
+                return False
+            self._containers_index_update(name=os.path.basename(pathname),
+                                          remove=True)
+            return True
+        elif category == "tmp":
+            return FileUtil(pathname).remove(force=True)
+        elif os.path.islink(pathname):
+            try:
+                os.remove(pathname)     # legacy layer name
+            except (IOError, OSError):
+                return False
+            return True
+        return FileUtil(pathname).remove()
 
     def _is_tag(self, tag_dir):
         """Does this directory contain an image tag ?
@@ -5018,6 +7496,12 @@ class LocalRepository(object):
                 if os.path.islink(f_path):
                     if filename in fullname:       # match .layer or .json
                         found_list.append(f_path)  # found reference to layer
+                        continue
+                    try:                           # v1 names link digests
+                        if os.path.basename(os.readlink(f_path)) == filename:
+                            found_list.append(f_path)
+                    except (IOError, OSError):
+                        pass
                 elif os.path.isdir(f_path):
                     found_list.extend(self._find(filename, f_path))
         return found_list
@@ -5026,22 +7510,107 @@ class LocalRepository(object):
         """Check if a given file is in the repository"""
         return self._find(filename, self.reposdir)
 
+    def _layers_refs_scan(self):
+        """Walk the image tags to find the tags referencing each layer"""
+        layers = dict()
+        for (imagerepo, tag) in self._get_tags(self.reposdir):
+            tag_ref = imagerepo + '/' + tag
+            tag_dir = self.reposdir + '/' + tag_ref
+            try:
+                for fname in os.listdir(tag_dir):
+                    f_path = tag_dir + '/' + fname
+                    if os.path.islink(f_path):
+                        layer = os.path.basename(os.readlink(f_path))
+                        if tag_ref not in layers.setdefault(layer, []):
+                            layers[layer].append(tag_ref)
+            except (IOError, OSError):
+                continue
+        return {"version": self.LAYERS_REFS_VERSION, "layers": layers}
+
+    def _layers_refs(self, rebuild=False):
+        """Get the index of layer references, layer: list of image tags
+        the index is rebuilt if missing or if rebuild is requested.
+        It is always read from its file, invoked holding its lock.
+        """
+        layers_refs = None
+        if not rebuild:
+            layers_refs = self.load_json(self.layers_refs_file)
+        if not (isinstance(layers_refs, dict) and
+                layers_refs.get("version") == self.LAYERS_REFS_VERSION):
+            layers_refs = self._layers_refs_scan()
+            self._index_save(self.layers_refs_file, layers_refs)
+        return layers_refs
+
+    def rebuild_layers_refs(self):
+        """Rebuild the index of layer references from the image tags"""
+        with self._index_lock:
+            with self.lock_index(self.layers_refs_file):
+                layers_refs = self._layers_refs(rebuild=True)
+        return os.path.exists(self.layers_refs_file) and layers_refs
+
+    def _layers_refs_update(self, tag_dir, layer):
+        """Add a reference from the image tag to a layer"""
+        tag_ref = tag_dir.replace(self.reposdir + '/', "", 1)
+        with self._index_lock:
+            with self.lock_index(self.layers_refs_file):
+                layers_refs = self._layers_refs()
+                refs = layers_refs["layers"].setdefault(layer, [])
+                if tag_ref in refs:
+                    return True
+                refs.append(tag_ref)
+                return self._index_save(self.layers_refs_file, layers_refs)
+
+    def _layer_inuse(self, layers, tag_ref, layer):
+        """Drop the reference from the tag and check if the layer is still
+        referenced by other tags. The index is trusted, the repository is
+        only searched for links to layers that are missing from the index.
+        """
+        if layer in layers:
+            if tag_ref in layers[layer]:
+                layers[layer].remove(tag_ref)
+            return bool(layers[layer])
+        refs = []
+        for f_path in self._inrepository(layer):
+            ref = os.path.dirname(f_path).replace(self.reposdir + '/', "", 1)
+            if ref not in refs:
+                refs.append(ref)
+        if refs:
+            layers[layer] = refs
+            return True
+        return False
+
     def _remove_layers(self, tag_dir, force):
         """Remove link to image layer and corresponding layer
         if not being used by other images
         """
-        for fname in os.listdir(tag_dir):
-            f_path = tag_dir + '/' + fname  # link to layer
-            if os.path.islink(f_path):
-                linkname = os.readlink(f_path)
-                layer_file = tag_dir + '/' + linkname
-                if not FileUtil(f_path).remove() and not force:
-                    return False
-                if not self._inrepository(linkname):
-                    # removing actual layers not reference by other repos
-                    if not FileUtil(layer_file).remove() and not force:
-                        return False
-        return True
+        tag_ref = tag_dir.replace(self.reposdir + '/', "", 1)
+        status = True
+        removed = []
+        with self._index_lock, self.lock_index(self.layers_refs_file):
+            layers_refs = self._layers_refs()
+            layers = layers_refs["layers"]
+            for fname in os.listdir(tag_dir):
+                f_path = tag_dir + '/' + fname  # link to layer
+                if os.path.islink(f_path):
+                    linkname = os.readlink(f_path)
+                    layer = os.path.basename(linkname)
+                    layer_file = tag_dir + '/' + linkname
+                    if not FileUtil(f_path).remove() and not force:
+                        status = False
+                        break
+                    if not self._layer_inuse(layers, tag_ref, layer):
+                        # removing actual layers not reference by other repos
+                        if not FileUtil(layer_file).remove() and not force:
+                            status = False
+                            break
+                        layers.pop(layer, None)
+                        removed.append(layer)
+                        for suffix in (".idx", ".tar", ".tar.idx"):
+                            FileUtil(layer_file + suffix).remove()
+            self._index_save(self.layers_refs_file, layers_refs)
+        if removed:
+            self._layer_alias_remove(removed)
+        return status
 
     def del_imagerepo(self, imagerepo, tag, force=False):
         """Delete an image repository and its layers"""
@@ -5054,6 +7623,7 @@ class LocalRepository(object):
             while imagerepo:
                 FileUtil(self.reposdir + '/' + imagerepo).rmdir()
                 imagerepo = "/".join(imagerepo.split("/")[:-1])
+            self._tags_catalog_update(tag_dir)
             return True
         return False
 
@@ -5072,22 +7642,295 @@ class LocalRepository(object):
                     tag_list.extend(self._get_tags(f_path))
         return tag_list
 
+    def _tags_catalog_entry(self, tag_ref):
+        """Collect the catalog entry of an image tag from its directory"""
+        tag_dir = self.reposdir + '/' + tag_ref
+        if not self._is_tag(tag_dir):
+            return None
+        (imagerepo, tag) = tag_ref.rsplit('/', 1)
+        entry = {"imagerepo": imagerepo, "tag": tag, "version": "",
+                 "manifest": "", "layers": [], "mtime": None}
+        try:
+            entry["mtime"] = os.stat(tag_dir).st_mtime
+            for fname in sorted(os.listdir(tag_dir)):
+                f_path = tag_dir + '/' + fname
+                if os.path.islink(f_path):
+                    entry["layers"].append([fname, FileUtil(f_path).size()])
+                elif fname in ("v1", "v2"):
+                    entry["version"] = fname
+                elif fname == "manifest":
+                    entry["manifest"] = "sha256:" + ChkSUM().sha256(f_path)
+        except (IOError, OSError):
+            return None
+        return entry
+
+    def _tags_catalog_entry_valid(self, entry, tag_dir):
+        """Does the entry match the mtime of the image tag directory"""
+        try:
+            return entry["mtime"] == os.stat(tag_dir).st_mtime
+        except (IOError, OSError, KeyError, TypeError):
+            return False
+
+    def _tags_catalog_walk(self, in_dir, catalog, old_tags):
+        """Collect the image tags below a directory and the mtime of the
+        directories, entries of old_tags still valid are kept
+        """
+        try:
+            if in_dir != self.reposdir:
+                catalog["dirs"][in_dir[len(self.reposdir):]] = \
+                    os.stat(in_dir).st_mtime
+            dir_entries = os.listdir(in_dir)
+        except (IOError, OSError):
+            return
+        for fname in dir_entries:
+            f_path = in_dir + '/' + fname
+            if self._is_tag(f_path):
+                tag_ref = f_path[len(self.reposdir) + 1:]
+                entry = old_tags.get(tag_ref)
+                if not self._tags_catalog_entry_valid(entry, f_path):
+                    entry = self._tags_catalog_entry(tag_ref)
+                if entry:
+                    catalog["tags"][tag_ref] = entry
+            elif os.path.isdir(f_path):
+                self._tags_catalog_walk(f_path, catalog, old_tags)
+
+    def _tags_catalog_scan(self, old_tags=None):
+        """Walk the repos directory to build the catalog of image tags"""
+        catalog = {"version": self.TAGS_CATALOG_VERSION, "repos": [],
+                   "dirs": {}, "tags": {}}
+        try:
+            catalog["repos"] = sorted([fname for fname in
+                                       os.listdir(self.reposdir)
+                                       if not fname.startswith('.')])
+        except (IOError, OSError):
+            return catalog
+        self._tags_catalog_walk(self.reposdir, catalog, old_tags or {})
+        return catalog
+
+    def _tags_catalog_valid(self, catalog):
+        """Does the catalog match the repos directory, the entries in it,
+        the mtime of the repository directories and of the image tag
+        directories must be the same
+        """
+        try:
+            if catalog["version"] != self.TAGS_CATALOG_VERSION:
+                return False
+            if catalog["repos"] != sorted([fname for fname in
+                                           os.listdir(self.reposdir)
+                                           if not fname.startswith('.')]):
+                return False
+            for (dir_name, dir_mtime) in catalog["dirs"].items():
+                if os.stat(self.reposdir + dir_name).st_mtime != dir_mtime:
+                    return False
+            for (tag_ref, entry) in catalog["tags"].items():
+                if not self._tags_catalog_entry_valid(
+                        entry, self.reposdir + '/' + tag_ref):
+                    return False
+        except (IOError, OSError, KeyError, TypeError, AttributeError):
+            return False
+        return True
+
+    def _tags_catalog_old(self, catalog):
+        """Entries of a loaded catalog that can be reused by a scan"""
+        try:
+            if catalog["version"] == self.TAGS_CATALOG_VERSION:
+                return dict(catalog["tags"])
+        except (KeyError, TypeError):
+            pass
+        return {}
+
+    def _tags_catalog_load(self, rebuild=False):
+        """Read the catalog from its file, if it does not match the repos
+        directory it is updated by a scan keeping the valid entries,
+        invoked holding its lock
+        """
+        catalog = None
+        if not rebuild:
+            catalog = self.load_json(self.tags_catalog_file)
+        if rebuild or not self._tags_catalog_valid(catalog):
+            catalog = self._tags_catalog_scan(self._tags_catalog_old(catalog))
+            self._index_save(self.tags_catalog_file, catalog)
+        return catalog
+
+    def _tags_catalog(self, rebuild=False):
+        """Get the catalog of image tags, tag: entry with the image
+        repository, tag, version, manifest digest and layers with sizes
+        the catalog is updated if it does not match the repos directory
+        or if rebuild is requested
+        """
+        with self._index_lock:
+            catalog = self._tags_catalog_cache
+            if rebuild or not self._tags_catalog_valid(catalog):
+                with self.lock_index(self.tags_catalog_file):
+                    catalog = self._tags_catalog_load(rebuild)
+                self._tags_catalog_cache = catalog
+        return catalog
+
+    def _tags_catalog_dirs(self, catalog, tag_ref):
+        """Update the repository names and the mtime of the directories
+        above an image tag that was added or removed
+        """
+        try:
+            catalog["repos"] = sorted([fname for fname in
+                                       os.listdir(self.reposdir)
+                                       if not fname.startswith('.')])
+        except (IOError, OSError):
+            catalog["repos"] = []
+        dir_name = ""
+        for part in tag_ref.split('/')[:-1]:
+            dir_name += '/' + part
+            try:
+                catalog["dirs"][dir_name] = \
+                    os.stat(self.reposdir + dir_name).st_mtime
+            except (IOError, OSError):
+                for name in list(catalog["dirs"].keys()):
+                    if name == dir_name or name.startswith(dir_name + '/'):
+                        del catalog["dirs"][name]
+                break
+
+    def _tags_catalog_update(self, tag_dir, **changes):
+        """Update the catalog entry of an image tag after a change in its
+        directory. The changes (version, manifest, or a layer as
+        [name, size]) are applied to the entry of the tag, a new tag
+        gets its entry and a removed tag is dropped. The catalog is read
+        again from its file holding its lock, and is only rebuilt from
+        the repository directories if it is missing or not valid.
+        """
+        tag_ref = tag_dir.replace(self.reposdir + '/', "", 1)
+        with self._index_lock, self.lock_index(self.tags_catalog_file):
+            catalog = self.load_json(self.tags_catalog_file)
+            try:
+                if not (catalog["version"] == self.TAGS_CATALOG_VERSION and
+                        isinstance(catalog["tags"], dict) and
+                        isinstance(catalog["dirs"], dict) and
+                        isinstance(catalog["repos"], list)):
+                    catalog = None
+            except (KeyError, TypeError):
+                catalog = None
+            if catalog is None:
+                catalog = self._tags_catalog_scan()
+            elif self._is_tag(tag_dir):
+                entry = catalog["tags"].get(tag_ref)
+                if isinstance(entry, dict):
+                    layer = changes.pop("layer", None)
+                    if layer:
+                        entry["layers"] = sorted(
+                            [lay for lay in entry.get("layers", [])
+                             if lay[0] != layer[0]] + [list(layer)])
+                    entry.update(changes)
+                    try:
+                        entry["mtime"] = os.stat(tag_dir).st_mtime
+                    except (IOError, OSError):
+                        entry["mtime"] = None
+                else:
+                    entry = self._tags_catalog_entry(tag_ref)
+                    if entry:
+                        catalog["tags"][tag_ref] = entry
+                    self._tags_catalog_dirs(catalog, tag_ref)
+            else:
+                catalog["tags"].pop(tag_ref, None)
+                self._tags_catalog_dirs(catalog, tag_ref)
+            self._tags_catalog_cache = catalog
+            return self._index_save(self.tags_catalog_file, catalog)
+
+    def rebuild_tags_catalog(self):
+        """Rebuild the catalog of image tags from the repos directory"""
+        with self._index_lock:
+            catalog = self._tags_catalog(rebuild=True)
+        return os.path.exists(self.tags_catalog_file) and catalog
+
     def get_imagerepos(self):
         """get all images repositories with tags"""
-        return self._get_tags(self.reposdir)
+        catalog = self._tags_catalog()
+        return sorted([(entry["imagerepo"], entry["tag"])
+                       for entry in catalog["tags"].values()])
 
     def get_layers(self, imagerepo, tag):
         """Get all layers for a given image image tag"""
         layers_list = []
         tag_dir = self.cd_imagerepo(imagerepo, tag)
         if tag_dir:
-            for fname in os.listdir(tag_dir):
-                filename = tag_dir + '/' + fname
-                if os.path.islink(filename):
-                    size = FileUtil(filename).size()
-                    layers_list.append((filename, size))
+            tag_ref = imagerepo + '/' + tag
+            catalog = self._tags_catalog_cache
+            entry = catalog and catalog["tags"].get(tag_ref)
+            if not self._tags_catalog_entry_valid(entry, tag_dir):
+                entry = self._tags_catalog()["tags"].get(tag_ref) or {}
+            for (fname, size) in entry.get("layers", []):
+                layers_list.append((tag_dir + '/' + fname, size))
         return layers_list
 
+    def _layer_alias(self, layer_file, alias):
+        """Link a legacy layer name in the layers directory to a layer
+        stored under its digest
+        """
+        alias_file = self.layersdir + '/' + os.path.basename(alias)
+        if alias_file == layer_file:
+            return True
+        try:
+            if os.path.islink(alias_file) or os.path.exists(alias_file):
+                os.remove(alias_file)
+            os.symlink(os.path.basename(layer_file), alias_file)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def _layer_alias_remove(self, layers):
+        """Remove the legacy name links pointing to removed layers"""
+        try:
+            dir_entries = os.listdir(self.layersdir)
+        except (IOError, OSError):
+            return False
+        for fname in dir_entries:
+            alias_file = self.layersdir + '/' + fname
+            try:
+                if (os.path.islink(alias_file) and
+                        os.path.basename(os.readlink(alias_file)) in layers):
+                    os.remove(alias_file)
+            except (IOError, OSError):
+                continue
+        return True
+
+    def store_layer(self, filename, alias=None, move=True):
+        """Store a layer file in the layers directory named by the
+        sha256 digest of its content, identical layers obtained by
+        pull, load, import or squash are stored only once. With alias
+        a symbolic link with the legacy name points to the stored layer.
+        Returns the pathname of the stored layer or "" on error.
+        """
+        if os.path.islink(filename):
+            stored_file = os.path.realpath(filename)
+            if (os.path.dirname(stored_file) ==
+                    os.path.realpath(self.layersdir) and
+                    os.path.basename(stored_file).startswith("sha256:")):
+                return self.layersdir + '/' + os.path.basename(stored_file)
+        chksum = ChkSUM().sha256(filename)
+        if not chksum:
+            Msg().err("Error: computing layer digest:", filename)
+            return ""
+        layer_file = self.layersdir + "/sha256:" + chksum
+        if filename == layer_file:
+            pass
+        elif os.path.exists(layer_file):
+            if move:
+                try:
+                    os.remove(filename)
+                except (IOError, OSError):
+                    pass
+        else:
+            try:
+                if not move:
+                    raise OSError("copy")
+                os.rename(filename, layer_file)
+            except (IOError, OSError):
+                tmp_file = layer_file + ".%d.tmp" % os.getpid()
+                if not FileUtil(filename).copyto(tmp_file):
+                    Msg().err("Error: storing layer:", filename)
+                    return ""
+                os.rename(tmp_file, layer_file)
+        if alias:
+            self._layer_alias(layer_file, alias)
+        return layer_file
+
     def add_image_layer(self, filename, linkname=None):
         """Add a layer to an image TAG"""
         if not self.cur_tagdir:
@@ -5103,8 +7946,61 @@ class LocalRepository(object):
         if os.path.islink(linkname):
             FileUtil(linkname).remove()
         self._symlink(filename, linkname)
+        self._layers_refs_update(self.cur_tagdir, os.path.basename(filename))
+        self._tags_catalog_update(
+            self.cur_tagdir,
+            layer=[os.path.basename(linkname), FileUtil(linkname).size()])
+        if Config.uncompressed_layers is True:
+            self.uncompress_layer(filename)
         return True
 
+    def _uncompressed_isvalid(self, filename, uncompressed_file):
+        """The uncompressed copy must be newer than the layer"""
+        try:
+            return (os.path.getmtime(uncompressed_file) >=
+                    os.path.getmtime(filename))
+        except (IOError, OSError):
+            return False
+
+    def get_uncompressed_layer(self, filename):
+        """Get the uncompressed copy of a layer file if available,
+        otherwise the layer file itself
+        """
+        uncompressed_file = os.path.realpath(filename) + ".tar"
+        if self._uncompressed_isvalid(filename, uncompressed_file):
+            return uncompressed_file
+        return filename
+
+    def uncompress_layer(self, filename):
+        """Store an uncompressed copy of a compressed layer next to it
+        in the layers directory, the copy is named <layer>.tar and
+        is used in preference to the layer to create containers
+        """
+        filename = os.path.realpath(filename)
+        uncompressed_file = filename + ".tar"
+        if not LayerIndex(filename).get_compression():
+            return False
+        if self._uncompressed_isvalid(filename, uncompressed_file):
+            return True
+        Msg().out("Info: uncompressing layer:", filename, l=Msg.INF)
+        tmp_file = uncompressed_file + ".%d.tmp" % os.getpid()
+        try:
+            with open(tmp_file, "wb") as outfp:
+                status = LayerIndex(filename).uncompress(outfp)
+            if status:
+                os.rename(tmp_file, uncompressed_file)
+                return True
+        except (IOError, OSError):
+            pass
+        FileUtil(tmp_file).remove()
+        Msg().err("Error: uncompressing layer:", filename)
+        return False
+
+    def lock_tag(self, imagerepo, tag):
+        """Lock to serialize the processes updating an image tag"""
+        return FileLock(self.reposdir + "/." + imagerepo.replace('/', '_') +
+                        ':' + tag + ".lock")
+
     def setup_imagerepo(self, imagerepo):
         """Create directory for an image repository"""
         if not imagerepo:
@@ -5130,12 +8026,12 @@ class LocalRepository(object):
             if not os.path.exists(directory):
                 os.makedirs(directory)
             self.cur_tagdir = directory
-            out_tag = open(directory + "/TAG", 'w')
         except (IOError, OSError):
             return False
-        else:
-            out_tag.write(self.cur_repodir + ':' + tag)
-            out_tag.close()
+        if not FileUtil(directory + "/TAG").putdata(
+                self.cur_repodir + ':' + tag, 'w'):
+            return False
+        self._tags_catalog_update(self.cur_tagdir)
         return True
 
     def set_version(self, version):
@@ -5165,6 +8061,7 @@ class LocalRepository(object):
             open(directory + '/' + version, 'a').close()
         except (IOError, OSError):
             return False
+        self._tags_catalog_update(directory, version=version)
         return True
 
     def _get_image_attributes_v1(self, directory):
@@ -5248,15 +8145,28 @@ class LocalRepository(object):
             if not os.path.exists(self.cur_tagdir):
                 return False
             out_filename = self.cur_tagdir + '/' + filename
+        tmp_filename = "%s.%d.%d.tmp" % (out_filename, os.getpid(),
+                                         threading.current_thread().ident)
         outfile = None
         try:
-            outfile = open(out_filename, 'w')
+            outfile = open(tmp_filename, 'w')
             json.dump(data, outfile)
+            outfile.close()
+            os.rename(tmp_filename, out_filename)
         except (IOError, OSError, AttributeError, ValueError, TypeError):
             if outfile:
                 outfile.close()
+                try:
+                    os.remove(tmp_filename)
+                except (IOError, OSError):
+                    pass
             return False
-        outfile.close()
+        if filename == "manifest":
+            self._tags_catalog_update(
+                self.cur_tagdir,
+                manifest="sha256:" + ChkSUM().sha256(out_filename))
+        elif os.path.dirname(out_filename) == self.cur_tagdir:
+            self._tags_catalog_update(self.cur_tagdir)
         return True
 
     def load_json(self, filename):
@@ -5378,12 +8288,20 @@ class LocalRepository(object):
                               os.readlink(layer_f)):
             Msg().err("Error: layer data file not found")
             return False
-        if "gzip" in GuestInfo('/').get_filetype(layer_f):
-            if not FileUtil(layer_f).verify_tar():
-                Msg().err("Error: layer tar verify failed:", layer_f)
-                return False
+        stored_name = os.path.basename(os.path.realpath(layer_f))
+        if not layer_algorithm and stored_name.startswith("sha256:"):
+            (layer_algorithm, layer_hash) = self._split_layer_id(stored_name)
+        (tar_status, layer_f_chksum) = \
+            LayerIndex(layer_f).verify(layer_algorithm or "sha256")
+        if layer_f_chksum:
+            ChkSUM().store(layer_f, layer_algorithm or "sha256",
+                           layer_f_chksum)
+        if tar_status is False:
+            Msg().err("Error: layer tar verify failed:", layer_f)
+            return False
         if layer_algorithm:
-            layer_f_chksum = ChkSUM().hash(layer_f, layer_algorithm)
+            if not layer_f_chksum:
+                layer_f_chksum = ChkSUM().hash(layer_f, layer_algorithm)
             if layer_f_chksum and layer_f_chksum != layer_hash:
                 Msg().err("Error: layer file chksum failed:", layer_f)
                 return False
@@ -5430,8 +8348,31 @@ class LocalRepository(object):
                 continue
         return status
 
-    def verify_image(self):
-        """Verify the structure of an image repository"""
+    def _verify_layer(self, structure, layer_id, verified):
+        """Verify a layer of an image once, the results are kept
+        in verified by layer file for layers shared by other images
+        """
+        if "layer_f" not in structure["repolayers"][layer_id]:
+            Msg().err("Error: layer file not found in structure", layer_id)
+            return False
+        layer_f = structure["repolayers"][layer_id]["layer_f"]
+        stored_file = os.path.realpath(layer_f)
+        if stored_file in verified:
+            return verified[stored_file]
+        layer_status = self._verify_layer_file(structure, layer_id)
+        if layer_status:
+            Msg().out("Info: layer ok:", layer_id, l=Msg.INF)
+        verified[stored_file] = layer_status
+        return layer_status
+
+    def verify_image(self, verified=None):
+        """Verify the structure of an image repository, the layers
+        are verified in parallel, each layer file only once. The dict
+        verified keeps the results of the layers already verified
+        across several images.
+        """
+        if verified is None:
+            verified = dict()
         Msg().out("Info: loading structure", l=Msg.INF)
         structure = self._load_structure(self.cur_tagdir)
         if not structure:
@@ -5446,18 +8387,20 @@ class LocalRepository(object):
                 status = self._verify_image_v2_s1(structure)
             elif "layers" in structure["manifest"]:
                 status = self._verify_image_v2_s2(structure)
-        for layer_id in structure["repolayers"]:
-            if "layer_f" not in structure["repolayers"][layer_id]:
-                Msg().err("Error: layer file not found in structure",
-                          layer_id)
-                status = False
-                continue
-            layer_status = self._verify_layer_file(structure, layer_id)
-            if not layer_status:
-                status = False
-                continue
-            Msg().out("Info: layer ok:", layer_id, l=Msg.INF)
-        return status
+        layer_ids = []
+        layer_files = set()
+        for (layer_id, layer) in structure["repolayers"].items():
+            if "layer_f" in layer:
+                stored_file = os.path.realpath(layer["layer_f"])
+                if stored_file in layer_files:
+                    continue            # same file verified by one worker
+                layer_files.add(stored_file)
+            layer_ids.append(layer_id)
+        layers_status = WorkerPool().map(
+            lambda layer_id: self._verify_layer(structure, layer_id,
+                                                verified),
+            layer_ids)
+        return status and all(layers_status)
 
 
 class CurlHeader(object):
@@ -5854,11 +8797,23 @@ class DockerIoAPI(object):
         self.v2_auth_header = ""
         self.v2_auth_token = ""
         self.localrepo = localrepo
-        self.curl = GetURL()
+        self._curl = None
         self.search_pause = True
         self.search_page = 0
         self.search_ended = False
 
+    @property
+    def curl(self):
+        """GetURL object created when first used"""
+        if self._curl is None:
+            self._curl = GetURL()
+        return self._curl
+
+    @curl.setter
+    def curl(self, curl):
+        """Set the GetURL object"""
+        self._curl = curl
+
     def set_proxy(self, http_proxy):
         """Select a socks http proxy for API access and file download"""
         self.curl.set_proxy(http_proxy)
@@ -5930,8 +8885,14 @@ class DockerIoAPI(object):
         """Get a file and check its size. Optionally enable other
         capabilities such as caching to check if the
         file already exists locally and whether its size is the
-        same to avoid downloaded it again.
+        same to avoid downloaded it again. Other processes getting
+        the same file wait and then find it in the cache.
         """
+        with FileLock(filename + ".lock"):
+            return self._get_file_locked(url, filename, cache_mode)
+
+    def _get_file_locked(self, url, filename, cache_mode):
+        """Get a file, invoked by _get_file() holding its lock"""
         match = re.search("/([^/:]+):(\\S+)$", filename)
         if match:
             layer_f_chksum = ChkSUM().hash(filename, match.group(1))
@@ -5962,6 +8923,11 @@ class DockerIoAPI(object):
             Msg().err("Error: file size mismatch:", filename,
                       remote_size, FileUtil(filename).size())
             return False
+        if match and (ChkSUM().hash(filename, match.group(1)) !=
+                      match.group(2)):
+            Msg().err("Error: file digest mismatch:", filename)
+            FileUtil(filename).remove()
+            return False
         return True
 
     def _split_fields(self, buf):
@@ -6075,8 +9041,10 @@ class DockerIoAPI(object):
         Msg().err("layer url:", url, l=Msg.DBG)
         filename = self.localrepo.layersdir + '/' + layer_id + ".layer"
         if self._get_file(url, filename, 3):
-            self.localrepo.add_image_layer(filename)
-            return True
+            layer_file = self.localrepo.store_layer(filename, filename)
+            if layer_file:
+                self.localrepo.add_image_layer(layer_file, filename)
+                return True
         return False
 
     def get_v1_layers_all(self, endpoint, layer_list):
@@ -6215,10 +9183,23 @@ class DockerIoAPI(object):
             return True
         return False
 
+    def _check_v2_layers(self, fslayers):
+        """Compute the digests of the layers already in the repository
+        concurrently, the digests are cached for the presence checks
+        """
+        layer_files = []
+        for layer in fslayers:
+            blob = layer.get("blobSum", layer.get("digest", ""))
+            layer_f = self.localrepo.layersdir + '/' + blob
+            if blob.startswith("sha256:") and os.path.exists(layer_f):
+                layer_files.append(layer_f)
+        return ChkSUM().hash_many(layer_files, "sha256")
+
     def get_v2_layers_all(self, imagerepo, fslayers):
         """Get all layer data files belonging to a image tag"""
         files = []
         if fslayers:
+            self._check_v2_layers(fslayers)
             for layer in reversed(fslayers):
                 if "blobSum" in layer:
                     blob = layer["blobSum"]
@@ -6363,17 +9344,18 @@ class DockerIoAPI(object):
         """Pull a docker image from a v2 registry or v1 index"""
         Msg().err("get imagerepo: %s tag: %s" % (imagerepo, tag), l=Msg.DBG)
         (imagerepo, remoterepo) = self._parse_imagerepo(imagerepo)
-        if self.localrepo.cd_imagerepo(imagerepo, tag):
-            new_repo = False
-        else:
-            self.localrepo.setup_imagerepo(imagerepo)
-            new_repo = True
-        if self.is_v2():
-            files = self.get_v2(remoterepo, tag)  # try v2
-        else:
-            files = self.get_v1(remoterepo, tag)  # try v1
-        if new_repo and not files:
-            self.localrepo.del_imagerepo(imagerepo, tag, False)
+        with self.localrepo.lock_tag(imagerepo, tag):
+            if self.localrepo.cd_imagerepo(imagerepo, tag):
+                new_repo = False
+            else:
+                self.localrepo.setup_imagerepo(imagerepo)
+                new_repo = True
+            if self.is_v2():
+                files = self.get_v2(remoterepo, tag)  # try v2
+            else:
+                files = self.get_v1(remoterepo, tag)  # try v1
+            if new_repo and not files:
+                self.localrepo.del_imagerepo(imagerepo, tag, False)
         return files
 
     def get_tags(self, imagerepo):
@@ -6461,7 +9443,9 @@ class CommonLocalFileApi(object):
         self._imagerepo = None
 
     def _move_layer_to_v1repo(self, filepath, layer_id, linkname=None):
-        """Copy or rename an image layer file to a v1 repository"""
+        """Copy or rename an image layer file to a v1 repository,
+        layers are stored under their digest and keep the v1 name
+        """
         if filepath.endswith("json"):
             target_file = self.localrepo.layersdir + '/' + layer_id + ".json"
         elif filepath.endswith("layer.tar"):
@@ -6471,6 +9455,13 @@ class CommonLocalFileApi(object):
             target_file = self.localrepo.layersdir + '/' + layer_id + ".layer"
         else:
             return False
+        if target_file.endswith(".layer"):
+            layer_file = self.localrepo.store_layer(filepath, target_file)
+            if not layer_file:
+                return False
+            self.localrepo.add_image_layer(layer_file,
+                                           linkname or target_file)
+            return True
         try:
             os.rename(filepath, target_file)
         except(IOError, OSError):
@@ -6607,18 +9598,14 @@ class CommonLocalFileApi(object):
             Msg().err("Error: setting repository version")
             return False
         layer_id = Unique().layer_v1()
-        layer_file = self.localrepo.layersdir + '/' + layer_id + ".layer"
+        layer_name = layer_id + ".layer"
         json_file = self.localrepo.layersdir + '/' + layer_id + ".json"
-        if move_tarball:
-            try:
-                os.rename(tarfile, layer_file)
-            except(IOError, OSError):
-                pass
-        if not os.path.exists(layer_file):
-            if not FileUtil(tarfile).copyto(layer_file):
-                Msg().err("Error: in move/copy file", tarfile)
-                return False
-        self.localrepo.add_image_layer(layer_file)
+        layer_file = self.localrepo.store_layer(tarfile, layer_name,
+                                                move_tarball)
+        if not layer_file:
+            Msg().err("Error: in move/copy file", tarfile)
+            return False
+        self.localrepo.add_image_layer(layer_file, layer_name)
         self.localrepo.save_json("ancestry", [layer_id])
         container_json = self.create_container_meta(layer_id)
         self.localrepo.save_json(json_file, container_json)
@@ -6688,6 +9675,190 @@ class CommonLocalFileApi(object):
             exec_mode.set_mode(xmode, True)
         return dest_container_id
 
+    def _squash_hidden(self, pathname, whiteouts, opaque, nondirs):
+        """Is pathname removed or replaced by the upper layers"""
+        components = pathname.split('/')
+        for idx in range(1, len(components) + 1):
+            prefix = '/'.join(components[:idx])
+            if prefix in whiteouts:
+                return True
+            if idx < len(components) and (prefix in opaque or
+                                          prefix in nondirs):
+                return True
+        return False
+
+    def _squash_layers(self, layer_files, squashed_file):
+        """Merge the layers of an image into a single tar file. The
+        layers are read from the top to the bottom, the members that
+        are replaced, removed by whiteouts, or hidden by opaque
+        directories in upper layers are not copied. Hard links to
+        replaced files are converted into regular files.
+        """
+        seen = set()
+        whiteouts = set()
+        opaque = set()
+        nondirs = set()
+        outtar = None
+        intar = None
+        try:
+            outtar = tarfile.open(squashed_file, "w",
+                                  format=tarfile.PAX_FORMAT)
+            for layer_file in reversed(layer_files):
+                Msg().out("Info: squashing layer:", layer_file, l=Msg.INF)
+                intar = tarfile.open(
+                    self.localrepo.get_uncompressed_layer(layer_file), "r:*")
+                layer_tarinfo = dict()
+                layer_members = dict()
+                layer_whiteouts = set()
+                layer_opaque = set()
+                for tarinfo in intar:
+                    pathname = LayerIndex.normpath(tarinfo.name)
+                    (dirname, basename) = os.path.split(pathname)
+                    if basename == ".wh..wh..opq":
+                        layer_opaque.add(dirname)
+                        continue
+                    elif basename.startswith(".wh."):
+                        layer_whiteouts.add(os.path.join(dirname,
+                                                         basename[4:]))
+                        continue
+                    layer_tarinfo[pathname] = tarinfo
+                    if (not pathname or pathname in seen or
+                          self._squash_hidden(pathname, whiteouts,
+                                              opaque, nondirs)):
+                        continue
+                    layer_members[pathname] = tarinfo
+                    tarinfo.name = pathname
+                    if tarinfo.islnk():
+                        linkname = LayerIndex.normpath(tarinfo.linkname)
+                        if not (linkname in seen or self._squash_hidden(
+                                linkname, whiteouts, opaque, nondirs)):
+                            tarinfo.linkname = linkname
+                        elif linkname in layer_tarinfo:
+                            target = layer_tarinfo[linkname]
+                            tarinfo.type = target.type
+                            tarinfo.size = target.size
+                            tarinfo.linkname = ""
+                            outtar.addfile(tarinfo, intar.extractfile(target))
+                            continue
+                        else:
+                            continue
+                    if tarinfo.isreg():
+                        outtar.addfile(tarinfo, intar.extractfile(tarinfo))
+                    else:
+                        outtar.addfile(tarinfo)
+                intar.close()
+                intar = None
+                for (pathname, tarinfo) in layer_members.items():
+                    seen.add(pathname)
+                    if not tarinfo.isdir():
+                        nondirs.add(pathname)
+                whiteouts.update(layer_whiteouts)
+                opaque.update(layer_opaque)
+            outtar.close()
+            outtar = None
+        except (tarfile.TarError, IOError, OSError, EOFError, zlib.error,
+                ValueError):
+            Msg().err("Error: squashing layers")
+            return False
+        finally:
+            for tarf in (intar, outtar):
+                if tarf:
+                    try:
+                        tarf.close()
+                    except (tarfile.TarError, IOError, OSError):
+                        pass
+        return True
+
+    def _squash_config(self, container_json, diff_id):
+        """Image config for the squashed image"""
+        config_json = dict(container_json)
+        for key in ("id", "parent", "parent_id", "layer_id"):
+            config_json.pop(key, None)
+        config_json["rootfs"] = {"type": "layers", "diff_ids": [diff_id]}
+        config_json["history"] = [{
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S.000000000Z",
+                                     time.gmtime()),
+            "created_by": "udocker squash",
+        }]
+        if not config_json.get("architecture"):
+            config_json["architecture"] = HostInfo().arch()
+        if not config_json.get("os"):
+            config_json["os"] = HostInfo().osversion()
+        return config_json
+
+    def squash(self, imagerepo, tag, new_imagerepo=None, new_tag=None):
+        """Collapse the layers of an image into a single layer, the
+        result is a v2 image with one layer and a new manifest and
+        config. Without a new image name the image tag is replaced.
+        """
+        if not self.localrepo.cd_imagerepo(imagerepo, tag):
+            Msg().err("Error: image not found:", imagerepo, tag)
+            return False
+        (container_json, layer_files) = \
+            self.localrepo.get_image_attributes()
+        if not (container_json and layer_files):
+            Msg().err("Error: getting image layers or json")
+            return False
+        replace = not (new_imagerepo or new_tag)
+        if replace and len(layer_files) == 1:
+            Msg().out("Info: image has a single layer", l=Msg.INF)
+            return True
+        new_imagerepo = new_imagerepo or imagerepo
+        new_tag = new_tag or tag
+        if not replace and self.localrepo.cd_imagerepo(new_imagerepo,
+                                                       new_tag):
+            Msg().err("Error: repository and tag already exist",
+                      new_imagerepo, new_tag)
+            return False
+        squashed_file = FileUtil("squash").mktmp()
+        if not self._squash_layers(layer_files, squashed_file):
+            FileUtil(squashed_file).remove()
+            return False
+        layer_file = self.localrepo.store_layer(squashed_file)
+        if not layer_file:
+            Msg().err("Error: storing squashed layer")
+            FileUtil(squashed_file).remove()
+            return False
+        layer_digest = os.path.basename(layer_file)
+        config_file = FileUtil("config").mktmp()
+        if not self.localrepo.save_json(
+                config_file, self._squash_config(container_json,
+                                                 layer_digest)):
+            return False
+        config_file = self.localrepo.store_layer(config_file)
+        if not config_file:
+            Msg().err("Error: storing squashed image config")
+            return False
+        manifest = {
+            "schemaVersion": 2,
+            "mediaType":
+                "application/vnd.docker.distribution.manifest.v2+json",
+            "config": {
+                "mediaType": "application/vnd.docker.container.image.v1+json",
+                "size": FileUtil(config_file).size(),
+                "digest": os.path.basename(config_file),
+            },
+            "layers": [{
+                "mediaType": "application/vnd.docker.image.rootfs.diff.tar",
+                "size": FileUtil(layer_file).size(),
+                "digest": layer_digest,
+            }],
+        }
+        if replace and not self.localrepo.del_imagerepo(imagerepo, tag):
+            Msg().err("Error: replacing image:", imagerepo, tag)
+            return False
+        self.localrepo.setup_imagerepo(new_imagerepo)
+        if not (self.localrepo.setup_tag(new_tag) and
+                self.localrepo.set_version("v2")):
+            Msg().err("Error: setting up repository", new_imagerepo, new_tag)
+            return False
+        self.localrepo.add_image_layer(layer_file)
+        self.localrepo.add_image_layer(config_file)
+        self.localrepo.save_json("manifest", manifest)
+        Msg().out("Info: squashed %d layers into:" % len(layer_files),
+                  layer_digest, l=Msg.INF)
+        return True
+
     def _get_imagedir_type(self, tmp_imagedir):
         """Identify type of image from extracted image directory"""
         image_types_list = [(tmp_imagedir + "/oci-layout", "OCI"),
@@ -7573,18 +10744,89 @@ class Udocker(object):
                 imagerepo, tag)
         return False
 
+    def _create_setmode(self, container_ids, xmode):
+        """Auxiliary to create(), sets the execution mode of the new
+        containers in parallel, failed containers are removed and
+        replaced by False
+        """
+        if not xmode:
+            return container_ids
+        results = WorkerPool().map(
+            lambda container_id: container_id and ExecutionMode(
+                self.localrepo, container_id).set_mode(xmode),
+            container_ids)
+        for (container_id, status) in zip(container_ids, results):
+            if container_id and not status:
+                Msg().err("Error: setting execution mode:", container_id)
+                self.localrepo.del_container(container_id, force=True)
+        return [container_id if status else False
+                for (container_id, status) in zip(container_ids, results)]
+
+    def _create_many(self, container_id, count, name_prefix, xmode=None):
+        """Auxiliary to create(), clones the first container count-1
+        times and names the containers <name_prefix>-<n>
+        """
+        container_ids = [container_id]
+        if count > 1:
+            container_ids.extend(ContainerStructure(
+                self.localrepo, container_id).clone_many(count - 1))
+        container_ids = self._create_setmode(container_ids, xmode)
+        status = True
+        for (idx, clone_id) in enumerate(container_ids):
+            if not clone_id:
+                status = False
+                continue
+            Msg().out(clone_id)
+            name = "%s-%d" % (name_prefix, idx + 1)
+            if name_prefix and not self.localrepo.set_container_name(
+                    clone_id, name):
+                Msg().err("Error: invalid container name may already exist "
+                          "or wrong format:", name)
+                status = False
+        if not status:
+            Msg().err("Error: creating containers")
+        return status
+
     def do_create(self, cmdp):
         """
         create: extract image layers and create a container
         create [options]  <repo/image:tag>
         --name=<container-name>    :set or change the name of the container
+        --count=<n>                :create n containers from the image
+        --name-prefix=<prefix>     :name the containers <prefix>-1 to -n
+        --execmode=<mode>          :setup the execution mode on creation
+
+        Examples:
+          create --count=8 --name-prefix=job centos:7
+          create --execmode=F3 --name=mycontainer centos:7
         """
         imagespec = cmdp.get("P1")
         name = cmdp.get("--name=")
+        count = cmdp.get("--count=")
+        name_prefix = cmdp.get("--name-prefix=")
+        xmode = cmdp.get("--execmode=")
         if cmdp.missing_options():               # syntax error
             return False
+        if xmode:
+            xmode = xmode.upper()
+            if xmode not in ExecutionMode.valid_modes:
+                Msg().err("Error: invalid execmode:", xmode)
+                return False
+        if count or name_prefix:
+            try:
+                count = int(count or 1)
+            except ValueError:
+                count = 0
+            if count < 1 or name:
+                Msg().err("Error: --count= requires a positive number and "
+                          "--name-prefix= instead of --name=")
+                return False
         container_id = self._create(imagespec)
+        if container_id and count:
+            return self._create_many(container_id, count, name_prefix, xmode)
         if container_id:
+            if not self._create_setmode([container_id], xmode)[0]:
+                return False
             Msg().out(container_id)
             if name and not self.localrepo.set_container_name(container_id,
                                                               name):
@@ -7782,6 +11024,8 @@ class Udocker(object):
         status = exec_engine.run(container_id)
         if delete and not self.localrepo.isprotected_container(container_id):
             self.localrepo.del_container(container_id)
+        elif container_id:
+            self.localrepo.reset_size(container_id)
         return status
 
     def do_images(self, cmdp):
@@ -7888,9 +11132,19 @@ class Udocker(object):
         rmi: delete an image in the local repository
         rmi [options] <repo/image:tag>
         -f                          :force removal
+        --rebuild-index             :rebuild the layers and tags indexes
         """
         force = cmdp.get("-f")
-        imagespec = str(cmdp.get("P1"))
+        rebuild = cmdp.get("--rebuild-index")
+        imagespec = cmdp.get("P1")
+        if rebuild:
+            if not (self.localrepo.rebuild_layers_refs() and
+                    self.localrepo.rebuild_tags_catalog()):
+                Msg().err("Error: rebuilding the repository indexes")
+                return False
+            if not imagespec:
+                return True
+        imagespec = str(imagespec)
         (imagerepo, tag) = self._check_imagespec(imagespec)
         if cmdp.missing_options():               # syntax error
             return False
@@ -8042,8 +11296,25 @@ class Udocker(object):
     def do_verify(self, cmdp):
         """
         verify: verify an image
-        verify <repo/image:tag>
+        verify [--all] <repo/image:tag>
+        --all                      :verify all images, shared layers once
         """
+        if cmdp.get("--all"):
+            if cmdp.missing_options():               # syntax error
+                return False
+            verified = dict()
+            status = True
+            for (imagerepo, tag) in self.localrepo.get_imagerepos():
+                Msg().out("Info: verifying: %s:%s" % (imagerepo, tag),
+                          l=Msg.INF)
+                if not (self.localrepo.cd_imagerepo(imagerepo, tag) and
+                        self.localrepo.verify_image(verified)):
+                    Msg().err("Error: image verification failure:",
+                              "%s:%s" % (imagerepo, tag))
+                    status = False
+            if status:
+                Msg().out("Info: images Ok", l=Msg.INF)
+            return status
         (imagerepo, tag) = self._check_imagespec(cmdp.get("P1"))
         if (not imagerepo) or cmdp.missing_options():  # syntax error
             return False
@@ -8058,6 +11329,112 @@ class Udocker(object):
         Msg().err("Error: image verification failure")
         return False
 
+    def do_squash(self, cmdp):
+        """
+        squash: merge the layers of an image into a single layer
+        squash <repo/image:tag> [<newtag> | <repo/image:newtag>]
+
+        Without a new tag the image is replaced by the squashed image.
+
+        Examples:
+          squash centos:7 7-squashed
+          squash centos:7 mycentos:7
+        """
+        imagespec = cmdp.get("P1")
+        newspec = cmdp.get("P2")
+        if cmdp.missing_options():               # syntax error
+            return False
+        (imagerepo, tag) = self._check_imagespec(imagespec)
+        if not imagerepo:
+            return False
+        (new_imagerepo, new_tag) = (None, None)
+        if newspec and ':' in newspec:
+            (new_imagerepo, new_tag) = self._check_imagespec(newspec)
+            if not new_imagerepo:
+                return False
+        elif newspec:
+            new_tag = newspec
+        elif self.localrepo.isprotected_imagerepo(imagerepo, tag):
+            Msg().err("Error: image repository is protected")
+            return False
+        if not self.dockerlocalfileapi.squash(imagerepo, tag,
+                                              new_imagerepo, new_tag):
+            Msg().err("Error: squashing image")
+            return False
+        return True
+
+    def do_cat(self, cmdp):
+        """
+        cat: print a file from an image without creating a container
+        cat <repo/image:tag> <pathname>
+
+        Examples:
+          cat centos:7 /etc/os-release
+        """
+        imagespec = cmdp.get("P1")
+        pathname = cmdp.get("P2")
+        if cmdp.missing_options():               # syntax error
+            return False
+        (imagerepo, tag) = self._check_imagespec(imagespec)
+        if not (imagerepo and pathname):
+            Msg().err("Error: must specify image:tag and pathname")
+            return False
+        image_index = ImageIndex(self.localrepo)
+        if not image_index.select(imagerepo, tag):
+            Msg().err("Error: image not found or invalid:", imagespec)
+            return False
+        sys.stdout.flush()
+        outfp = getattr(sys.stdout, "buffer", sys.stdout)
+        if not image_index.copyto(pathname, outfp):
+            Msg().err("Error: file not found in image:", pathname)
+            return False
+        outfp.flush()
+        return True
+
+    def do_gc(self, cmdp):
+        """
+        gc: remove unreferenced layers, temporary files and containers
+        left by interrupted operations and report the space reclaimed
+        gc [options]
+        --dry-run                  :only report, do not remove
+        --grace=<seconds>          :ignore files newer than (default 3600)
+        """
+        dry_run = cmdp.get("--dry-run")
+        grace = cmdp.get("--grace=")
+        if cmdp.missing_options():               # syntax error
+            return False
+        try:
+            grace = int(grace) if grace else None
+        except ValueError:
+            Msg().err("Error: invalid grace time:", grace)
+            return False
+        garbage = self.localrepo.gc_garbage(grace)
+        if garbage is None:
+            Msg().err("Error: reading the repository")
+            return False
+        items = []
+        total = 0
+        Msg().out("%-12s %8s %10s" % ("CATEGORY", "ITEMS", "SIZE(MB)"))
+        for category in ("layers", "tmp", "containers", "names"):
+            size = sum([max(item_size, 0) for (dummy, item_size)
+                        in garbage[category]])
+            total += size
+            Msg().out("%-12s %8d %10d" % (category, len(garbage[category]),
+                                          size / (1024 * 1024)))
+            for (pathname, dummy) in garbage[category]:
+                Msg().out("Info: garbage:", pathname, l=Msg.INF)
+                items.append((category, pathname))
+        Msg().out("%-12s %8d %10d" % ("total", len(items),
+                                      total / (1024 * 1024)))
+        if dry_run or not items:
+            return True
+        status = WorkerPool().map(
+            lambda item: self.localrepo.gc_remove(item[0], item[1]), items)
+        if not all(status):
+            Msg().err("Error: removing garbage")
+            return False
+        return True
+
     def do_setup(self, cmdp):
         """
         setup: change container execution settings
@@ -8112,6 +11489,8 @@ class Udocker(object):
         if nvidia:
             nvidia_mode.set_mode(force)
         exec_mode = ExecutionMode(self.localrepo, container_id)
+        if xmode or nvidia or purge or fixperm:
+            self.localrepo.reset_size(container_id)
         if xmode:
             return exec_mode.set_mode(xmode.upper(), force)
         if xmode or not (xmode or force or nvidia or purge or fixperm):
@@ -8169,6 +11548,10 @@ class Udocker(object):
 
           inspect -p <repo/image:tag>   :Return low level information on image
           verify <repo/image:tag>       :Verify a pulled image
+          verify --all                  :Verify all images
+          squash <repo/image:tag>       :Merge the image layers into one
+          cat <repo/image:tag> <file>   :Print a file from an image
+          gc --dry-run                  :Remove unreferenced files and report
 
           protect <repo/image:tag>      :Protect repository
           unprotect <repo/image:tag>    :Unprotect repository
@@ -8448,7 +11831,6 @@ class Main(object):
     """Get options, parse and execute the command line"""
 
     def __init__(self):
-        HostInfo()
         self.cmdp = CmdParser()
         parseok = self.cmdp.parse(sys.argv)
         if not parseok and not (self.cmdp.get("--version", "GEN_OPT") or
@@ -8502,6 +11884,8 @@ class Main(object):
             "unprotect": self.udocker.do_unprotect, "ps": self.udocker.do_ps,
             "inspect": self.udocker.do_inspect, "login": self.udocker.do_login,
             "setup":self.udocker.do_setup, "install":self.udocker.do_install,
+            "cat": self.udocker.do_cat, "squash": self.udocker.do_squash,
+            "gc": self.udocker.do_gc,
         }
         if (self.cmdp.get("--help", "GEN_OPT") or
                 self.cmdp.get("-h", "GEN_OPT")):